@@ -0,0 +1,75 @@
+"""
+Benchmark of the JSON decoders available to :func:`github_webhook.decoders.get_decoder`, on
+realistic push, pull_request and workflow_run payloads. Backends that are not installed are
+skipped. Run it with the package installed (``pip install -e .``)::
+
+    python benchmarks/bench_decoders.py [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import payloads  # noqa: E402
+from github_webhook.decoders import DECODERS, get_decoder  # noqa: E402
+
+CASES = [
+    ("push (3 commits)", lambda: payloads.push(commits=3)),
+    ("push (1MB)", lambda: payloads.sized_push(1 << 20)),
+    ("push (20MB)", lambda: payloads.sized_push(20 << 20)),
+    ("pull_request", payloads.pull_request),
+    ("pull_request (64KB body)", lambda: payloads.pull_request(body_size=64 << 10)),
+    ("workflow_run", payloads.workflow_run),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions, the best is kept")
+    args = parser.parse_args()
+
+    decoders = []
+    for name, _ in DECODERS:
+        try:
+            decoders.append((name, get_decoder(name)))
+        except ImportError:
+            print("skipping {0}: not installed".format(name))
+
+    print("{0:<26} {1:>10}".format("payload", "size") + "".join(" {0:>10}".format(n) for n, _ in decoders))
+    for label, make in CASES:
+        # Bodies arrive as a memoryview of the request buffer
+        body = memoryview(bytearray(json.dumps(make()).encode("utf-8")))
+        number = max(1, (8 << 20) // len(body))
+        timings = []
+        for _, decode in decoders:
+            best = min(timeit.repeat(lambda: decode(body), number=number, repeat=args.repeat))
+            timings.append(1e6 * best / number)
+        row = "{0:<26} {1:>10}".format(label, len(body))
+        print(row + "".join(" {0:>8.0f}us".format(t) for t in timings))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,80 @@
+"""
+Benchmark of finding the hooks of a pull_request delivery, with filters checked by every hook
+versus indexed by :class:`github_webhook.routing.Router`, as the number of hooks grows. Run it
+with the package installed (``pip install -e .``)::
+
+    python benchmarks/bench_routing.py [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import payloads  # noqa: E402
+from github_webhook.routing import Router  # noqa: E402
+
+ACTIONS = ["opened", "closed", "synchronize", "labeled", "edited"]
+
+
+def _filtering_hook(action, repo):
+    def hook(data):
+        if data["action"] != action or data["repository"]["full_name"] != repo:
+            return
+        return data
+
+    return hook
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions, the best is kept")
+    args = parser.parse_args()
+
+    data = payloads.pull_request("org/repo-0", action="opened")
+    number = 2000
+
+    print("{0:>8} {1:>12} {2:>12}".format("hooks", "filtering", "indexed"))
+    for count in [10, 100, 1000, 10000]:
+        hooks = []
+        router = Router()
+        for i in range(count):
+            action, repo = ACTIONS[i % len(ACTIONS)], "org/repo-{0}".format(i // len(ACTIONS))
+            hooks.append(_filtering_hook(action, repo))
+            router.add("pull_request", lambda data: data, action=action, repository=repo)
+
+        def filtering():
+            for hook in hooks:
+                hook(data)
+
+        def indexed():
+            for hook in router.match("pull_request", data):
+                hook(data)
+
+        timings = [min(timeit.repeat(run, number=number, repeat=args.repeat)) for run in (filtering, indexed)]
+        print("{0:>8}".format(count) + "".join(" {0:>10.2f}us".format(1e6 * t / number) for t in timings))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
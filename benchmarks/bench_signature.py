@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of delivery signature verification.
+
+Compares re-hashing the whole body once per secret and algorithm with the single pass made by
+:class:`github_webhook.signature.Verifier`, for payloads from 1KB up to Github's 25MB limit. Run it
+with the package installed (``pip install -e .``)::
+
+    python benchmarks/bench_signature.py [--secrets N] [--repeat N]
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import hmac
+import io
+import os
+import timeit
+
+from github_webhook.body import BodyReader
+from github_webhook.signature import Verifier
+
+SIZES = [1 << 10, 64 << 10, 1 << 20, 5 << 20, 25 << 20]
+
+
+def _per_secret(secrets, body, headers):
+    """Every candidate digest computed separately over the whole body"""
+
+    expected = headers["x-hub-signature-256"].split("=", 1)[1]
+    digests = [
+        hmac.new(secret, body, algorithm).hexdigest()
+        for secret in secrets
+        for algorithm in (hashlib.sha1, hashlib.sha256)
+    ]
+    return any(hmac.compare_digest(expected, digest) for digest in digests)
+
+
+def _single_pass(verifier, body, headers):
+    """The selected digests fed chunk by chunk while the body is read into its buffer"""
+
+    reader = BodyReader(verifier.signature(headers), content_length=len(body))
+    reader.read_from(io.BytesIO(body))
+    return reader.signature.verify()
+
+
+def _label(size):
+    return "{0}MB".format(size >> 20) if size >= 1 << 20 else "{0}KB".format(size >> 10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--secrets", type=int, default=2, help="number of active secrets")
+    parser.add_argument("--repeat", type=int, default=5, help="timing repetitions, the best is kept")
+    args = parser.parse_args()
+
+    secrets = [os.urandom(20) for _ in range(args.secrets)]
+    verifier = Verifier(secrets)
+
+    print("{0:>6} {1:>14} {2:>14} {3:>10}".format("size", "per-secret ms", "single-pass ms", "MB/s"))
+    for size in SIZES:
+        body = os.urandom(size)
+        headers = {"x-hub-signature-256": "sha256=" + hmac.new(secrets[-1], body, hashlib.sha256).hexdigest()}
+        assert _per_secret(secrets, body, headers) and _single_pass(verifier, body, headers)
+
+        number = max(1, (4 << 20) // size)
+        naive = min(timeit.repeat(lambda: _per_secret(secrets, body, headers), number=number, repeat=args.repeat))
+        fast = min(timeit.repeat(lambda: _single_pass(verifier, body, headers), number=number, repeat=args.repeat))
+        print(
+            "{0:>6} {1:>14.3f} {2:>14.3f} {3:>10.0f}".format(
+                _label(size), 1000 * naive / number, 1000 * fast / number, size * number / fast / (1 << 20)
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,266 @@
+"""
+Load test of the request path: signature verification, JSON and form parsing, and dispatch to
+hooks, driven through the raw core, the Flask test client or a real WSGI server. Reports requests
+per second and p50/p99 latencies, and compares them against a saved baseline. Run it with the
+package installed (``pip install -e .``)::
+
+    python benchmarks/loadtest.py --save baseline.json
+    python benchmarks/loadtest.py --compare baseline.json [--tolerance 0.25]
+
+The comparison exits with status 1 when a result is slower than the baseline by more than the
+tolerance, so that it can gate a CI job running on dedicated hardware.
+"""
+
+from __future__ import print_function
+
+import argparse
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import payloads  # noqa: E402
+from github_webhook.core import WebhookCore  # noqa: E402
+
+_clock = getattr(time, "perf_counter", time.time)
+
+SECRET = b"load-test-secret"
+
+#: Whether each scenario signs deliveries, form-encodes them, and registers hooks
+SCENARIOS = {
+    "signature": {"secret": True, "form": False, "hooks": False},
+    "json": {"secret": False, "form": False, "hooks": False},
+    "form": {"secret": False, "form": True, "hooks": False},
+    "dispatch": {"secret": False, "form": False, "hooks": True},
+}
+
+
+def deliveries(count, size=None, secret=False, form=False):
+    """Return :code:`count` (headers, body) pairs, of mixed event types or pushes of :code:`size` bytes"""
+
+    if size is not None:
+        events = [("push", payloads.sized_push(size)) for _ in range(count)]
+    else:
+        events = list(payloads.corpus(count))
+
+    result = []
+    for i, (event, payload) in enumerate(events):
+        document = json.dumps(payload)
+        headers = {"X-Github-Event": event, "X-Github-Delivery": "load-{0}".format(i)}
+        if form:
+            body = urlencode({"payload": document}).encode("ascii")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        else:
+            body = document.encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        if secret:
+            headers["X-Hub-Signature-256"] = "sha256=" + hmac.new(SECRET, body, hashlib.sha256).hexdigest()
+        result.append((headers, body))
+    return result
+
+
+def _configure(webhook, hooks):
+    def hook(data):
+        pass
+
+    for event in payloads.EVENTS:
+        for _ in range(hooks):
+            webhook.hook(event)(hook)
+    return webhook
+
+
+def _run_core(scenario, requests, count, concurrency, hooks):
+    core = _configure(WebhookCore(secret=SECRET if scenario["secret"] else None), hooks)
+
+    def send(headers, body):
+        core.handle(headers, body)
+
+    return _drive(send, requests, count, concurrency)
+
+
+def _flask_app(scenario, hooks):
+    from flask import Flask
+
+    from github_webhook import Webhook
+
+    app = Flask(__name__)
+    _configure(Webhook(app, secret=SECRET if scenario["secret"] else None), hooks)
+    return app
+
+
+def _run_flask(scenario, requests, count, concurrency, hooks):
+    client = _flask_app(scenario, hooks).test_client()
+
+    def send(headers, body):
+        response = client.post("/postreceive", data=body, headers=headers)
+        if response.status_code >= 300:
+            raise RuntimeError("Unexpected response: {0}".format(response.status))
+
+    return _drive(send, requests, count, concurrency)
+
+
+def _run_wsgi(scenario, requests, count, concurrency, hooks):
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # one line per request otherwise
+    server = make_server("127.0.0.1", 0, _flask_app(scenario, hooks), threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    def send(headers, body):
+        connection = http_client.HTTPConnection("127.0.0.1", server.server_port, timeout=30)
+        try:
+            connection.request("POST", "/postreceive", body, headers)
+            response = connection.getresponse()
+            response.read()
+        finally:
+            connection.close()
+        if response.status >= 300:
+            raise RuntimeError("Unexpected response: {0} {1}".format(response.status, response.reason))
+
+    try:
+        return _drive(send, requests, count, concurrency)
+    finally:
+        server.shutdown()
+
+
+#: Functions running a scenario through each driver
+DRIVERS = {"core": _run_core, "flask": _run_flask, "wsgi": _run_wsgi}
+
+
+def _drive(send, requests, count, concurrency):
+    """Send :code:`count` requests from :code:`concurrency` threads; return latencies and elapsed time"""
+
+    for headers, body in requests[: max(1, len(requests) // 10)]:  # warm up
+        send(headers, body)
+
+    latencies = []
+    errors = []
+
+    def worker(offset):
+        measured = []
+        try:
+            for i in range(offset, count, concurrency):
+                headers, body = requests[i % len(requests)]
+                start = _clock()
+                send(headers, body)
+                measured.append(_clock() - start)
+        except Exception as e:
+            errors.append(e)
+        latencies.extend(measured)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start = _clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = _clock() - start
+
+    if errors:
+        raise errors[0]
+    return latencies, elapsed
+
+
+def summarize(latencies, elapsed):
+    """Return the requests per second and the p50 and p99 latencies in milliseconds"""
+
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return 1000 * latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    return {"rps": len(latencies) / elapsed, "p50_ms": percentile(0.50), "p99_ms": percentile(0.99)}
+
+
+def regressions(results, baseline, tolerance):
+    """Return a description of each result worse than its baseline by more than :code:`tolerance`"""
+
+    found = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            found.append("{0}: {1:.0f} requests/s, down from {2:.0f}".format(name, result["rps"], base["rps"]))
+        if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            found.append("{0}: p99 of {1:.3f}ms, up from {2:.3f}ms".format(name, result["p99_ms"], base["p99_ms"]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--driver", nargs="+", choices=sorted(DRIVERS), default=sorted(DRIVERS))
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000, help="requests per scenario and driver")
+    parser.add_argument("--concurrency", type=int, default=1, help="number of client threads")
+    parser.add_argument("--hooks", type=int, default=10, help="hooks per event type, for the dispatch scenario")
+    parser.add_argument("--size", type=int, help="send pushes of about this many bytes, instead of mixed events")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results against a saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="slowdown tolerated by --compare")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+
+    results = {}
+    print("{0:<20} {1:>10} {2:>9} {3:>9} {4:>9}".format("scenario", "req/s", "p50 ms", "p99 ms", "vs base"))
+    for scenario_name in args.scenario:
+        scenario = SCENARIOS[scenario_name]
+        requests = deliveries(min(args.requests, 200), args.size, scenario["secret"], scenario["form"])
+        hooks = args.hooks if scenario["hooks"] else 0
+        for driver in args.driver:
+            name = "{0}/{1}".format(driver, scenario_name)
+            result = results[name] = summarize(
+                *DRIVERS[driver](scenario, requests, args.requests, args.concurrency, hooks)
+            )
+            base = baseline.get(name)
+            change = "{0:+.0%}".format(result["rps"] / base["rps"] - 1) if base else ""
+            print(
+                "{0:<20} {1:>10.0f} {2:>9.3f} {3:>9.3f} {4:>9}".format(
+                    name, result["rps"], result["p50_ms"], result["p99_ms"], change
+                )
+            )
+
+    if args.save:
+        with open(args.save, "w") as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+
+    found = regressions(results, baseline, args.tolerance)
+    for regression in found:
+        print("REGRESSION " + regression)
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
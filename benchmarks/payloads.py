@@ -0,0 +1,286 @@
+"""Synthetic Github deliveries, shaped like the real thing, for benchmarks and load tests."""
+
+import hashlib
+import itertools
+import json
+import random
+
+_counter = itertools.count(1)
+
+
+def _sha(seed):
+    return hashlib.sha1(str(seed).encode("utf-8")).hexdigest()
+
+
+def user(login="octocat"):
+    uid = int(_sha(login)[:6], 16)
+    url = "https://api.github.com/users/" + login
+    return {
+        "login": login,
+        "id": uid,
+        "node_id": "MDQ6VXNlcj" + str(uid),
+        "avatar_url": "https://avatars.githubusercontent.com/u/{0}?v=4".format(uid),
+        "gravatar_id": "",
+        "url": url,
+        "html_url": "https://github.com/" + login,
+        "followers_url": url + "/followers",
+        "following_url": url + "/following{/other_user}",
+        "gists_url": url + "/gists{/gist_id}",
+        "starred_url": url + "/starred{/owner}{/repo}",
+        "subscriptions_url": url + "/subscriptions",
+        "organizations_url": url + "/orgs",
+        "repos_url": url + "/repos",
+        "events_url": url + "/events{/privacy}",
+        "received_events_url": url + "/received_events",
+        "type": "User",
+        "site_admin": False,
+    }
+
+
+def repository(full_name="bloomberg/python-github-webhook"):
+    owner, name = full_name.split("/")
+    url = "https://api.github.com/repos/" + full_name
+    repo = {
+        "id": int(_sha(full_name)[:7], 16),
+        "node_id": "MDEwOlJlcG9zaXRvcnk" + name,
+        "name": name,
+        "full_name": full_name,
+        "private": False,
+        "owner": user(owner),
+        "html_url": "https://github.com/" + full_name,
+        "description": "Very simple, but powerful, microframework for writing Github webhooks in Python",
+        "fork": False,
+        "url": url,
+        "created_at": 1457000000,
+        "updated_at": "2020-03-06T11:18:46Z",
+        "pushed_at": 1583493526,
+        "git_url": "git://github.com/{0}.git".format(full_name),
+        "ssh_url": "git@github.com:{0}.git".format(full_name),
+        "clone_url": "https://github.com/{0}.git".format(full_name),
+        "homepage": None,
+        "size": 61,
+        "stargazers_count": 204,
+        "watchers_count": 204,
+        "language": "Python",
+        "has_issues": True,
+        "has_projects": True,
+        "has_downloads": True,
+        "has_wiki": True,
+        "has_pages": False,
+        "forks_count": 71,
+        "archived": False,
+        "disabled": False,
+        "open_issues_count": 4,
+        "license": {"key": "apache-2.0", "name": "Apache License 2.0", "spdx_id": "Apache-2.0"},
+        "forks": 71,
+        "open_issues": 4,
+        "watchers": 204,
+        "default_branch": "master",
+    }
+    for rel in [
+        "forks",
+        "keys",
+        "collaborators",
+        "teams",
+        "hooks",
+        "issue_events",
+        "events",
+        "assignees",
+        "branches",
+        "tags",
+        "blobs",
+        "git_tags",
+        "git_refs",
+        "trees",
+        "statuses",
+        "languages",
+        "stargazers",
+        "contributors",
+        "subscribers",
+        "subscription",
+        "commits",
+        "git_commits",
+        "comments",
+        "issue_comment",
+        "contents",
+        "compare",
+        "merges",
+        "archive",
+        "downloads",
+        "issues",
+        "pulls",
+        "milestones",
+        "notifications",
+        "labels",
+        "releases",
+        "deployments",
+    ]:
+        repo[rel + "_url"] = "{0}/{1}".format(url, rel)
+    return repo
+
+
+def commit(repo, author="octocat", files=5):
+    sha = _sha(next(_counter))
+    person = {"name": author.title(), "email": author + "@example.com", "username": author}
+    return {
+        "id": sha,
+        "tree_id": _sha(sha),
+        "distinct": True,
+        "message": "Fix the thing that was broken\n\n" + "Longer explanation of the change. " * 4,
+        "timestamp": "2020-03-06T11:18:46Z",
+        "url": "https://github.com/{0}/commit/{1}".format(repo, sha),
+        "author": person,
+        "committer": person,
+        "added": ["src/new_{0}.py".format(i) for i in range(files // 3)],
+        "removed": [],
+        "modified": ["src/module_{0}.py".format(i) for i in range(files - files // 3)],
+    }
+
+
+def push(repo="bloomberg/python-github-webhook", commits=3, ref="refs/heads/master"):
+    """A push of :code:`commits` commits"""
+
+    all_commits = [commit(repo) for _ in range(commits)]
+    return {
+        "ref": ref,
+        "before": _sha("before"),
+        "after": all_commits[-1]["id"] if all_commits else _sha("after"),
+        "created": False,
+        "deleted": False,
+        "forced": False,
+        "base_ref": None,
+        "compare": "https://github.com/{0}/compare/a...b".format(repo),
+        "commits": all_commits,
+        "head_commit": all_commits[-1] if all_commits else None,
+        "repository": repository(repo),
+        "pusher": {"name": "octocat", "email": "octocat@example.com"},
+        "sender": user(),
+    }
+
+
+def _branch(repo, ref, number):
+    return {
+        "label": "octocat:" + ref,
+        "ref": ref,
+        "sha": _sha(ref + str(number)),
+        "user": user(),
+        "repo": repository(repo),
+    }
+
+
+def pull_request(repo="bloomberg/python-github-webhook", action="opened", number=None, body_size=2000):
+    """A pull request event; :code:`body_size` is the length of the description"""
+
+    number = number or next(_counter)
+    url = "https://api.github.com/repos/{0}/pulls/{1}".format(repo, number)
+    return {
+        "action": action,
+        "number": number,
+        "pull_request": {
+            "url": url,
+            "id": number * 1000,
+            "html_url": "https://github.com/{0}/pull/{1}".format(repo, number),
+            "diff_url": "https://github.com/{0}/pull/{1}.diff".format(repo, number),
+            "number": number,
+            "state": "open",
+            "locked": False,
+            "title": "Add a feature that does something useful",
+            "user": user(),
+            "body": ("Description of the change. " * (body_size // 27 + 1))[:body_size],
+            "created_at": "2020-03-06T11:18:46Z",
+            "updated_at": "2020-03-06T11:18:46Z",
+            "merge_commit_sha": None,
+            "assignees": [user("hubot")],
+            "requested_reviewers": [user("monalisa")],
+            "labels": [{"id": 1, "name": "enhancement", "color": "a2eeef", "default": True}],
+            "head": _branch(repo, "feature", number),
+            "base": _branch(repo, "master", number),
+            "author_association": "CONTRIBUTOR",
+            "draft": False,
+            "merged": False,
+            "mergeable": None,
+            "comments": 0,
+            "review_comments": 0,
+            "commits": 3,
+            "additions": 120,
+            "deletions": 14,
+            "changed_files": 5,
+        },
+        "repository": repository(repo),
+        "sender": user(),
+    }
+
+
+def workflow_run(repo="bloomberg/python-github-webhook", action="completed", conclusion="success"):
+    """A workflow_run event"""
+
+    run_id = next(_counter)
+    head = commit(repo)
+    return {
+        "action": action,
+        "workflow_run": {
+            "id": run_id,
+            "name": "CI",
+            "node_id": "WFR_" + str(run_id),
+            "head_branch": "master",
+            "head_sha": head["id"],
+            "run_number": run_id % 1000,
+            "event": "push",
+            "status": "completed" if action == "completed" else "in_progress",
+            "conclusion": conclusion if action == "completed" else None,
+            "workflow_id": 161335,
+            "url": "https://api.github.com/repos/{0}/actions/runs/{1}".format(repo, run_id),
+            "html_url": "https://github.com/{0}/actions/runs/{1}".format(repo, run_id),
+            "pull_requests": [],
+            "created_at": "2020-03-06T11:18:46Z",
+            "updated_at": "2020-03-06T11:20:46Z",
+            "run_attempt": 1,
+            "actor": user(),
+            "head_commit": head,
+            "repository": repository(repo),
+            "head_repository": repository(repo),
+        },
+        "workflow": {"id": 161335, "name": "CI", "path": ".github/workflows/ci.yml", "state": "active"},
+        "repository": repository(repo),
+        "sender": user(),
+    }
+
+
+#: Generators by event type
+EVENTS = {"push": push, "pull_request": pull_request, "workflow_run": workflow_run}
+
+
+def sized_push(size, repo="bloomberg/python-github-webhook"):
+    """A push payload whose JSON encoding is roughly :code:`size` bytes"""
+
+    per_commit = len(json.dumps(commit(repo)))
+    return push(repo, commits=max(1, size // per_commit))
+
+
+def corpus(count, events=("push", "pull_request", "workflow_run"), repos=16, seed=0):
+    """
+    Yield :code:`count` (event type, payload) pairs, spread over :code:`repos` repositories.
+    """
+
+    rng = random.Random(seed)
+    names = ["org/repo-{0}".format(i) for i in range(repos)]
+    for _ in range(count):
+        event = rng.choice(events)
+        yield event, EVENTS[event](repo=rng.choice(names))
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,197 @@
+"""Rate limits and load shedding, deciding from their headers which deliveries to refuse."""
+
+import collections
+import threading
+import time
+
+from github_webhook.cache import LRUCache
+from github_webhook.descriptions import EVENT_DESCRIPTIONS
+
+_clock = getattr(time, "monotonic", time.time)
+
+HIGH = "high"
+NORMAL = "normal"
+LOW = "low"
+
+#: Label counting the deliveries of event types admission control does not know about
+OTHER = "other"
+
+#: Priority class of event types; the others are :data:`NORMAL`
+PRIORITIES = {
+    "check_run": HIGH,
+    "check_suite": HIGH,
+    "deployment": HIGH,
+    "deployment_status": HIGH,
+    "pull_request": HIGH,
+    "push": HIGH,
+    "status": HIGH,
+    "fork": LOW,
+    "gollum": LOW,
+    "page_build": LOW,
+    "public": LOW,
+    "sponsorship": LOW,
+    "star": LOW,
+    "watch": LOW,
+}
+
+#: Share of a shared bucket each priority class leaves to the classes above it
+RESERVES = {HIGH: 0.0, NORMAL: 0.25, LOW: 0.5}
+
+
+class TokenBucket(object):
+    """
+    Allow :code:`rate` events per second on average, and bursts of up to :code:`burst` of them.
+
+    :param rate: Number of tokens added per second
+    :param burst: Maximum number of tokens held, at least one; :code:`rate`, or one, by default
+    """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise ValueError("The rate of a token bucket must be positive")
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        if self.burst < 1:
+            raise ValueError("The burst of a token bucket must be at least one")
+        self._tokens = self.burst
+        self._updated = _clock()
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self):
+        """Number of tokens currently held"""
+
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def take(self, reserve=0.0):
+        """
+        Take a token, unless that would leave fewer than :code:`reserve` times the burst size. The
+        reserve never exceeds the burst size less one, so that a full bucket always gives a token.
+
+        :return: whether a token was taken
+        """
+
+        with self._lock:
+            self._refill()
+            if self._tokens - 1 < min(reserve * self.burst, self.burst - 1):
+                return False
+            self._tokens -= 1
+            return True
+
+    def _refill(self):
+        now = _clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class AdmissionControl(object):
+    """
+    Refuse deliveries arriving faster than allowed, with ``429 Too Many Requests``, so that a flood
+    of them, such as a backlog GitHub redelivers after an outage, does not slow every delivery
+    down. The overall and per event type limits are checked from the headers alone, before the
+    body is read; the per repository limit once the payload is parsed.
+
+    Deliveries share the overall bucket by priority class: those of :data:`NORMAL` priority are
+    refused once it is a quarter empty, and those of :data:`LOW` priority once it is half empty,
+    so that :data:`HIGH` priority events, such as ``push`` and ``deployment``, keep getting
+    through while the others are shed. A full bucket always admits a delivery, whatever its class.
+
+    Limits are given as a number of deliveries per second, or a ``(rate, burst)`` tuple.
+
+    :param rate: Optional overall limit
+    :param event_rates: Optional dict of event types to their limit
+    :param repository_rate: Optional limit of each repository, by ``repository.full_name``
+    :param priorities: Optional dict of event types to their priority class, taking precedence
+                       over :data:`PRIORITIES`
+    :param max_repositories: Number of repositories whose bucket is kept
+    """
+
+    def __init__(self, rate=None, event_rates=None, repository_rate=None, priorities=None, max_repositories=10000):
+        self.priorities = dict(PRIORITIES, **(priorities or {}))
+        self._bucket = _bucket(rate) if rate is not None else None
+        self._event_buckets = dict((event, _bucket(limit)) for event, limit in (event_rates or {}).items())
+        self._repository_rate = repository_rate
+        self._repository_buckets = LRUCache(max_repositories) if repository_rate is not None else None
+        self._lock = threading.Lock()
+        self._shed = collections.Counter()
+
+    @property
+    def shed(self):
+        """Dict of the number of deliveries refused, by ``(event type, reason)``"""
+
+        with self._lock:
+            return dict(self._shed)
+
+    def label(self, event_type):
+        """
+        Label :code:`event_type` is counted under when its deliveries are refused. The header it
+        comes from is checked before the delivery is authenticated, so event types neither GitHub
+        documents nor admission control is configured with are all counted as :data:`OTHER`.
+        """
+
+        if event_type in EVENT_DESCRIPTIONS or event_type in self.priorities or event_type in self._event_buckets:
+            return event_type
+        return OTHER
+
+    def admit(self, event_type):
+        """
+        Take a token for a delivery of :code:`event_type`, from the overall and event type buckets.
+
+        :return: None if the delivery is admitted, or the reason it is refused: ``"overload"``
+                 or ``"event"``
+        """
+
+        if self._bucket is not None:
+            if not self._bucket.take(RESERVES[self.priorities.get(event_type, NORMAL)]):
+                return self._refuse(event_type, "overload")
+        bucket = self._event_buckets.get(event_type)
+        if bucket is not None and not bucket.take():
+            return self._refuse(event_type, "event")
+        return None
+
+    def admit_repository(self, event_type, repository):
+        """
+        Take a token for a delivery of :code:`event_type` from the bucket of :code:`repository`,
+        leaving a reserve for the higher priority classes.
+
+        :return: None if the delivery is admitted, or ``"repository"`` if it is refused
+        """
+
+        if self._repository_buckets is None or repository is None:
+            return None
+        bucket = self._repository_buckets.get(repository)
+        if bucket is None:
+            bucket = _bucket(self._repository_rate)
+            if not self._repository_buckets.add(repository, bucket):  # another thread was first
+                bucket = self._repository_buckets.get(repository, bucket)
+        if not bucket.take(RESERVES[self.priorities.get(event_type, NORMAL)]):
+            return self._refuse(event_type, "repository")
+        return None
+
+    def _refuse(self, event_type, reason):
+        with self._lock:
+            self._shed[self.label(event_type), reason] += 1
+        return reason
+
+
+def _bucket(limit):
+    return TokenBucket(*limit) if isinstance(limit, tuple) else TokenBucket(limit)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
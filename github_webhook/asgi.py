@@ -0,0 +1,287 @@
+"""ASGI front-end for :class:`~github_webhook.core.WebhookCore`, with support for coroutine hooks."""
+
+import asyncio
+import functools
+import logging
+import threading
+
+from github_webhook.body import PayloadTooLarge
+from github_webhook.core import (
+    DUPLICATE,
+    UNHANDLED,
+    WebhookCore,
+    WebhookError,
+    _endpoint_tenant,
+    _journal_complete,
+    _synchronous,
+    is_coroutine_hook,
+)
+from github_webhook.dispatch import QueueFull
+from github_webhook.metrics import _clock, hook_name
+
+# the loop running the current coroutine; Python 3.7 added the stricter get_running_loop
+_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+
+class AsgiWebhook(WebhookCore):
+    """
+    Construct a webhook that is itself an ASGI application, suitable for serving with uvicorn,
+    hypercorn or any other ASGI server.
+
+    Coroutine hooks are awaited concurrently with :func:`asyncio.gather`; other hooks are handed
+    to the dispatcher, in the event loop's default executor so they do not block it. When the
+    dispatcher is asynchronous, the delivery is acknowledged with ``202 Accepted`` before any hook
+    has finished.
+
+    :param endpoint: the path deliveries are posted to. With :code:`tenants`, it may hold a
+                     ``<tenant>`` segment, such as ``"/postreceive/<tenant>"``, naming the tenant
+                     of each delivery.
+    :param secret: Optional secret, used to authenticate the hook comes from Github
+    :param metrics_endpoint: Optional path serving the metrics in the Prometheus text format, on
+                             ``GET``. Requires a :code:`metrics` sink that can render them, such as
+                             :class:`~github_webhook.metrics.PrometheusMetrics`.
+    :param options: Further options, such as :code:`dispatcher` (which runs the synchronous hooks)
+                    or :code:`max_payload_size`, as described by
+                    :class:`~github_webhook.core.WebhookCore`
+    """
+
+    def __init__(self, endpoint="/postreceive", secret=None, metrics_endpoint=None, **options):
+        super(AsgiWebhook, self).__init__(secret=secret, **options)
+        if metrics_endpoint is not None and not hasattr(self.metrics, "render"):
+            raise ValueError("metrics_endpoint requires a metrics sink with a render() method")
+        self.endpoint = endpoint
+        self.metrics_endpoint = metrics_endpoint
+        self._tasks = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+
+        if self.metrics_endpoint is not None and scope["path"] == self.metrics_endpoint:
+            await self._serve_metrics(scope, send)
+            return
+        tenant = _endpoint_tenant(self.endpoint, scope["path"])
+        if tenant is False:
+            await _respond(send, 404, "Not Found")
+            return
+        if scope["method"] != "POST":
+            await _respond(send, 405, "Method Not Allowed", [(b"allow", b"POST")])
+            return
+
+        headers = dict((key.decode("latin-1"), value.decode("latin-1")) for key, value in scope["headers"])
+        try:
+            status = await self.handle_async(headers, receive, tenant)
+        except WebhookError as e:
+            self._count_response(e.status)
+            await _respond(send, e.status, e.description)
+        except Exception:
+            self._logger.exception("Hook raised an exception")
+            self._count_response(500)
+            await _respond(send, 500, "Internal Server Error")
+        else:
+            self._count_response(status)
+            await _respond(send, status, "")
+
+    async def handle_async(self, headers, receive, tenant=None):
+        """
+        Process a single delivery from within an event loop.
+
+        :param headers: Mapping of request header names to values
+        :param receive: ASGI receive callable the request body is read from. Each chunk is
+                        authenticated as it arrives.
+        :param tenant: Optional tenant the delivery is for
+        :return: the status code to respond with
+        :raises WebhookError: if the delivery must be refused
+        """
+
+        headers = self._headers(headers, tenant)
+        if self._is_duplicate(headers):
+            return DUPLICATE.status
+        if self._is_unhandled(headers):
+            return UNHANDLED.status
+        self._admit(headers)
+
+        reader = self._body_reader(headers)
+        more_body = True
+        while more_body:
+            message = await receive()
+            try:
+                reader.feed(message.get("body", b""))
+            except PayloadTooLarge as e:
+                raise WebhookError(413, str(e))
+            more_body = message.get("more_body", False)
+
+        body = reader.getvalue()
+        if self.workers is not None:
+            self._verify(headers, body, reader.signature)
+            result = await _running_loop().run_in_executor(None, self._forward, headers, body)
+            return result.status
+
+        hooks, data = self._receive(headers, body, reader.signature)
+        self._admit_repository(headers, data)
+        if not self._claim(headers):
+            return DUPLICATE.status
+
+        loop = _running_loop()
+        try:
+            if self.recorder is not None:
+                await loop.run_in_executor(None, self._record, headers, body)
+            seq = None
+            if self.journal is not None and hooks:
+                seq = await loop.run_in_executor(None, self.journal.append, headers, body)
+            return await self._run(hooks, data, seq)
+        except Exception:
+            self._release(headers)
+            raise
+
+    async def _run(self, hooks, data, seq):
+        hooks, batches = self._split_batches(hooks)
+        coroutines = [self._coroutine(hook, data) for hook in hooks if is_coroutine_hook(hook)]
+        blocking = [hook for hook in hooks if not is_coroutine_hook(hook)]
+
+        if self.dispatcher.asynchronous:
+            on_complete = None
+            if seq is not None:
+                on_complete = _countdown(len(coroutines) + 1, functools.partial(_journal_complete, self.journal, seq))
+            try:
+                if on_complete is None:
+                    self.dispatcher.dispatch(self._synchronous_hooks(blocking), data)
+                else:
+                    self.dispatcher.dispatch(self._synchronous_hooks(blocking), data, on_complete)
+            except QueueFull as e:
+                for coroutine in coroutines:
+                    coroutine.close()
+                if seq is not None:
+                    await _running_loop().run_in_executor(None, self.journal.done, seq)
+                raise WebhookError(503, str(e))
+
+            for coroutine in coroutines:
+                task = asyncio.ensure_future(coroutine)
+                self._tasks.add(task)
+                task.add_done_callback(self._task_done)
+                if on_complete is not None:
+                    task.add_done_callback(lambda task: on_complete(not task.cancelled() and not task.exception()))
+            for batch in batches:
+                batch(data)
+            return 202
+
+        loop = _running_loop()
+        if blocking:
+            coroutines.append(
+                loop.run_in_executor(None, self.dispatcher.dispatch, self._synchronous_hooks(blocking), data)
+            )
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for error in errors[1:]:
+                self._logger.error("Hook raised an exception", exc_info=error)
+            raise errors[0]
+        for batch in batches:
+            batch(data)
+        if seq is not None:
+            await loop.run_in_executor(None, self.journal.done, seq)
+        return 204
+
+    def _coroutine(self, hook, data):
+        coroutine = hook(data)
+        if self.metrics is not None:
+            coroutine = _timed(coroutine, self.metrics, {"hook": hook_name(hook)})
+        if self.retries is not None:
+            coroutine = _retried(coroutine, hook, data, self.retries)
+        return coroutine
+
+    async def _serve_metrics(self, scope, send):
+        if scope["method"] != "GET":
+            await _respond(send, 405, "Method Not Allowed", [(b"allow", b"GET")])
+            return
+        body = self.metrics.render().encode("utf-8")
+        headers = [(b"content-type", self.metrics.content_type.encode("latin-1"))]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def drain(self):
+        """Wait for coroutine hooks started by deliveries that were already acknowledged"""
+
+        if self._tasks:
+            await asyncio.wait(list(self._tasks))
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self._logger.error("Hook raised an exception", exc_info=task.exception())
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.drain()
+                await _running_loop().run_in_executor(None, self.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def _countdown(count, callback):
+    """Return a function calling :code:`callback` once it has been called :code:`count` times"""
+
+    lock = threading.Lock()
+    state = {"remaining": count, "succeeded": True}
+
+    def part_done(succeeded):
+        with lock:
+            state["remaining"] -= 1
+            state["succeeded"] = state["succeeded"] and succeeded
+            complete = state["remaining"] == 0
+        if complete:
+            callback(state["succeeded"])
+
+    return part_done
+
+
+async def _timed(coroutine, sink, labels):
+    start = _clock()
+    try:
+        return await coroutine
+    except Exception:
+        sink.increment("github_webhook_hook_errors_total", labels)
+        raise
+    finally:
+        sink.observe("github_webhook_hook_seconds", _clock() - start, labels)
+
+
+async def _retried(coroutine, hook, data, scheduler):
+    """Hand the failures of a coroutine hook to the retry scheduler, which runs it on its own loop"""
+
+    try:
+        return await coroutine
+    except Exception as e:
+        name = hook_name(hook)
+        logging.getLogger("webhook").warning("Hook %s raised an exception; retrying it later", name, exc_info=True)
+        scheduler.schedule(_synchronous(hook), data, e, name=name)
+
+
+async def _respond(send, status, description, headers=()):
+    body = description.encode("utf-8")
+    response_headers = [(b"content-type", b"text/plain; charset=utf-8")] if body else []
+    response_headers.extend(headers)
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
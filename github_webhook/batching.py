@@ -0,0 +1,154 @@
+"""Hooks run once for a batch of deliveries, coalesced over a time window."""
+
+import collections
+import itertools
+import logging
+import threading
+import time
+
+from github_webhook.payload import _extract, _split
+from github_webhook.routing import _key_function
+
+_clock = getattr(time, "monotonic", time.time)
+
+logger = logging.getLogger("webhook")
+
+
+class BatchHook(object):
+    """
+    Collects the payloads of deliveries, and calls :code:`hook` with a list of them, on a thread
+    of its own, once :code:`window` seconds have passed since the first of them arrived or
+    :code:`max_size` of them have been collected, whichever comes first.
+
+    When :code:`key` is given, payloads with the same key are collapsed: the batch holds only the
+    latest of them, in the position of the first. Keying ``status`` events on
+    ``["repository.full_name", "sha"]`` thus hands the hook the latest status of each commit.
+
+    :param hook: The synchronous function called with each batch
+    :param window: Number of seconds payloads are collected for
+    :param max_size: Number of distinct payloads that triggers a batch before the window ends
+    :param key: Optional function returning the key of a payload, or list of dotted paths, such
+                as ``"repository.full_name"``, whose values make up the key
+    :param fields: Optional list of dotted paths; only those fields of each payload are kept, see
+                   :func:`~github_webhook.payload.extract`
+    :param name: Name of the hook, used when logging its exceptions
+    """
+
+    def __init__(self, hook, window=1.0, max_size=100, key=None, fields=None, name=None):
+        if window <= 0 or max_size < 1:
+            raise ValueError("The window and maximum size of a batch must be positive")
+
+        self.hook = hook
+        self.window = window
+        self.max_size = max_size
+        self.name = name or getattr(hook, "__name__", repr(hook))
+        self._key = key if key is None or callable(key) else _key_function([_split(path) for path in key])
+        self._paths = [_split(field) for field in fields] if fields is not None else None
+        self._sequence = itertools.count()
+        self._closed = False
+        self._start()
+
+    def __len__(self):
+        """Number of payloads waiting for the next batch"""
+
+        with self._cond:
+            return len(self._pending)
+
+    def __call__(self, data):
+        """Add a payload to the next batch; run the hook with it right away once closed"""
+
+        key, data = self._entry(data)
+        with self._cond:
+            if not self._closed:
+                if not self._pending:
+                    self._deadline = _clock() + self.window
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name="webhook-batch-" + self.name)
+                        self._thread.daemon = True
+                        self._thread.start()
+                    self._cond.notify()
+                self._pending[key] = data
+                if len(self._pending) == self.max_size:
+                    self._cond.notify()
+                return
+
+        self._call([data])
+
+    def close(self, wait=True, timeout=None):
+        """
+        Run the hook with the payloads collected so far, without waiting for the window to end.
+        Payloads added afterwards are passed to the hook one at a time, as they arrive.
+
+        :param wait: Block until the hook has returned
+        :param timeout: Optional maximum number of seconds to wait
+        """
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+            thread = self._thread
+        if wait and thread is not None:
+            thread.join(timeout)
+
+    def after_fork(self):
+        """
+        Start afresh in a child process forked from this one, where the thread running the
+        batches is not. The payloads collected in the parent are left to it.
+        """
+
+        self._start()
+
+    def _start(self):
+        self._pending = collections.OrderedDict()
+        self._deadline = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _entry(self, data):
+        """Return the key of a payload in a batch, and the part of it that is kept"""
+
+        if self._paths is not None:
+            data = _extract(data, self._paths)
+        return self._key(data) if self._key is not None else next(self._sequence), data
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                while len(self._pending) < self.max_size and not self._closed:
+                    remaining = self._deadline - _clock()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = list(self._pending.values())
+                self._pending.clear()
+                closed = self._closed
+
+            if batch:
+                self._call(batch)
+            if closed:
+                return
+
+    def _call(self, batch):
+        try:
+            self.hook(batch)
+        except Exception:
+            logger.exception("Batch hook %s raised an exception on %d payloads", self.name, len(batch))
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,125 @@
+"""Incremental reading and authentication of request bodies."""
+
+CHUNK_SIZE = 64 * 1024
+
+# Largest buffer allocated from the declared length alone, before the body arrives: beyond it, the
+# buffer grows with the data actually read, so a made-up Content-Length costs nothing
+MAX_PRESIZE = 1024 * 1024
+
+
+class PayloadTooLarge(ValueError):
+    """Raised when a body exceeds the maximum size of a :class:`BodyReader`"""
+
+    def __init__(self, max_size):
+        super(PayloadTooLarge, self).__init__("Payload exceeds {0} bytes".format(max_size))
+        self.max_size = max_size
+
+
+class BodyReader(object):
+    """
+    Accumulate a request body into a single buffer, feeding each chunk to the signature as it
+    arrives, so the body is neither copied nor traversed again before it is parsed.
+
+    :param signature: Optional :class:`~github_webhook.signature.Signature` the body is verified
+                      against
+    :param content_length: Declared length of the body, if known, used to size the buffer up front,
+                           up to :data:`MAX_PRESIZE`
+    :param max_size: Optional maximum body size; larger bodies are refused with
+                     :class:`PayloadTooLarge` as soon as that is known
+    """
+
+    def __init__(self, signature=None, content_length=None, max_size=None):
+        if content_length is not None and max_size is not None and content_length > max_size:
+            raise PayloadTooLarge(max_size)
+
+        self._buffer = bytearray(min(content_length or 0, MAX_PRESIZE))
+        self._size = 0
+        self._max_size = max_size
+        self.signature = signature
+
+    def getvalue(self):
+        """Return a memoryview of the body read so far, without copying it"""
+
+        return memoryview(self._buffer)[: self._size]
+
+    def feed(self, chunk):
+        """Append :code:`chunk` to the body"""
+
+        end = self._size + len(chunk)
+        self._check_size(end)
+        if end > len(self._buffer):
+            del self._buffer[self._size :]
+            self._buffer += chunk
+        else:
+            self._buffer[self._size : end] = chunk
+        self._update(self._size, end)
+
+    def read_from(self, stream, chunk_size=CHUNK_SIZE):
+        """
+        Read :code:`stream` until it is exhausted. When the stream supports :code:`readinto`, data
+        goes straight into the pre-sized buffer.
+
+        :return: a memoryview of the whole body
+        """
+
+        readinto = getattr(stream, "readinto", None)
+        while True:
+            if readinto is not None and self._size < len(self._buffer):
+                count = self._readinto(readinto, chunk_size)
+                if not count:
+                    break
+                self._update(self._size, self._size + count)
+            else:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                self.feed(chunk)
+        return self.getvalue()
+
+    def _readinto(self, readinto, chunk_size):
+        view = memoryview(self._buffer)[self._size : self._size + chunk_size]
+        try:
+            return readinto(view)
+        finally:
+            _release(view)
+
+    def _update(self, start, end):
+        if self.signature is not None:
+            view = memoryview(self._buffer)[start:end]
+            self.signature.update(view)
+            _release(view)
+        self._size = end
+
+    def _check_size(self, size):
+        if self._max_size is not None and size > self._max_size:
+            raise PayloadTooLarge(self._max_size)
+
+
+if hasattr(memoryview, "release"):
+
+    def _release(view):
+        """Release :code:`view` now, so the buffer it exports may be resized"""
+
+        view.release()
+
+else:  # pragma: no cover
+
+    def _release(view):
+        """Python 2 has no memoryview.release(): the view is released with its last reference"""
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,104 @@
+"""A bounded, thread-safe LRU cache whose entries expire."""
+
+import collections
+import threading
+import time
+
+_clock = getattr(time, "monotonic", time.time)
+_MISSING = object()
+
+
+class LRUCache(object):
+    """
+    Map keys to values, evicting the least recently used entry once :code:`max_size` entries are
+    held, and dropping entries :code:`ttl` seconds after they were stored.
+
+    :param max_size: Maximum number of entries
+    :param ttl: Optional lifetime of an entry, in seconds
+    """
+
+    def __init__(self, max_size=1024, ttl=None):
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # key -> (expiry, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        """Return the value stored for :code:`key`, or :code:`default`"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] is not None and entry[0] <= _clock():
+                del self._entries[key]
+                return default
+            self._touch(key)
+            return entry[1]
+
+    def set(self, key, value):
+        """Store :code:`value` for :code:`key`, replacing any previous value"""
+
+        with self._lock:
+            self._store(key, value)
+
+    def add(self, key, value=True):
+        """
+        Store :code:`value` for :code:`key` unless a live entry already exists, atomically.
+
+        :return: whether the value was stored
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] is None or entry[0] > _clock()):
+                self._touch(key)
+                return False
+            self._store(key, value)
+            return True
+
+    def discard(self, key):
+        """Remove :code:`key`, if present"""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _touch(self, key):
+        # OrderedDict.move_to_end() is Python 3 only
+        self._entries[key] = self._entries.pop(key)
+
+    def _store(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (_clock() + self.ttl if self.ttl is not None else None, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,927 @@
+"""Framework-agnostic verification, parsing and dispatch of Github deliveries."""
+
+import codecs
+import collections
+import functools
+import inspect
+import logging
+import time
+
+import six
+from six.moves.urllib.parse import unquote_to_bytes
+
+from github_webhook.batching import BatchHook
+from github_webhook.body import BodyReader, PayloadTooLarge
+from github_webhook.decoders import get_decoder
+from github_webhook.descriptions import EVENT_DESCRIPTIONS, Description, describe  # noqa: F401
+from github_webhook.dispatch import DispatcherClosed, QueueFull, SerialDispatcher
+from github_webhook.events import EVENT_CLASSES, Event, TypedHook
+from github_webhook.forward import ForwardHook
+from github_webhook.memo import MemoizedHook
+from github_webhook.metrics import UNTIMED, TimedHook, Timer, hook_name
+from github_webhook.payload import FieldsHook, LazyPayload
+from github_webhook.retry import RetryingHook
+from github_webhook.routing import Router, _get
+from github_webhook.signature import POLICIES, InvalidSignature, Verifier, encode_secrets
+from github_webhook.tenants import TENANT_HEADER, TenantSecrets
+
+Result = collections.namedtuple("Result", ["status", "body"])
+
+# Header the tenant of a delivery is recorded under, whether it came from the URL or a header, so
+# that journaled deliveries are replayed for the same tenant
+_TENANT = "x-github-webhook-tenant"
+_TENANT_HEADER = TENANT_HEADER.lower()
+
+#: Response to a delivery that was already handled
+DUPLICATE = Result(200, "Duplicate delivery")
+
+#: Response to a delivery no hook is registered for, with :code:`skip_unhandled`
+UNHANDLED = Result(200, "No hook for this event")
+
+
+class WebhookError(Exception):
+    """
+    Raised when a delivery must be refused.
+
+    :param status: HTTP status code to respond with
+    :param description: Human-readable reason
+    """
+
+    def __init__(self, status, description):
+        super(WebhookError, self).__init__(description)
+        self.status = status
+        self.description = description
+
+
+class WebhookCore(object):
+    """
+    Verify, parse and dispatch Github deliveries, independently of any web framework. Adapters,
+    such as :class:`~github_webhook.Webhook` for Flask, feed it the headers and body of each
+    request and turn the :class:`Result` (or :class:`WebhookError`) into a response.
+
+    :param secret: Optional secret, used to authenticate the hook comes from Github. A list of
+                   secrets may be given while rotating them; deliveries signed with any of them
+                   are accepted.
+    :param dispatcher: Optional strategy for running hooks, such as a
+                       :class:`~github_webhook.dispatch.PoolDispatcher`. By default hooks run
+                       serially, before the response is sent.
+    :param max_payload_size: Optional maximum size of a request body, in bytes. Larger deliveries
+                             are refused with ``413 Payload Too Large``, before the body is read
+                             whenever they declare their Content-Length.
+    :param signature_policy: Which signatures are accepted: ``"prefer-sha256"`` (the default)
+                             verifies ``X-Hub-Signature-256`` and falls back to ``X-Hub-Signature``
+                             for deliveries without it, ``"sha256"`` requires
+                             ``X-Hub-Signature-256`` and ``"sha1"`` only checks ``X-Hub-Signature``.
+                             Any other value raises :code:`ValueError`.
+    :param json_decoder: JSON backend used to decode payloads: ``"auto"`` (the default) picks the
+                         fastest of orjson, simdjson and ujson that is installed, falling back to
+                         the standard library. See :func:`~github_webhook.decoders.get_decoder`.
+    :param lazy_payloads: Hand hooks a :class:`~github_webhook.payload.LazyPayload` instead of a
+                          dict, so that only the parts of each payload hooks read are decoded.
+                          This requires pysimdjson: without it, the whole payload is still
+                          decoded before the hooks run, so that an invalid one is refused.
+    :param dedup: Optional :class:`~github_webhook.dedup.DeliveryStore` remembering the
+                  ``X-Github-Delivery`` IDs already handled. Redeliveries are acknowledged with
+                  ``200 OK`` without running any hook; those already in the store when their
+                  headers arrive are acknowledged without even reading their body.
+    :param metrics: Optional :class:`~github_webhook.metrics.MetricsSink` recording the time
+                    spent reading, verifying and parsing deliveries and in each hook, the number
+                    and size of deliveries by event type, and hook errors. Hooks running on a
+                    process pool are not timed.
+    :param journal: Optional :class:`~github_webhook.journal.Journal` every delivery with hooks
+                    to run is appended to, before they run. Deliveries stay in the journal until
+                    all their hooks have succeeded, and can be run again with :meth:`replay`.
+    :param tenants: Optional :class:`~github_webhook.tenants.TenantSecrets`, or mapping or
+                    function it can be built from, to serve many integrations, each with its own
+                    secret, from one webhook. The tenant of a delivery is given by the adapter,
+                    from the URL, or else read from the ``X-GitHub-Hook-Installation-Target-ID``
+                    header. Deliveries for unknown tenants are refused with ``404 Not Found``.
+    :param workers: Optional :class:`~github_webhook.workers.WorkerFleet` of processes running the
+                    hooks. Deliveries are then only verified, and acknowledged with
+                    ``202 Accepted`` once queued for the workers, which parse them and run their
+                    hooks; the dispatcher is not used. The workers import this webhook, but the
+                    journal and recorder stay with this process.
+    :param admission: Optional :class:`~github_webhook.admission.AdmissionControl` limiting the
+                      rate of deliveries. Those over the limits are refused with
+                      ``429 Too Many Requests``, by priority class, most of them before their
+                      body is read. The limit per repository does not apply to deliveries run
+                      by :code:`workers`, whose payloads are not parsed here.
+    :param skip_unhandled: Acknowledge deliveries of event types no hook is registered for with
+                           ``200 OK``, from their headers alone, without reading, verifying or
+                           parsing their body. Registering a hook for every event type, ``"*"``,
+                           turns this off. With :code:`workers`, the hooks must be registered in
+                           this process too.
+    :param recorder: Optional :class:`~github_webhook.recording.Recorder` archiving every
+                     verified delivery, but redeliveries, so that it can be replayed later with
+                     :func:`~github_webhook.recording.replay_recording`.
+    :param retries: Optional :class:`~github_webhook.retry.RetryScheduler`. Hooks raising an
+                    exception are then retried later, with exponential backoff, and dead-lettered
+                    once they have failed every attempt, while the delivery succeeds: neither the
+                    response, the other hooks nor the journal wait for them. Hooks running on a
+                    process pool are not retried.
+    """
+
+    def __init__(
+        self,
+        secret=None,
+        dispatcher=None,
+        max_payload_size=None,
+        signature_policy="prefer-sha256",
+        json_decoder="auto",
+        lazy_payloads=False,
+        dedup=None,
+        metrics=None,
+        journal=None,
+        tenants=None,
+        workers=None,
+        admission=None,
+        skip_unhandled=False,
+        recorder=None,
+        retries=None,
+    ):
+        self._router = Router()
+        self._tenant_routers = {}  # tenant -> Router of the hooks registered for that tenant only
+        self._batches = []
+        self._forwarders = []
+        self._descriptions = {}
+        self._logger = logging.getLogger("webhook")
+        self.secret = secret
+        self.dispatcher = dispatcher if dispatcher is not None else SerialDispatcher()
+        self.max_payload_size = max_payload_size
+        self.signature_policy = signature_policy
+        self.json_decoder = get_decoder(json_decoder)
+        self.lazy_payloads = lazy_payloads
+        self.dedup = dedup
+        self.metrics = metrics
+        self.journal = journal
+        self.workers = workers
+        self.admission = admission
+        self.skip_unhandled = skip_unhandled
+        self.recorder = recorder
+        self.retries = retries
+        self.tenants = tenants if tenants is None or isinstance(tenants, TenantSecrets) else TenantSecrets(tenants)
+
+    @property
+    def secret(self):
+        """The current secret; the first one while several are active"""
+
+        return self._secrets[0] if self._secrets else None
+
+    @secret.setter
+    def secret(self, secret):
+        self._secrets = encode_secrets(secret)
+        self._verifier = Verifier(self._secrets) if self._secrets else None
+
+    @property
+    def secrets(self):
+        """All active secrets"""
+
+        return self._secrets
+
+    @property
+    def signature_policy(self):
+        """Which signatures are accepted, one of :data:`~github_webhook.signature.POLICIES`"""
+
+        return self._signature_policy
+
+    @signature_policy.setter
+    def signature_policy(self, policy):
+        if policy not in POLICIES:
+            raise ValueError("Unknown signature policy: {0!r}".format(policy))
+        self._signature_policy = policy
+
+    def hook(
+        self,
+        event_type="push",
+        fields=None,
+        action=None,
+        repository=None,
+        ref=None,
+        sender=None,
+        tenant=None,
+        typed=False,
+    ):
+        """
+        Registers a function as a hook. Multiple hooks can be registered for a given type, but the
+        order in which they are invoke is unspecified. Hooks may be coroutine functions; they are
+        awaited concurrently by the ASGI adapter and run to completion on their own event loop
+        otherwise.
+
+        The hook may be restricted to some deliveries of the event type with the filters below,
+        each a string or a list of strings. They are indexed, so that a delivery only costs the
+        hooks it may match, however many are registered.
+
+        :param event_type: The event type this hook will be invoked for, or ``"*"`` for every event
+                           type.
+        :param fields: Optional list of the dotted paths, such as ``"repository.full_name"``, the
+                       hook reads. It then receives a dict holding only those fields, which are
+                       all that is decoded when :code:`lazy_payloads` is enabled.
+        :param action: Only invoke the hook for these actions, such as ``"opened"``.
+        :param repository: Only invoke the hook for repositories whose full name matches one of
+                           these glob patterns, such as ``"my-org/*"``.
+        :param ref: Only invoke the hook when the ref (or the base branch of a pull request)
+                    matches one of these glob patterns, such as ``"refs/heads/main"``.
+        :param sender: Only invoke the hook for events triggered by one of these users.
+        :param tenant: Only invoke the hook for deliveries to this tenant. Its hooks run after
+                       those registered for every tenant.
+        :param typed: Hand the hook a compact :class:`~github_webhook.events.Event` holding the
+                      fields most hooks read, such as a
+                      :class:`~github_webhook.events.PushEvent`, instead of the payload; or the
+                      :class:`~github_webhook.events.Event` subclass to build. With
+                      :code:`lazy_payloads`, the payload stays reachable as its :code:`payload`.
+        :raises ValueError: if both :code:`fields` and :code:`typed` are given
+        """
+
+        if fields is not None and typed:
+            raise ValueError("A hook may either read some fields or be typed, not both")
+
+        def decorator(func):
+            if isinstance(func, ForwardHook):
+                self._forwarders.append(func)
+            if typed:
+                event_class = typed if isinstance(typed, type) else EVENT_CLASSES.get(event_type, Event)
+                hook = TypedHook(func, event_class)
+            else:
+                hook = FieldsHook(func, fields) if fields is not None else func
+            self._router_for(tenant).add(event_type, hook, action=action, repository=repository, ref=ref, sender=sender)
+            return func
+
+        return decorator
+
+    def batch_hook(
+        self,
+        event_type="push",
+        window=1.0,
+        max_size=100,
+        key=None,
+        fields=None,
+        action=None,
+        repository=None,
+        ref=None,
+        sender=None,
+        tenant=None,
+    ):
+        """
+        Registers a function as a hook called with lists of payloads, coalesced from the deliveries
+        received over :code:`window` seconds, so that bursts of events cost a single call. It runs
+        on a thread of its own rather than through the dispatcher; a delivery is acknowledged,
+        and done as far as the journal is concerned, once its payload has been queued. Batches
+        still collecting are run by :meth:`shutdown`.
+
+        :param event_type: The event type this hook will be invoked for.
+        :param window: Number of seconds payloads are collected for, from the first of a batch.
+        :param max_size: Number of distinct payloads that triggers a batch before the window ends.
+        :param key: Optional list of the dotted paths, such as ``["repository.full_name", "sha"]``,
+                    or function, identifying payloads that supersede each other. A batch only
+                    holds the latest payload for each key.
+        :param fields: Optional list of the dotted paths the hook reads, as for :meth:`hook`.
+
+        The :code:`action`, :code:`repository`, :code:`ref`, :code:`sender` and :code:`tenant`
+        filters are those of :meth:`hook`.
+        """
+
+        def decorator(func):
+            hook = _synchronous(func)
+            if self.metrics is not None:
+                hook = TimedHook(hook, self.metrics, hook_name(func))
+            batch = BatchHook(hook, window, max_size, key=key, fields=fields, name=hook_name(func))
+            self._router_for(tenant).add(
+                event_type, batch, action=action, repository=repository, ref=ref, sender=sender
+            )
+            self._batches.append(batch)
+            return func
+
+        return decorator
+
+    def memoize(self, key, max_size=1024, ttl=None):
+        """
+        Decorates a function of a payload, such as a hook or a step several hooks share, so that
+        it runs once for the payloads with the same key, its result being cached for the following
+        ones. A memoized hook is thus skipped for deliveries whose key it has already seen.
+        Hits and misses are counted by :code:`metrics`, see
+        :class:`~github_webhook.memo.MemoizedHook`. To handle each commit once, for instance::
+
+            @webhook.hook("check_run")
+            @webhook.memoize("check_run.head_sha", ttl=300)
+            def on_check_run(data):
+                ...
+
+        :param key: Dotted path, such as ``"check_run.head_sha"``, list of dotted paths, or
+                    function returning the key of a payload
+        :param max_size: Maximum number of results cached
+        :param ttl: Optional number of seconds results are cached for
+        """
+
+        def decorator(func):
+            return MemoizedHook(func, key, max_size, ttl, metrics=self.metrics, name=hook_name(func))
+
+        return decorator
+
+    def describe(self, event_type, template):
+        """
+        Registers the template describing deliveries of :code:`event_type` in the log, in place
+        of the one in :data:`~github_webhook.descriptions.EVENT_DESCRIPTIONS`, if any.
+
+        :param event_type: The event type, such as ``"workflow_run"``
+        :param template: A :meth:`str.format` template with named fields, such as
+                         ``"{sender[login]} {action} run {workflow_run[id]} in
+                         {repository[full_name]}"``
+        :raises ValueError: if the template is invalid
+        """
+
+        self._descriptions[event_type] = Description(template)
+
+    def after_fork(self):
+        """
+        Restart the threads of the dispatcher, the retry scheduler, the batch hooks and the
+        forwarding hooks in a child process forked from this one, since only the thread that
+        forked runs there. :class:`~github_webhook.server.Server` calls it in each worker.
+        """
+
+        for component in [self.dispatcher, self.retries] + self._batches + self._forwarders:
+            if hasattr(component, "after_fork"):
+                component.after_fork()
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop accepting deliveries and drain the ones already handed to the dispatcher.
+
+        :param wait: Block until pending hooks have finished
+        :param timeout: Optional maximum number of seconds to wait
+        """
+
+        if self.workers is not None:
+            self.workers.shutdown(wait=wait, timeout=timeout)
+        for batch in self._batches:
+            batch.close(wait=wait, timeout=timeout)
+        self.dispatcher.shutdown(wait=wait, timeout=timeout)
+        for forwarder in self._forwarders:
+            forwarder.close(wait=wait)
+        if self.retries is not None:
+            self.retries.close(wait=wait)
+
+    def handle(self, headers, body, tenant=None):
+        """
+        Process a single delivery, running its hooks through the dispatcher.
+
+        :param headers: Mapping of request header names to values
+        :param body: Raw request body, as a bytes-like object
+        :param tenant: Optional tenant the delivery is for, such as a parameter of its URL
+        :return: the :class:`Result` to respond with
+        :raises WebhookError: if the delivery must be refused
+        """
+
+        headers = self._headers(headers, tenant)
+        if self._is_duplicate(headers):
+            return DUPLICATE
+        if self._is_unhandled(headers):
+            return UNHANDLED
+        self._admit(headers)
+        if self.workers is not None:
+            self._verify(headers, body, self._sign(headers, body))
+            return self._forward(headers, body)
+        return self._dispatch_once(headers, body, *self._receive_body(headers, body))
+
+    def handle_stream(self, headers, stream, tenant=None):
+        """
+        Process a single delivery whose body is read from :code:`stream`, such as a WSGI input.
+
+        :param headers: Mapping of request header names to values
+        :param stream: File-like object the request body is read from
+        :param tenant: Optional tenant the delivery is for, such as a parameter of its URL
+        :return: the :class:`Result` to respond with
+        :raises WebhookError: if the delivery must be refused
+        """
+
+        headers = self._headers(headers, tenant)
+        if self._is_duplicate(headers):
+            return DUPLICATE
+        if self._is_unhandled(headers):
+            return UNHANDLED
+        self._admit(headers)
+        body, signature = self._read(headers, stream)
+        if self.workers is not None:
+            self._verify(headers, body, signature)
+            return self._forward(headers, body)
+        hooks, data = self._receive(headers, body, signature)
+        return self._dispatch_once(headers, body, hooks, data)
+
+    def dispatch(self, hooks, data, on_complete=None):
+        """
+        Run :code:`hooks` for a delivery that has already been received.
+
+        :param on_complete: Optional callable, passed whether every hook succeeded once they have
+                            all run
+        :return: the :class:`Result` to respond with
+        :raises WebhookError: if the dispatcher cannot accept the delivery
+        """
+
+        hooks, batches = self._split_batches(hooks)
+        hooks = self._synchronous_hooks(hooks)
+        try:
+            if on_complete is None:
+                self.dispatcher.dispatch(hooks, data)
+            else:
+                self.dispatcher.dispatch(hooks, data, on_complete)
+        except QueueFull as e:
+            raise WebhookError(503, str(e))
+        for batch in batches:
+            batch(data)
+
+        return Result(202 if self.dispatcher.asynchronous else 204, "")
+
+    def receive(self, headers, body, tenant=None):
+        """
+        Verify and parse a single delivery, without running any hook.
+
+        :param headers: Mapping of request header names to values
+        :param body: Raw request body, as a bytes-like object
+        :param tenant: Optional tenant the delivery is for
+        :return: the hooks registered for the delivery's event type, and its decoded payload
+        :raises WebhookError: if the delivery must be refused
+        """
+
+        return self._receive_body(self._headers(headers, tenant), body)
+
+    def receive_stream(self, headers, stream, tenant=None):
+        """
+        Verify and parse a single delivery whose body is read from :code:`stream`. The body is
+        authenticated as it is read, into a single buffer that is then parsed in place.
+
+        :param headers: Mapping of request header names to values
+        :param stream: File-like object the request body is read from
+        :param tenant: Optional tenant the delivery is for
+        :return: the hooks registered for the delivery's event type, and its decoded payload
+        :raises WebhookError: if the delivery must be refused
+        """
+
+        headers = self._headers(headers, tenant)
+        return self._receive(headers, *self._read(headers, stream))
+
+    def replay(self, journal=None):
+        """
+        Run the hooks of the deliveries of :code:`journal` that are not done yet, oldest first,
+        through the dispatcher, waiting whenever its queue is full. Deliveries are verified and
+        parsed again, and marked done once all their hooks have succeeded; those that can no
+        longer be verified are logged and dropped.
+
+        :param journal: The :class:`~github_webhook.journal.Journal` to replay; by default
+                        :code:`journal`, as given to the constructor
+        :return: the number of deliveries whose hooks were run
+        """
+
+        journal = journal if journal is not None else self.journal
+        count = 0
+        for entry in journal.entries():
+            try:
+                hooks, data = self.receive(entry.headers, entry.body, entry.headers.get(_TENANT))
+            except WebhookError as e:
+                self._logger.error("Dropping delivery %s from the journal: %s", entry.seq, e.description)
+                journal.done(entry.seq)
+                continue
+
+            hooks, batches = self._split_batches(hooks)
+            on_complete = functools.partial(_journal_complete, journal, entry.seq)
+            while True:
+                try:
+                    self.dispatcher.dispatch(self._synchronous_hooks(hooks), data, on_complete)
+                except DispatcherClosed:
+                    raise
+                except QueueFull:
+                    time.sleep(0.01)
+                    continue
+                except Exception:
+                    self._logger.exception("Hook raised an exception replaying delivery %s", entry.seq)
+                    break
+                for batch in batches:
+                    batch(data)
+                break
+            count += 1
+        return count
+
+    def body_reader(self, headers, tenant=None):
+        """
+        Return a :class:`~github_webhook.body.BodyReader` for the body of a delivery, sized from
+        its Content-Length.
+
+        :param headers: Mapping of request header names to values
+        :param tenant: Optional tenant the delivery is for
+        :raises WebhookError: if the delivery declares a body larger than allowed
+        """
+
+        return self._body_reader(self._headers(headers, tenant))
+
+    def _body_reader(self, headers):
+        signature = self._signature(headers)
+
+        length = headers.get("content-length")
+        try:
+            length = int(length) if length is not None else None
+        except ValueError:
+            raise WebhookError(400, "Invalid header: Content-Length")
+
+        try:
+            return BodyReader(signature, content_length=length, max_size=self.max_payload_size)
+        except PayloadTooLarge as e:
+            raise _too_large(e)
+
+    def _headers(self, headers, tenant=None):
+        """Lower-case the header names, and record the tenant of the delivery among them"""
+
+        headers = _lower(headers)
+        headers.pop(_TENANT, None)
+        if tenant is None and (self.tenants is not None or self._tenant_routers):
+            tenant = headers.get(_TENANT_HEADER)
+        if tenant is not None:
+            headers[_TENANT] = str(tenant)
+        return headers
+
+    def _router_for(self, tenant):
+        if tenant is None:
+            return self._router
+        router = self._tenant_routers.get(str(tenant))
+        if router is None:
+            router = self._tenant_routers[str(tenant)] = Router()
+        return router
+
+    def _receive_body(self, headers, body):
+        return self._receive(headers, body, self._sign(headers, body))
+
+    def _sign(self, headers, body):
+        """Return the signature of a delivery whose body was read whole, fed with the body"""
+
+        if self.max_payload_size is not None and len(body) > self.max_payload_size:
+            raise _too_large(PayloadTooLarge(self.max_payload_size))
+
+        signature = self._signature(headers)
+        if signature is not None:
+            with self._timer("body"):
+                signature.update(body)
+        return signature
+
+    def _split_batches(self, hooks):
+        """Separate the batch hooks, which only queue payloads, from those the dispatcher runs"""
+
+        if not self._batches:
+            return hooks, ()
+        return [h for h in hooks if not isinstance(h, BatchHook)], [h for h in hooks if isinstance(h, BatchHook)]
+
+    def _synchronous_hooks(self, hooks):
+        """Adapt hooks for the dispatcher, timing them when metrics are enabled and retrying them"""
+
+        if (self.metrics is None and self.retries is None) or getattr(self.dispatcher, "executor", None) == "process":
+            return [_synchronous(hook) for hook in hooks]
+        adapted = []
+        for hook in hooks:
+            name, hook = hook_name(hook), _synchronous(hook)
+            if self.metrics is not None:
+                hook = TimedHook(hook, self.metrics, name)
+            if self.retries is not None:
+                hook = RetryingHook(hook, self.retries, name)
+            adapted.append(hook)
+        return adapted
+
+    def _timer(self, stage):
+        if self.metrics is None:
+            return UNTIMED
+        return Timer(self.metrics, "github_webhook_stage_seconds", {"stage": stage})
+
+    def _count_response(self, status):
+        """Record the status of a response, for adapters"""
+
+        if self.metrics is not None:
+            self.metrics.increment("github_webhook_responses_total", {"status": str(status)})
+
+    def _read(self, headers, stream):
+        """Read the body of a delivery, returning it with the signature it was fed to"""
+
+        reader = self._body_reader(headers)
+        try:
+            with self._timer("body"):
+                body = reader.read_from(stream)
+        except PayloadTooLarge as e:
+            raise _too_large(e)
+        return body, reader.signature
+
+    def _dispatch_once(self, headers, body, hooks, data):
+        self._admit_repository(headers, data)
+        if not self._claim(headers):
+            return DUPLICATE
+        try:
+            self._record(headers, body)
+            if self.journal is None or not hooks:
+                return self.dispatch(hooks, data)
+
+            seq = self.journal.append(headers, body)
+            try:
+                return self.dispatch(hooks, data, functools.partial(_journal_complete, self.journal, seq))
+            except WebhookError:
+                self.journal.done(seq)  # refused: no hook ran, and the sender may retry
+                raise
+        except Exception:
+            self._release(headers)
+            raise
+
+    def _forward(self, headers, body):
+        """Hand a verified delivery to the worker fleet, once claimed and journaled"""
+
+        _get_header(headers, "content-type")
+        _get_header(headers, "X-Github-Delivery")
+        if not self._claim(headers):
+            return DUPLICATE
+        try:
+            self._record(headers, body)
+            if self.journal is None:
+                self.workers.submit(headers, body)
+                return Result(202, "")
+
+            seq = self.journal.append(headers, body)
+            try:
+                self.workers.submit(headers, body, functools.partial(_journal_complete, self.journal, seq))
+            except QueueFull:
+                self.journal.done(seq)
+                raise
+        except QueueFull as e:
+            self._release(headers)
+            raise WebhookError(503, str(e))
+        except Exception:
+            self._release(headers)
+            raise
+        return Result(202, "")
+
+    def _run_verified(self, headers, body):
+        """
+        Parse a delivery that was verified already, and run its hooks in the calling thread, as
+        workers do. Return whether they all succeeded.
+        """
+
+        try:
+            hooks, data = self._receive(headers, body, None)
+            hooks, batches = self._split_batches(hooks)
+            for hook in self._synchronous_hooks(hooks):
+                hook(data)
+            for batch in batches:
+                batch(data)
+        except WebhookError as e:
+            self._logger.error("Dropping delivery %s: %s", headers.get("x-github-delivery"), e.description)
+            return False
+        except Exception:
+            self._logger.exception("Hook raised an exception")
+            return False
+        return True
+
+    def _is_duplicate(self, headers):
+        """Return whether a delivery is known to be handled already, from its headers alone"""
+
+        if self.dedup is None:
+            return False
+        delivery = headers.get("x-github-delivery")
+        return delivery is not None and delivery in self.dedup
+
+    def _is_unhandled(self, headers):
+        """Return whether no hook is registered for a delivery's event type, from its headers alone"""
+
+        if not self.skip_unhandled:
+            return False
+        event_type = headers.get("x-github-event")
+        if event_type is None or self._router.handles(event_type):
+            return False
+        router = self._tenant_routers.get(headers.get(_TENANT))
+        return router is None or not router.handles(event_type)
+
+    def _admit(self, headers):
+        """Refuse a delivery over the rate limits, from its headers alone"""
+
+        if self.admission is not None and "x-github-event" in headers:
+            event_type = headers["x-github-event"]
+            self._shed(event_type, self.admission.admit(event_type))
+
+    def _admit_repository(self, headers, data):
+        """Refuse a parsed delivery over the rate limit of its repository"""
+
+        if self.admission is not None:
+            event_type = headers["x-github-event"]
+            repository = _get(data, ("repository", "full_name"))
+            self._shed(event_type, self.admission.admit_repository(event_type, repository))
+
+    def _shed(self, event_type, reason):
+        if reason is None:
+            return
+        if self.metrics is not None:
+            labels = {"event": self.admission.label(event_type), "reason": reason}
+            self.metrics.increment("github_webhook_shed_total", labels)
+        raise WebhookError(429, "Too many deliveries: {0} limit reached".format(reason))
+
+    def _claim(self, headers):
+        """Record a received delivery as handled; return False if it already was"""
+
+        return self.dedup is None or self.dedup.claim(headers["x-github-delivery"])
+
+    def _record(self, headers, body):
+        if self.recorder is not None:
+            self.recorder.record(headers, body)
+
+    def _release(self, headers):
+        """Forget a claimed delivery whose hooks failed, so that a redelivery runs them"""
+
+        if self.dedup is not None:
+            self.dedup.release(headers["x-github-delivery"])
+
+    def _signature(self, headers):
+        """Return the signature the delivery must match if a secret was provided"""
+
+        verifier = self._verifier
+        if self.tenants is not None:
+            tenant = headers.get(_TENANT)
+            if tenant is None:
+                raise WebhookError(400, "Missing header: " + TENANT_HEADER)
+            try:
+                verifier = self.tenants.verifier(tenant)
+            except KeyError:
+                raise WebhookError(404, "Unknown tenant: " + tenant)
+
+        if verifier is None:
+            return None
+
+        try:
+            return verifier.signature(headers, self.signature_policy)
+        except InvalidSignature as e:
+            raise WebhookError(400, str(e))
+
+    def _verify(self, headers, body, signature):
+        """Check the signature of a delivery, and return its event type"""
+
+        if signature is not None:
+            with self._timer("verify"):
+                verified = signature.verify()
+            if not verified:
+                raise WebhookError(400, "Invalid signature")
+
+        event_type = _get_header(headers, "X-Github-Event")
+        if self.metrics is not None:
+            self.metrics.increment("github_webhook_deliveries_total", {"event": event_type})
+            self.metrics.observe("github_webhook_payload_bytes", len(body), {"event": event_type})
+        return event_type
+
+    def _receive(self, headers, body, signature):
+        event_type = self._verify(headers, body, signature)
+        with self._timer("parse"):
+            data = _parse(_get_header(headers, "content-type"), body, self.json_decoder, self.lazy_payloads)
+
+        if data is None:
+            raise WebhookError(400, "Request body must contain json")
+
+        delivery = _get_header(headers, "X-Github-Delivery")
+        try:
+            if self._logger.isEnabledFor(logging.INFO):
+                self._logger.info("%s (%s)", describe(event_type, data, self._descriptions), delivery)
+
+            hooks = self._router.match(event_type, data)
+            if self._tenant_routers:
+                router = self._tenant_routers.get(headers.get(_TENANT))
+                if router is not None:
+                    hooks = hooks + router.match(event_type, data)
+            if hooks and isinstance(data, LazyPayload):
+                len(data)  # decodes a payload pysimdjson did not validate, before any hook runs
+        except ValueError:  # raised by a lazy payload decoded while it is described or routed
+            raise WebhookError(400, "Request body must contain json")
+        if self._forwarders:
+            hooks = [hook.bind(headers, body) if isinstance(hook, ForwardHook) else hook for hook in hooks]
+        return hooks, data
+
+
+def _journal_complete(journal, seq, succeeded):
+    if succeeded:
+        journal.done(seq)
+
+
+def _endpoint_tenant(endpoint, path):
+    """
+    Return the tenant a request path names, :code:`None` if the endpoint names no tenant, or
+    :code:`False` if the path is not the endpoint's. The endpoint may hold a ``<tenant>`` segment,
+    such as ``"/postreceive/<tenant>"``.
+    """
+
+    if "<tenant>" not in endpoint:
+        return None if path == endpoint else False
+    prefix, _, suffix = endpoint.partition("<tenant>")
+    if not path.startswith(prefix) or not path.endswith(suffix):
+        return False
+    tenant = path[len(prefix) : len(path) - len(suffix)]
+    return tenant if tenant and "/" not in tenant else False
+
+
+def _lower(headers):
+    return dict((key.lower(), value) for key, value in headers.items())
+
+
+def _too_large(error):
+    return WebhookError(413, str(error))
+
+
+def _get_header(headers, key):
+    """Return message header from a mapping with lower-cased keys"""
+
+    try:
+        return headers[key.lower()]
+    except KeyError:
+        raise WebhookError(400, "Missing header: " + key)
+
+
+def _parse(content_type, body, decode, lazy=False):
+    """Decode the payload of a JSON or form-encoded delivery"""
+
+    mimetype = content_type.split(";", 1)[0].strip().lower()
+    if mimetype == "application/x-www-form-urlencoded":
+        document = _form_field(body, b"payload")
+        if not document:
+            return None
+    elif mimetype == "application/json" or (mimetype.startswith("application/") and mimetype.endswith("+json")):
+        document = body
+    else:
+        return None
+
+    try:
+        if lazy and _is_object(document):
+            return LazyPayload(document, decode)
+        return decode(document)
+    except ValueError:
+        raise WebhookError(400, "Request body must contain json")
+
+
+def _form_field(body, name):
+    """
+    Return the first value of the field :code:`name` of a form-encoded body, as bytes, or None.
+    The body is scanned for the field rather than parsed, and only the value is unquoted, as bytes,
+    so that bodies of tens of megabytes are neither split into fields nor decoded as text.
+    """
+
+    if not isinstance(body, bytes):
+        body = body.tobytes() if isinstance(body, memoryview) else bytes(body)
+
+    key = name + b"="
+    if body.startswith(key):
+        start = len(key)
+    else:
+        start = body.find(b"&" + key)
+        if start < 0:
+            return None
+        start += len(key) + 1
+    end = body.find(b"&", start)
+    value = (body[start:end] if end >= 0 else body[start:]).replace(b"+", b" ")
+    if b"%" not in value:
+        return value
+
+    # Turning %XX escapes into \xXX ones lets the C escape decoder unquote the value
+    try:
+        return codecs.escape_decode(value.replace(b"\\", b"\\\\").replace(b"%", b"\\x"))[0]
+    except ValueError:  # a % not followed by two hex digits, which is kept as is
+        return unquote_to_bytes(value)
+
+
+def _is_object(document):
+    """Return whether a JSON document's top level is an object, from its first few characters"""
+
+    start = document[:16] if isinstance(document, six.text_type) else codecs.decode(document[:16], "latin-1")
+    return start.lstrip().startswith("{")
+
+
+def is_coroutine_hook(hook):
+    """Return whether :code:`hook` is a coroutine function, which must be awaited"""
+
+    iscoroutinefunction = getattr(inspect, "iscoroutinefunction", None)
+    hook = getattr(hook, "__wrapped__", hook)
+    return iscoroutinefunction is not None and iscoroutinefunction(hook)
+
+
+def _synchronous(hook):
+    """Adapt coroutine hooks for dispatchers that call hooks synchronously"""
+
+    return functools.partial(_run_coroutine, hook) if is_coroutine_hook(hook) else hook
+
+
+def _run_coroutine(hook, data):
+    import asyncio
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(hook(data))
+    finally:
+        loop.close()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,104 @@
+"""JSON decoders for delivery payloads."""
+
+import codecs
+import json
+
+import six
+
+# Decoders are module-level functions so that payloads holding one can be pickled
+
+
+def _stdlib():
+    return _stdlib_loads
+
+
+def _stdlib_loads(data):
+    if not isinstance(data, six.text_type):
+        data = codecs.decode(data, "utf-8")
+    return json.loads(data)
+
+
+def _orjson():
+    import orjson
+
+    return orjson.loads
+
+
+def _ujson():
+    import ujson  # noqa: F401
+
+    return _ujson_loads
+
+
+def _ujson_loads(data):
+    import ujson
+
+    return ujson.loads(_bytes(data))
+
+
+def _simdjson():
+    import simdjson  # noqa: F401
+
+    return _simdjson_loads
+
+
+def _simdjson_loads(data):
+    import simdjson
+
+    return simdjson.loads(_bytes(data))
+
+
+def _bytes(data):
+    # bytes() of a memoryview is its repr on Python 2
+    if isinstance(data, memoryview):
+        return data.tobytes()
+    return bytes(data) if isinstance(data, bytearray) else data
+
+
+#: Factories for the supported decoders, in the order :code:`"auto"` tries them
+DECODERS = [("orjson", _orjson), ("simdjson", _simdjson), ("ujson", _ujson), ("json", _stdlib)]
+
+
+def get_decoder(decoder="auto"):
+    """
+    Return a function decoding a JSON document from :code:`str` or any bytes-like object, without
+    decoding bytes to text first where the backend allows it. Every decoder raises
+    :class:`ValueError` for invalid documents.
+
+    :param decoder: Name of a backend (``"orjson"``, ``"simdjson"``, ``"ujson"`` or ``"json"``),
+                    ``"auto"`` for the fastest one installed, or a callable used as is
+    :raises ImportError: if the named backend is not installed
+    """
+
+    if callable(decoder):
+        return decoder
+
+    factories = dict(DECODERS)
+    if decoder != "auto":
+        try:
+            return factories[decoder]()
+        except KeyError:
+            raise ValueError("Unknown JSON decoder: {0!r}".format(decoder))
+
+    for _, factory in DECODERS:
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
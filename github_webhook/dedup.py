@@ -0,0 +1,136 @@
+"""Stores of the delivery IDs already handled, used to drop redelivered events."""
+
+import os
+import sqlite3
+import threading
+import time
+
+from github_webhook.cache import LRUCache
+
+
+class DeliveryStore(object):
+    """
+    Interface of the stores :class:`~github_webhook.core.WebhookCore` uses to recognise deliveries
+    it has already handled, keyed on the ``X-Github-Delivery`` header. Implement it on top of a
+    shared database to deduplicate across several workers or hosts.
+    """
+
+    def __contains__(self, delivery_id):
+        """Return whether :code:`delivery_id` has been claimed"""
+
+        raise NotImplementedError
+
+    def claim(self, delivery_id):
+        """
+        Atomically record :code:`delivery_id` unless it was already recorded.
+
+        :return: :code:`True` if the caller should handle the delivery
+        """
+
+        raise NotImplementedError
+
+    def release(self, delivery_id):
+        """Forget :code:`delivery_id`, because handling it failed and Github may redeliver it"""
+
+        raise NotImplementedError
+
+
+class MemoryDeliveryStore(DeliveryStore):
+    """
+    Remember delivery IDs in the current process, in a fixed amount of memory.
+
+    :param max_size: Maximum number of IDs remembered; the least recently seen are forgotten first
+    :param ttl: Number of seconds an ID is remembered for
+    """
+
+    def __init__(self, max_size=100000, ttl=3600):
+        self._cache = LRUCache(max_size=max_size, ttl=ttl)
+
+    def __contains__(self, delivery_id):
+        return delivery_id in self._cache
+
+    def claim(self, delivery_id):
+        return self._cache.add(delivery_id)
+
+    def release(self, delivery_id):
+        self._cache.discard(delivery_id)
+
+
+class SqliteDeliveryStore(DeliveryStore):
+    """
+    Remember delivery IDs in a SQLite database, which every worker process on a host can share.
+    Expired IDs are purged every :code:`purge_interval` claims.
+
+    :param path: Path of the database file; created if needed
+    :param ttl: Number of seconds an ID is remembered for
+    :param purge_interval: Number of claims between purges of expired IDs
+    """
+
+    def __init__(self, path, ttl=86400, purge_interval=1000):
+        self.path = path
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._local = threading.local()
+        self._claims = 0
+        with self._connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS deliveries (id TEXT PRIMARY KEY, expires REAL NOT NULL)")
+
+    def __contains__(self, delivery_id):
+        row = (
+            self._connection()
+            .execute("SELECT 1 FROM deliveries WHERE id = ? AND expires > ?", (delivery_id, time.time()))
+            .fetchone()
+        )
+        return row is not None
+
+    def claim(self, delivery_id):
+        now = time.time()
+        db = self._connection()
+        with db:
+            db.execute("DELETE FROM deliveries WHERE id = ? AND expires <= ?", (delivery_id, now))
+            claimed = db.execute(
+                "INSERT OR IGNORE INTO deliveries (id, expires) VALUES (?, ?)", (delivery_id, now + self.ttl)
+            ).rowcount
+        self._claims += 1
+        if self._claims % self.purge_interval == 0:
+            self.purge()
+        return claimed == 1
+
+    def release(self, delivery_id):
+        db = self._connection()
+        with db:
+            db.execute("DELETE FROM deliveries WHERE id = ?", (delivery_id,))
+
+    def purge(self):
+        """Delete expired IDs"""
+
+        db = self._connection()
+        with db:
+            db.execute("DELETE FROM deliveries WHERE expires <= ?", (time.time(),))
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads, nor survive a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30)
+            db.execute("PRAGMA journal_mode=WAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
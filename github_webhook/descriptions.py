@@ -0,0 +1,172 @@
+"""One-line descriptions of deliveries, logged as they are received."""
+
+import re
+import string
+
+from github_webhook.payload import LazyPayload
+
+#: Template describing each event type, formatted with fields of the payload
+EVENT_DESCRIPTIONS = {
+    "commit_comment": "{comment[user][login]} commented on " "{comment[commit_id]} in {repository[full_name]}",
+    "create": "{sender[login]} created {ref_type} ({ref}) in " "{repository[full_name]}",
+    "delete": "{sender[login]} deleted {ref_type} ({ref}) in " "{repository[full_name]}",
+    "deployment": "{sender[login]} deployed {deployment[ref]} to "
+    "{deployment[environment]} in {repository[full_name]}",
+    "deployment_status": "deployment of {deployment[ref]} to "
+    "{deployment[environment]} "
+    "{deployment_status[state]} in "
+    "{repository[full_name]}",
+    "fork": "{forkee[owner][login]} forked {forkee[name]}",
+    "gollum": "{sender[login]} edited wiki pages in {repository[full_name]}",
+    "issue_comment": "{sender[login]} commented on issue #{issue[number]} " "in {repository[full_name]}",
+    "issues": "{sender[login]} {action} issue #{issue[number]} in " "{repository[full_name]}",
+    "member": "{sender[login]} {action} member {member[login]} in " "{repository[full_name]}",
+    "membership": "{sender[login]} {action} member {member[login]} to team " "{team[name]} in {repository[full_name]}",
+    "page_build": "{sender[login]} built pages in {repository[full_name]}",
+    "ping": "ping from {sender[login]}",
+    "public": "{sender[login]} publicized {repository[full_name]}",
+    "pull_request": "{sender[login]} {action} pull #{pull_request[number]} in " "{repository[full_name]}",
+    "pull_request_review": "{sender[login]} {action} {review[state]} "
+    "review on pull #{pull_request[number]} in "
+    "{repository[full_name]}",
+    "pull_request_review_comment": "{comment[user][login]} {action} comment "
+    "on pull #{pull_request[number]} in "
+    "{repository[full_name]}",
+    "push": "{pusher[name]} pushed {ref} in {repository[full_name]}",
+    "release": "{release[author][login]} {action} {release[tag_name]} in " "{repository[full_name]}",
+    "repository": "{sender[login]} {action} repository " "{repository[full_name]}",
+    "status": "{sender[login]} set {sha} status to {state} in " "{repository[full_name]}",
+    "team_add": "{sender[login]} added repository {repository[full_name]} to " "team {team[name]}",
+    "watch": "{sender[login]} {action} watch in repository " "{repository[full_name]}",
+}
+
+
+class _Missing(object):
+    """Stands in for the fields a payload lacks"""
+
+    def __format__(self, spec):
+        return "?"
+
+    def __repr__(self):
+        return "?"
+
+    __str__ = __repr__
+
+
+MISSING = _Missing()
+
+_FIELD = re.compile(r"^[^.\[]+|\.([^.\[]+)|\[([^\]]+)\]")
+_compiled = {}  # template -> Description
+
+
+class Description(object):
+    """
+    A description template, in :meth:`str.format` syntax with named fields only, compiled once
+    into the paths of the payload fields it reads; ``{a[b]}`` and ``{a.b}`` both read the key
+    ``b`` of ``a``. Formatting only looks these fields up, so the payload is not unpacked and a
+    :class:`~github_webhook.payload.LazyPayload` is not decoded any further. Fields missing from
+    the payload are shown as ``?``.
+
+    >>> Description("{sender[login]} pushed {ref}").format({"ref": "refs/heads/main"})
+    '? pushed refs/heads/main'
+
+    :param template: The template, such as ``"{sender[login]} ran {workflow_run[name]}"``
+    :raises ValueError: if the template is malformed or has positional fields
+    """
+
+    def __init__(self, template):
+        self.template = template
+        self._paths = []
+        positional = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            positional.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is not None:
+                self._paths.append(_split(field, template))
+                positional.append("{" + str(len(self._paths) - 1))
+                positional.append("!" + conversion if conversion else "")
+                positional.append(":" + spec + "}" if spec else "}")
+        self._format = "".join(positional).format
+        self._format(*[MISSING] * len(self._paths))  # refuse unknown conversions now
+
+    def __repr__(self):
+        return "Description({0!r})".format(self.template)
+
+    def format(self, data):
+        """Return the description of the payload :code:`data`"""
+
+        if isinstance(data, LazyPayload):
+            values = []
+            for path in self._paths:
+                try:
+                    values.append(data.lookup(path))
+                except (LookupError, TypeError):
+                    values.append(MISSING)
+            return self._format(*values)
+
+        values = []
+        for path in self._paths:
+            value = data
+            try:
+                for key in path:
+                    value = value[key]
+            except (LookupError, TypeError):
+                value = MISSING
+            values.append(value)
+        return self._format(*values)
+
+
+def describe(event_type, data, descriptions=None):
+    """
+    Return the description of a delivery, or its event type if there is no template for it.
+
+    :param descriptions: Optional dict of event types to :class:`Description`, taking precedence
+                         over the templates of :data:`EVENT_DESCRIPTIONS`
+    """
+
+    description = descriptions.get(event_type) if descriptions else None
+    if description is None:
+        template = EVENT_DESCRIPTIONS.get(event_type)
+        if template is None:
+            return event_type
+        # Templates are compiled on first use, so that changes to EVENT_DESCRIPTIONS take effect
+        description = _compiled.get(template)
+        if description is None:
+            description = _compiled[template] = Description(template)
+    try:
+        return description.format(data)
+    except ValueError:  # a format spec that does not suit the value
+        return event_type
+
+
+def _split(field, template):
+    if not field or field[0].isdigit() or field[0] in ".[":
+        raise ValueError("Descriptions may only have named fields: {0!r}".format(template))
+
+    path = []
+    end = 0
+    for match in _FIELD.finditer(field):
+        if match.start() != end:
+            break
+        part = match.group(2) or match.group(1) or match.group(0)
+        path.append(int(part) if match.group(2) and part.isdigit() else part)
+        end = match.end()
+    if end != len(field):
+        raise ValueError("Invalid field {0!r} in {1!r}".format(field, template))
+    return tuple(path)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
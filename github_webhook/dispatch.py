@@ -0,0 +1,471 @@
+"""Strategies for running the hooks registered on a :class:`~github_webhook.Webhook`."""
+
+import collections
+import functools
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+
+from concurrent import futures
+
+import six
+
+from github_webhook.payload import _split
+from github_webhook.routing import _get, _key_function
+
+_clock = getattr(time, "monotonic", time.time)
+
+_POLL = 0.05  # seconds between checks for hooks started by a process pool
+
+
+class QueueFull(Exception):
+    """Raised by a dispatcher that cannot accept another delivery"""
+
+
+class DispatcherClosed(QueueFull):
+    """Raised by a dispatcher that was shut down"""
+
+
+class SerialDispatcher(object):
+    """
+    Run every hook inline, in the thread handling the request. This is the default, and the
+    response is only sent once all hooks have returned. A hook raising an exception does not
+    stop the following ones; the first exception is raised once they have all run.
+    """
+
+    asynchronous = False
+
+    def dispatch(self, hooks, data, on_complete=None):
+        """
+        Run :code:`hooks` with :code:`data`.
+
+        :param on_complete: Optional callable, passed whether every hook succeeded once they have
+                            all run
+        """
+
+        error = None
+        for hook in hooks:
+            try:
+                hook(data)
+            except Exception:
+                if error is not None:
+                    logging.getLogger("webhook").exception("Hook %s raised an exception", _name(hook))
+                error = error or sys.exc_info()
+
+        if on_complete is not None:
+            on_complete(error is None)
+        if error is not None:
+            six.reraise(*error)
+
+    def shutdown(self, wait=True, timeout=None):
+        """Nothing to drain; present for symmetry with the other dispatchers"""
+
+
+class PoolDispatcher(object):
+    """
+    Run hooks on a pool of worker threads or processes, so the webhook can acknowledge a delivery
+    with ``202 Accepted`` as soon as it has been verified and parsed.
+
+    :param max_workers: Number of workers in the pool
+    :param max_queue: Maximum number of deliveries that may be pending (queued or running) at once.
+                      Further deliveries are refused with ``503 Service Unavailable``.
+    :param hook_timeout: Optional number of seconds a single hook may run, counted from when it
+                         starts rather than when it is queued. A hook that overruns is logged and
+                         stops counting towards ``max_queue``; Python offers no way to stop a
+                         running thread, so it is left to finish in the background. Hooks still
+                         queued behind busy workers are never timed out; on a process pool, a
+                         hook starts once handed to the processes.
+    :param executor: ``"thread"`` or ``"process"``. Hooks and payloads must be picklable when
+                     running on a process pool.
+    """
+
+    asynchronous = True
+
+    def __init__(self, max_workers=4, max_queue=64, hook_timeout=None, executor="thread"):
+        if executor not in ("thread", "process"):
+            raise ValueError("executor must be 'thread' or 'process', not {0!r}".format(executor))
+
+        self.executor = executor
+        self._logger = logging.getLogger("webhook")
+        self._max_workers = max_workers
+        self._max_queue = max_queue
+        self._hook_timeout = hook_timeout
+        self._closed = False
+        self._start()
+
+    def after_fork(self):
+        """
+        Start afresh in a child process forked from this one, where the pool and the watchdog
+        threads are not running. The hooks pending in the parent are left to it.
+        """
+
+        self._start()
+
+    def _start(self):
+        if self.executor == "thread":
+            self._executor = futures.ThreadPoolExecutor(self._max_workers)
+        else:
+            self._executor = futures.ProcessPoolExecutor(self._max_workers)
+        self._slots = threading.BoundedSemaphore(self._max_queue)
+        self._cond = threading.Condition()
+        self._pending = {}  # future -> (hook, _Delivery)
+        self._deadlines = []  # heap of (deadline, count, future) of the hooks running
+        self._queued = []  # futures of a process pool not yet started, when hooks have a timeout
+        self._counter = itertools.count()
+        self._watchdog = None
+
+        if self._hook_timeout is not None:
+            self._watchdog = threading.Thread(target=self._watch, name="webhook-watchdog")
+            self._watchdog.daemon = True
+            self._watchdog.start()
+
+    @property
+    def pending(self):
+        """Number of hook invocations that are queued or running"""
+
+        with self._cond:
+            return len(self._pending)
+
+    def dispatch(self, hooks, data, on_complete=None):
+        """
+        Queue :code:`hooks` to run with :code:`data`.
+
+        :param on_complete: Optional callable, passed whether every hook succeeded once they have
+                            all finished or timed out. It runs on a worker thread.
+        :raises QueueFull: if :code:`max_queue` deliveries are already pending, or the dispatcher
+                           is shutting down
+        """
+
+        if not hooks:
+            if on_complete is not None:
+                on_complete(True)
+            return
+
+        with self._cond:
+            if self._closed:
+                raise DispatcherClosed("Dispatcher is shutting down")
+
+        if not self._slots.acquire(False):
+            raise QueueFull("Too many pending deliveries")
+
+        delivery = _Delivery(on_complete)
+        submitted = []
+        with self._cond:
+            for hook in hooks:
+                if self._hook_timeout is None:
+                    future = self._executor.submit(hook, data)
+                elif self.executor == "thread":
+                    # The hook arms its own deadline once it starts, which is after the future is
+                    # stored: that needs this lock
+                    started = _Started(self, hook)
+                    future = started.future = self._executor.submit(started, data)
+                else:
+                    future = self._executor.submit(hook, data)
+                    self._queued.append(future)
+                delivery.futures.add(future)
+                submitted.append((hook, future))
+                self._pending[future] = (hook, delivery)
+            self._cond.notify_all()
+
+        for hook, future in submitted:
+            future.add_done_callback(functools.partial(self._on_done, hook))
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop accepting deliveries and, if :code:`wait` is true, drain the ones already accepted.
+
+        :param wait: Block until pending hooks have finished
+        :param timeout: Optional maximum number of seconds to wait for the drain
+        """
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            if wait:
+                deadline = None if timeout is None else _clock() + timeout
+                while self._pending:
+                    remaining = None if deadline is None else deadline - _clock()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+
+        self._executor.shutdown(wait=wait and not self.pending)
+        if self._watchdog is not None and wait:
+            self._watchdog.join(timeout)
+
+    def _arm(self, future):
+        heapq.heappush(self._deadlines, (_clock() + self._hook_timeout, next(self._counter), future))
+        self._cond.notify_all()
+
+    def _on_done(self, hook, future):
+        error = future.exception()
+        if error is not None:
+            self._logger.error("Hook %s raised an exception", _name(hook), exc_info=error)
+        self._finish(future, succeeded=error is None)
+
+    def _finish(self, future, succeeded):
+        with self._cond:
+            entry = self._pending.get(future)
+            if entry is None or future not in entry[1].futures:
+                return
+            delivery = entry[1]
+            delivery.futures.discard(future)
+            delivery.succeeded = delivery.succeeded and succeeded
+            complete = not delivery.futures
+
+        # The delivery stays pending until its callback has run, so that a draining shutdown()
+        # waits for it
+        try:
+            if complete and delivery.on_complete is not None:
+                delivery.on_complete(delivery.succeeded)
+        finally:
+            with self._cond:
+                del self._pending[future]
+                if complete:
+                    self._slots.release()
+                self._cond.notify_all()
+
+    def _watch(self):
+        while True:
+            with self._cond:
+                if self._closed and not self._pending:
+                    return
+
+                # A process pool runs hooks elsewhere: their start is only seen by polling
+                queued, self._queued = self._queued, []
+                for future in queued:
+                    if future.running():
+                        self._arm(future)
+                    elif not future.done():
+                        self._queued.append(future)
+                poll = _POLL if self._queued else None
+
+                if not self._deadlines:
+                    self._cond.wait(poll)
+                    continue
+
+                deadline, _, future = self._deadlines[0]
+                remaining = deadline - _clock()
+                if remaining > 0:
+                    self._cond.wait(remaining if poll is None else min(remaining, poll))
+                    continue
+
+                heapq.heappop(self._deadlines)
+                entry = self._pending.get(future)
+
+            if entry is not None and not future.done():
+                self._logger.warning("Hook %s timed out after %ss", _name(entry[0]), self._hook_timeout)
+                self._finish(future, succeeded=False)
+
+
+class KeyedDispatcher(object):
+    """
+    Run the deliveries sharing a key, by default their repository, one at a time and in the order
+    they arrived, while deliveries with different keys run in parallel on a pool of threads. The
+    hooks of a delivery run one after the other, so a ``push`` is fully handled before the
+    ``status`` and ``deployment`` events that follow it.
+
+    Keys take turns: a thread runs a single delivery of a key before moving on to the next key
+    with deliveries waiting, so a busy repository does not hold up the others. Deliveries without
+    the key, such as ``ping`` events, share a queue of their own.
+
+    :param max_workers: Number of threads, and thus of keys whose deliveries run at once
+    :param max_queue: Maximum number of deliveries that may be pending (queued or running) for a
+                      single key. Further deliveries for it are refused with
+                      ``503 Service Unavailable``.
+    :param max_pending: Maximum number of deliveries pending for all keys together
+    :param key: Dotted path of the payload field deliveries are ordered by, list of such paths,
+                or function returning the key of a payload
+    """
+
+    asynchronous = True
+
+    def __init__(self, max_workers=4, max_queue=64, max_pending=1024, key="repository.full_name"):
+        if isinstance(key, six.string_types):
+            path = _split(key)
+            key = functools.partial(_get, path=path)
+        elif not callable(key):
+            key = _key_function([_split(path) for path in key])
+
+        self._key = key
+        self._max_workers = max_workers
+        self._max_queue = max_queue
+        self._max_pending = max_pending
+        self._logger = logging.getLogger("webhook")
+        self._closed = False
+        self._start()
+
+    def after_fork(self):
+        """
+        Start afresh in a child process forked from this one, where the pool threads are not
+        running. The deliveries pending in the parent are left to it.
+        """
+
+        self._start()
+
+    def _start(self):
+        self._executor = futures.ThreadPoolExecutor(self._max_workers)
+        self._cond = threading.Condition()
+        self._queues = {}  # key -> deque of _Ordered, the first of which is running or scheduled
+        self._pending = 0
+
+    @property
+    def pending(self):
+        """Number of deliveries that are queued or running"""
+
+        with self._cond:
+            return self._pending
+
+    def depths(self):
+        """Return a dict of each key with pending deliveries to their number, running one included"""
+
+        with self._cond:
+            return dict((key, len(queue)) for key, queue in self._queues.items())
+
+    def dispatch(self, hooks, data, on_complete=None):
+        """
+        Queue :code:`hooks` to run with :code:`data`, after the deliveries pending for its key.
+
+        :param on_complete: Optional callable, passed whether every hook succeeded once they have
+                            all run. It runs on a worker thread.
+        :raises QueueFull: if :code:`max_queue` deliveries are already pending for the key, or
+                           :code:`max_pending` in all, or the dispatcher is shutting down
+        """
+
+        if not hooks:
+            if on_complete is not None:
+                on_complete(True)
+            return
+
+        key = self._key(data)
+        with self._cond:
+            if self._closed:
+                raise DispatcherClosed("Dispatcher is shutting down")
+            if self._pending >= self._max_pending:
+                raise QueueFull("Too many pending deliveries")
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = collections.deque()
+            elif len(queue) >= self._max_queue:
+                raise QueueFull("Too many pending deliveries for {0}".format(key))
+            queue.append(_Ordered(hooks, data, on_complete))
+            self._pending += 1
+            schedule = len(queue) == 1
+
+        if schedule:
+            self._executor.submit(self._run, key)
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop accepting deliveries and, if :code:`wait` is true, drain the ones already accepted.
+
+        :param wait: Block until pending deliveries have run
+        :param timeout: Optional maximum number of seconds to wait for the drain
+        """
+
+        with self._cond:
+            self._closed = True
+            if wait:
+                deadline = None if timeout is None else _clock() + timeout
+                while self._pending:
+                    remaining = None if deadline is None else deadline - _clock()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            drained = not self._pending
+
+        self._executor.shutdown(wait=wait and drained)
+
+    def _run(self, key):
+        with self._cond:
+            delivery = self._queues[key][0]
+
+        succeeded = True
+        for hook in delivery.hooks:
+            try:
+                hook(delivery.data)
+            except Exception:
+                succeeded = False
+                self._logger.exception("Hook %s raised an exception", _name(hook))
+        if delivery.on_complete is not None:
+            try:
+                delivery.on_complete(succeeded)
+            except Exception:
+                self._logger.exception("Completion callback raised an exception")
+
+        with self._cond:
+            queue = self._queues[key]
+            queue.popleft()
+            self._pending -= 1
+            if not queue:
+                del self._queues[key]
+            self._cond.notify_all()
+
+        # The next delivery of the key goes to the back of the line, behind the other keys
+        if queue:
+            try:
+                self._executor.submit(self._run, key)
+            except RuntimeError:  # shut down without waiting: the rest is abandoned
+                pass
+
+
+class _Delivery(object):
+    """The hook invocations still pending for a delivery"""
+
+    __slots__ = ("futures", "succeeded", "on_complete")
+
+    def __init__(self, on_complete):
+        self.futures = set()
+        self.succeeded = True
+        self.on_complete = on_complete
+
+
+class _Started(object):
+    """A hook run on a thread pool, arming its deadline when it starts"""
+
+    __slots__ = ("dispatcher", "hook", "future")
+
+    def __init__(self, dispatcher, hook):
+        self.dispatcher = dispatcher
+        self.hook = hook
+        self.future = None
+
+    def __call__(self, data):
+        with self.dispatcher._cond:
+            self.dispatcher._arm(self.future)
+        return self.hook(data)
+
+
+class _Ordered(object):
+    """A delivery waiting in the queue of its key"""
+
+    __slots__ = ("hooks", "data", "on_complete")
+
+    def __init__(self, hooks, data, on_complete):
+        self.hooks = hooks
+        self.data = data
+        self.on_complete = on_complete
+
+
+def _name(hook):
+    return getattr(hook, "__name__", repr(hook))
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,213 @@
+"""Compact, slotted classes holding the fields of common events that most hooks read."""
+
+from github_webhook.payload import LazyPayload, _split
+from github_webhook.routing import _get
+
+_compiled = {}  # class -> [(attribute, path, Record subclass or None)]
+
+
+class Record(object):
+    """
+    Base of the classes holding some fields of a payload, each in a slot. Subclasses list them in
+    :code:`FIELDS`, as pairs of an attribute name and the dotted path it is read from, or a pair
+    of a dotted path and the :class:`Record` subclass holding the object there. Fields missing
+    from the payload are None, as are records all of whose fields are.
+
+    :param data: The payload, a dict or :class:`~github_webhook.payload.LazyPayload`
+    :param prefix: Path of the object the record is read from, within :code:`data`
+    """
+
+    __slots__ = ()
+
+    FIELDS = ()
+
+    def __init__(self, data, prefix=()):
+        for name, path, record in _fields(type(self)):
+            if record is not None:
+                value = record(data, prefix + path)
+                if all(getattr(value, slot) is None for slot, _, _ in _fields(record)):
+                    value = None
+            else:
+                value = _get(data, prefix + path)
+            setattr(self, name, value)
+
+    def __repr__(self):
+        fields = ", ".join("{0}={1!r}".format(name, getattr(self, name)) for name, _, _ in _fields(type(self)))
+        return "{0}({1})".format(type(self).__name__, fields)
+
+
+class User(Record):
+    """A user or organization, such as the sender of an event"""
+
+    FIELDS = (("login", "login"), ("id", "id"), ("type", "type"))
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+class Repository(Record):
+    """The repository an event happened in"""
+
+    FIELDS = (
+        ("id", "id"),
+        ("full_name", "full_name"),
+        ("name", "name"),
+        ("owner", "owner.login"),
+        ("private", "private"),
+        ("default_branch", "default_branch"),
+        ("html_url", "html_url"),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS)
+
+
+class Event(Record):
+    """
+    The fields common to most events. With :code:`lazy_payloads`, the whole payload stays
+    reachable as :attr:`payload`, and is only decoded if it is read. A payload decoded already
+    is not kept, so that events hold no more than their fields.
+    """
+
+    FIELDS = (("action", "action"), ("repository", ("repository", Repository)), ("sender", ("sender", User)))
+    __slots__ = tuple(name for name, _ in FIELDS) + ("_payload",)
+
+    def __init__(self, data):
+        super(Event, self).__init__(data)
+        self._payload = data if isinstance(data, LazyPayload) else None
+
+    @property
+    def payload(self):
+        """The :class:`~github_webhook.payload.LazyPayload` the event was built from, or None"""
+
+        return self._payload
+
+
+class PushEvent(Event):
+    """A ``push`` event"""
+
+    FIELDS = Event.FIELDS + (
+        ("ref", "ref"),
+        ("before", "before"),
+        ("after", "after"),
+        ("created", "created"),
+        ("deleted", "deleted"),
+        ("forced", "forced"),
+        ("compare", "compare"),
+        ("head_commit", "head_commit.id"),
+        ("pusher", "pusher.name"),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS[len(Event.FIELDS) :])
+
+    @property
+    def branch(self):
+        """The branch pushed to, or None if a tag was"""
+
+        prefix = "refs/heads/"
+        return self.ref[len(prefix) :] if self.ref is not None and self.ref.startswith(prefix) else None
+
+
+class PullRequestEvent(Event):
+    """A ``pull_request`` event"""
+
+    FIELDS = Event.FIELDS + (
+        ("number", "number"),
+        ("title", "pull_request.title"),
+        ("state", "pull_request.state"),
+        ("draft", "pull_request.draft"),
+        ("merged", "pull_request.merged"),
+        ("head_ref", "pull_request.head.ref"),
+        ("head_sha", "pull_request.head.sha"),
+        ("base_ref", "pull_request.base.ref"),
+        ("html_url", "pull_request.html_url"),
+        ("author", ("pull_request.user", User)),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS[len(Event.FIELDS) :])
+
+
+class IssuesEvent(Event):
+    """An ``issues`` event"""
+
+    FIELDS = Event.FIELDS + (
+        ("number", "issue.number"),
+        ("title", "issue.title"),
+        ("state", "issue.state"),
+        ("html_url", "issue.html_url"),
+        ("author", ("issue.user", User)),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS[len(Event.FIELDS) :])
+
+
+class WorkflowRunEvent(Event):
+    """A ``workflow_run`` event"""
+
+    FIELDS = Event.FIELDS + (
+        ("id", "workflow_run.id"),
+        ("name", "workflow_run.name"),
+        ("event", "workflow_run.event"),
+        ("status", "workflow_run.status"),
+        ("conclusion", "workflow_run.conclusion"),
+        ("head_branch", "workflow_run.head_branch"),
+        ("head_sha", "workflow_run.head_sha"),
+        ("run_number", "workflow_run.run_number"),
+        ("run_attempt", "workflow_run.run_attempt"),
+        ("html_url", "workflow_run.html_url"),
+    )
+    __slots__ = tuple(name for name, _ in FIELDS[len(Event.FIELDS) :])
+
+
+#: Class of the typed events of each event type; others are built as an :class:`Event`
+EVENT_CLASSES = {
+    "issues": IssuesEvent,
+    "pull_request": PullRequestEvent,
+    "push": PushEvent,
+    "workflow_run": WorkflowRunEvent,
+}
+
+
+class TypedHook(object):
+    """
+    Wraps a hook so that it receives an :class:`Event` built from each payload rather than the
+    payload itself. Coroutine hooks stay coroutine hooks.
+
+    :param hook: The hook to call
+    :param event_class: The :class:`Event` subclass to build
+    """
+
+    def __init__(self, hook, event_class):
+        self.__wrapped__ = hook
+        self.__name__ = getattr(hook, "__name__", repr(hook))
+        self.event_class = event_class
+
+    def __call__(self, data):
+        return self.__wrapped__(self.event_class(data))
+
+
+def typed_event(event_type, data):
+    """Return the typed event of :code:`event_type` built from the payload :code:`data`"""
+
+    return EVENT_CLASSES.get(event_type, Event)(data)
+
+
+def _fields(cls):
+    fields = _compiled.get(cls)
+    if fields is None:
+        fields = []
+        for name, spec in cls.FIELDS:
+            path, record = spec if isinstance(spec, tuple) else (spec, None)
+            fields.append((name, _split(path), record))
+        fields = _compiled[cls] = fields
+    return fields
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,290 @@
+"""A hook relaying verified deliveries, as received, to downstream services over pooled connections."""
+
+import collections
+import logging
+import socket
+import threading
+import time
+
+from concurrent import futures
+from six.moves import http_client
+from six.moves.urllib.parse import urlsplit
+
+#: Headers relayed with each delivery, by name or prefix
+FORWARDED_HEADERS = ("content-type", "user-agent", "x-github-", "x-hub-signature")
+
+_clock = getattr(time, "monotonic", time.time)
+
+logger = logging.getLogger("webhook")
+
+
+class ForwardingError(Exception):
+    """
+    Raised by a :class:`ForwardHook` when some targets did not accept a delivery.
+
+    :param failures: Dict of the URL of each of those targets to the reason
+    """
+
+    def __init__(self, failures):
+        super(ForwardingError, self).__init__(
+            "Forwarding failed: " + ", ".join("{0} ({1})".format(url, failures[url]) for url in sorted(failures))
+        )
+        self.failures = failures
+
+
+class ForwardHook(object):
+    """
+    A hook posting each delivery, with its raw body and GitHub headers, to every target at once,
+    over persistent connections kept in a pool per target. Register it like any other hook; the
+    webhook hands it the raw delivery rather than the payload. It raises a
+    :class:`ForwardingError` once every target has been tried if any of them failed, so that
+    the delivery stays in the journal, if any.
+
+    A target failing with a connection error, a timeout, ``429`` or a ``5xx`` status is retried
+    with exponential backoff; other statuses fail right away. After :code:`failure_threshold`
+    deliveries in a row failed, the circuit to the target opens: deliveries to it fail at once,
+    until one is let through every :code:`reset_timeout` seconds to probe it, and succeeds.
+
+    :param targets: URLs deliveries are posted to, such as ``"http://ci.internal/github"``, or
+        dicts of a :code:`url` to the :code:`timeout`, :code:`retries`, :code:`backoff` and
+        :code:`max_connections` of that target, overriding those of the hook
+    :param timeout: Number of seconds to wait for a target to connect, and then to respond
+    :param retries: Number of times a delivery is tried again on a target
+    :param backoff: Number of seconds before the first retry, doubled for each following one
+    :param max_connections: Maximum number of connections to each target
+    :param failure_threshold: Number of failed deliveries in a row that opens the circuit
+    :param reset_timeout: Number of seconds the circuit stays open
+    :param name: Name of the hook, used in its metrics and logs
+    """
+
+    def __init__(
+        self,
+        targets,
+        timeout=10,
+        retries=2,
+        backoff=0.1,
+        max_connections=4,
+        failure_threshold=5,
+        reset_timeout=30,
+        name="forward",
+    ):
+        if not targets:
+            raise ValueError("A forwarding hook needs at least one target")
+
+        defaults = dict(timeout=timeout, retries=retries, backoff=backoff, max_connections=max_connections)
+        self.targets = [_Target(**_settings(target, defaults)) for target in targets]
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.__name__ = name
+        self._executor = futures.ThreadPoolExecutor(sum(target.max_connections for target in self.targets))
+
+    def __call__(self, data):
+        raise TypeError("A forwarding hook needs the raw delivery; register it on a webhook")
+
+    def bind(self, headers, body):
+        """Return a hook forwarding the delivery of :code:`headers` and :code:`body`"""
+
+        return _Forwarding(self, headers, body)
+
+    def forward(self, headers, body):
+        """
+        Post a delivery to every target at once, and return once they have all been tried.
+
+        :param headers: Mapping of lower-cased request header names to values
+        :param body: Raw request body, as a bytes-like object
+        :raises ForwardingError: if some targets did not accept it
+        """
+
+        headers = dict((k, v) for k, v in headers.items() if k.startswith(FORWARDED_HEADERS))
+        headers.pop("x-github-webhook-tenant", None)
+        body = bytes(body)
+
+        pending = [(target, self._executor.submit(self._deliver, target, headers, body)) for target in self.targets]
+        failures = {}
+        for target, future in pending:
+            reason = future.result()
+            if reason is not None:
+                failures[target.url] = reason
+        if failures:
+            raise ForwardingError(failures)
+
+    def close(self, wait=True):
+        """
+        Stop forwarding deliveries, and close the idle connections.
+
+        :param wait: Block until the deliveries being forwarded are done
+        """
+
+        self._executor.shutdown(wait=wait)
+        for target in self.targets:
+            target.close()
+
+    def after_fork(self):
+        """
+        Start afresh in a child process forked from this one, where the threads posting
+        deliveries are not running, without the connections opened by the parent.
+        """
+
+        self._executor = futures.ThreadPoolExecutor(sum(target.max_connections for target in self.targets))
+        for target in self.targets:
+            target.after_fork()
+
+    def _deliver(self, target, headers, body):
+        """Post a delivery to a target, retrying it; return None, or the reason it failed"""
+
+        if not target.allow(self.reset_timeout):
+            return "circuit open"
+
+        attempt = 0
+        while True:
+            try:
+                status = target.post(headers, body)
+            except (http_client.HTTPException, socket.error, OSError) as e:
+                reason, retry = str(e) or type(e).__name__, True
+            else:
+                if status < 300:
+                    target.record(True, self.failure_threshold)
+                    return None
+                reason, retry = "status {0}".format(status), status == 429 or status >= 500
+
+            if not retry or attempt >= target.retries:
+                break
+            time.sleep(target.backoff * 2**attempt)
+            attempt += 1
+
+        logger.warning("Forwarding to %s failed after %d attempts: %s", target.url, attempt + 1, reason)
+        if target.record(False, self.failure_threshold):
+            logger.error("Opened the circuit to %s after %d failures", target.url, self.failure_threshold)
+        return reason
+
+
+def _settings(target, defaults):
+    """Return the settings of a target given as a URL or a dict, completed with :code:`defaults`"""
+
+    if not isinstance(target, dict):
+        target = {"url": target}
+    unknown = set(target) - set(defaults) - {"url"}
+    if "url" not in target or unknown:
+        raise ValueError("Targets need a url, and may only set {0}: {1!r}".format(", ".join(sorted(defaults)), target))
+    settings = dict(defaults)
+    settings.update(target)
+    return settings
+
+
+class _Forwarding(object):
+    """A forwarding hook bound to a delivery"""
+
+    def __init__(self, forwarder, headers, body):
+        self.__wrapped__ = forwarder
+        self.__name__ = forwarder.__name__
+        self._headers = headers
+        self._body = body
+
+    def __call__(self, data):
+        self.__wrapped__.forward(self._headers, self._body)
+
+
+class _Target(object):
+    """A downstream service, with its pool of idle connections and its circuit breaker"""
+
+    def __init__(self, url, timeout, retries, backoff, max_connections):
+        parts = urlsplit(url)
+        if parts.scheme == "http":
+            self._connection_class = http_client.HTTPConnection
+        elif parts.scheme == "https":
+            self._connection_class = http_client.HTTPSConnection
+        else:
+            raise ValueError("Targets must be http or https URLs, not {0!r}".format(url))
+
+        self.url = url
+        self._netloc = parts.netloc
+        self._path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self._failures = 0
+        self._opened = None  # when the circuit was opened, or last probed
+        self.after_fork()
+
+    def after_fork(self):
+        """Drop the connections and locks of the process this one was forked from"""
+
+        self._idle = collections.deque()
+        self._slots = threading.BoundedSemaphore(self.max_connections)
+        self._lock = threading.Lock()
+
+    def allow(self, reset_timeout):
+        """Return whether a delivery may be posted, letting one through to probe an open circuit"""
+
+        with self._lock:
+            if self._opened is None:
+                return True
+            if _clock() - self._opened < reset_timeout:
+                return False
+            self._opened = _clock()
+            return True
+
+    def record(self, succeeded, failure_threshold):
+        """Record the outcome of a delivery; return whether it opened the circuit"""
+
+        with self._lock:
+            if succeeded:
+                self._failures = 0
+                self._opened = None
+                return False
+            self._failures += 1
+            opened = self._opened is None and self._failures >= failure_threshold
+            if self._failures >= failure_threshold:
+                self._opened = _clock()
+            return opened
+
+    def post(self, headers, body):
+        """Post a delivery on a pooled connection, and return the status of the response"""
+
+        with self._slots:
+            try:
+                connection = self._idle.pop()
+            except IndexError:
+                connection = None
+            if connection is not None:
+                try:
+                    return self._post(connection, headers, body)
+                except (http_client.HTTPException, socket.error, OSError):
+                    pass  # the target closed the idle connection: try a new one
+            return self._post(self._connection_class(self._netloc, timeout=self.timeout), headers, body)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+    def _post(self, connection, headers, body):
+        try:
+            connection.request("POST", self._path, body, headers)
+            response = connection.getresponse()
+            response.read()
+        except Exception:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self._idle.append(connection)
+        return response.status
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,322 @@
+"""
+Append-only, on-disk journal of the deliveries accepted, so that those whose hooks did not complete
+can be replayed. Run ``python -m github_webhook.journal --help`` for the command-line interface.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import importlib
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import zlib
+
+import six
+
+from github_webhook.decoders import _bytes
+from github_webhook.workers import WORKER_ENV
+
+#: Headers stored with each delivery; the rest are not needed to replay it
+JOURNAL_HEADERS = ("content-type", "x-github-", "x-hub-signature")
+
+_RECORD = struct.Struct(">cIQI")  # kind, crc32 of payload, sequence number, payload length
+_DELIVERY = b"D"
+_DONE = b"C"
+_SUFFIX = ".journal"
+
+Entry = collections.namedtuple("Entry", ["seq", "headers", "body"])
+
+logger = logging.getLogger("webhook")
+
+
+class Journal(object):
+    """
+    Journal of the deliveries handed to hooks, kept in segment files of a directory.
+
+    Each delivery is appended, with its body and the headers needed to replay it, before its hooks
+    run, and is marked done once they have all succeeded. :meth:`append` only returns once the
+    delivery is on disk; concurrent appends share a single ``fsync``. Done marks are not synced,
+    so after a crash a delivery may be replayed although its hooks had completed.
+
+    Segments are rotated once they reach :code:`segment_size` bytes, and deleted once every
+    delivery they and the older segments hold is done: a segment also holds the done marks of
+    deliveries in older ones, which must outlive them. Reopening the directory recovers the
+    deliveries still pending, ignoring any record torn by a crash.
+
+    :param directory: Directory holding the segments; created if needed
+    :param segment_size: Size in bytes after which a new segment is started
+    :param fsync: Whether to wait for appended deliveries to reach the disk. Disable only when
+                  durability does not matter, such as when load-testing hooks.
+    :param read_only: Only list the deliveries pending, leaving the directory untouched, so that
+                      the journal of a running webhook can be inspected. Its torn records, such as
+                      one being appended, are skipped rather than truncated, and :meth:`append`
+                      and :meth:`done` raise :class:`ValueError`. Journals are always read-only in
+                      the processes of a :class:`~github_webhook.workers.WorkerFleet`, which
+                      import the webhook, and so build its journal, but leave journaling to the
+                      process feeding them.
+    """
+
+    def __init__(self, directory, segment_size=64 << 20, fsync=True, read_only=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.fsync = fsync
+        self.read_only = read_only or WORKER_ENV in os.environ
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._pending = {}  # seq -> (segment, offset of the record)
+        self._segment_pending = collections.Counter()
+        self._written = 0
+        self._synced = 0
+        self._file = None
+
+        if not os.path.isdir(directory) and not self.read_only:
+            os.makedirs(directory)
+
+        next_seq, last_segment = 1, 0
+        segments = self._segments()
+        for segment in segments:
+            last_segment = segment
+            for kind, seq, offset, _ in self._scan(segment, truncate=not self.read_only):
+                if kind == _DELIVERY:
+                    self._pending[seq] = (segment, offset)
+                    self._segment_pending[segment] += 1
+                elif seq in self._pending:
+                    self._segment_pending[self._pending.pop(seq)[0]] -= 1
+                next_seq = max(next_seq, seq + 1)
+
+        self._next_seq = next_seq
+        self._oldest = segments[0] if segments else 1
+        if not self.read_only:
+            self._open(last_segment + 1)
+
+    def __len__(self):
+        """Number of deliveries not done yet"""
+
+        with self._lock:
+            return len(self._pending)
+
+    def append(self, headers, body):
+        """
+        Record a delivery, and return its sequence number once it is on disk.
+
+        :param headers: Mapping of lower-cased request header names to values
+        :param body: Raw request body, as a bytes-like object
+        """
+
+        self._check_writable()
+        if six.PY2 and not isinstance(body, bytes):  # pragma: no cover
+            body = _bytes(body)  # zlib only takes strings and read-only buffers there
+        headers = dict((k, v) for k, v in headers.items() if k.startswith(JOURNAL_HEADERS))
+        encoded = json.dumps(headers, sort_keys=True).encode("utf-8")
+        prefix = struct.pack(">I", len(encoded)) + encoded
+        crc = zlib.crc32(body, zlib.crc32(prefix)) & 0xFFFFFFFF
+
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            if self._size and self._size + _RECORD.size + len(prefix) + len(body) > self.segment_size:
+                self._open(self._segment + 1)
+            self._pending[seq] = (self._segment, self._size)
+            self._segment_pending[self._segment] += 1
+            self._write(_RECORD.pack(_DELIVERY, crc, seq, len(prefix) + len(body)), prefix, body)
+            written = self._written
+
+        self._sync(written)
+        return seq
+
+    def done(self, seq):
+        """Mark the delivery :code:`seq` as done, so that it is not replayed"""
+
+        self._check_writable()
+        with self._lock:
+            entry = self._pending.pop(seq, None)
+            if entry is None:
+                return
+            self._write(_RECORD.pack(_DONE, 0, seq, 0))
+            self._segment_pending[entry[0]] -= 1
+            if entry[0] == self._oldest:
+                self._collect()
+
+    def entries(self):
+        """Yield every delivery not done yet, as an :class:`Entry`, oldest first"""
+
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+            pending = sorted((segment, offset, seq) for seq, (segment, offset) in self._pending.items())
+
+        handle, current = None, None
+        try:
+            for segment, offset, seq in pending:
+                if segment != current:
+                    if handle is not None:
+                        handle.close()
+                    try:
+                        handle = open(self._path(segment), "rb")
+                    except (IOError, OSError):  # deleted since: every delivery in it is done
+                        handle, current = None, None
+                        continue
+                    current = segment
+                handle.seek(offset)
+                _, _, _, length = _RECORD.unpack(handle.read(_RECORD.size))
+                payload = handle.read(length)
+                (headers_length,) = struct.unpack(">I", payload[:4])
+                headers = json.loads(payload[4 : 4 + headers_length].decode("utf-8"))
+                yield Entry(seq, headers, payload[4 + headers_length :])
+        finally:
+            if handle is not None:
+                handle.close()
+
+    def sync(self):
+        """Write every record to disk, including done marks"""
+
+        with self._lock:
+            written = self._written
+        self._sync(written)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+    def _check_writable(self):
+        if self.read_only:
+            raise ValueError("Journal {0} was opened read-only".format(self.directory))
+
+    def _write(self, *chunks):
+        for chunk in chunks:
+            self._file.write(chunk)
+            self._size += len(chunk)
+        self._written += 1
+
+    def _sync(self, target):
+        # Group commit: whoever holds the sync lock flushes everything written so far, and the
+        # appends that were waiting for it find their record already on disk
+        with self._sync_lock:
+            if self._synced >= target:
+                return
+            with self._lock:
+                self._file.flush()
+                written = self._written
+                fd = os.dup(self._file.fileno()) if self.fsync else None
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            self._synced = written
+
+    def _open(self, segment):
+        if self._file is not None:
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._file.close()
+        self._segment = segment
+        self._file = open(self._path(segment), "ab")
+        self._size = 0
+        self._collect()
+
+    def _collect(self):
+        """Delete the oldest segments, but the current one, while every delivery they hold is done"""
+
+        while self._oldest < self._segment and not self._segment_pending[self._oldest]:
+            del self._segment_pending[self._oldest]
+            path = self._path(self._oldest)
+            if os.path.exists(path):  # the numbering may have gaps, left by older journals
+                os.remove(path)
+            self._oldest += 1
+
+    def _segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = (name[: -len(_SUFFIX)] for name in os.listdir(self.directory) if name.endswith(_SUFFIX))
+        return sorted(int(name) for name in names if name.isdigit())
+
+    def _path(self, segment):
+        return os.path.join(self.directory, "{0:012d}{1}".format(segment, _SUFFIX))
+
+    def _scan(self, segment, truncate=False):
+        """Yield the kind, sequence number and offset of each record of a segment"""
+
+        with open(self._path(segment), "rb") as handle:
+            data = handle.read()
+
+        offset = 0
+        while offset + _RECORD.size <= len(data):
+            kind, crc, seq, length = _RECORD.unpack_from(data, offset)
+            end = offset + _RECORD.size + length
+            if kind not in (_DELIVERY, _DONE) or end > len(data):
+                break
+            if kind == _DELIVERY and zlib.crc32(data[offset + _RECORD.size : end]) & 0xFFFFFFFF != crc:
+                break
+            yield kind, seq, offset, length
+            offset = end
+
+        if offset < len(data) and truncate:
+            logger.warning("Discarding %d torn bytes at the end of %s", len(data) - offset, self._path(segment))
+            with open(self._path(segment), "r+b") as handle:
+                handle.truncate(offset)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m github_webhook.journal", description=__doc__.split(".")[0])
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True  # as they always are on Python 2
+    list_parser = commands.add_parser("list", help="list the deliveries not done yet")
+    list_parser.add_argument("directory", help="journal directory")
+    replay_parser = commands.add_parser("replay", help="replay the deliveries not done yet")
+    replay_parser.add_argument("directory", help="journal directory")
+    replay_parser.add_argument("webhook", help="webhook to replay them through, as module:attribute")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        journal = Journal(args.directory, read_only=True)  # the webhook may be appending to it
+        for entry in journal.entries():
+            print(
+                entry.seq,
+                entry.headers.get("x-github-delivery", "-"),
+                entry.headers.get("x-github-event", "-"),
+                len(entry.body),
+            )
+        journal.close()
+    else:
+        module, _, attribute = args.webhook.partition(":")
+        sys.path.insert(0, os.getcwd())
+        webhook = getattr(importlib.import_module(module), attribute)
+        journal = Journal(args.directory)
+        count = webhook.replay(journal)
+        webhook.shutdown()
+        journal.close()
+        print("Replayed {0} deliveries, {1} still pending".format(count, len(journal)))
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,101 @@
+"""Memoisation of hooks and of the expensive steps they share, keyed by fields of the payload."""
+
+import inspect
+import threading
+
+import six
+
+from github_webhook.cache import LRUCache
+from github_webhook.payload import _split
+from github_webhook.routing import _key_function
+
+_MISSING = object()
+
+
+class MemoizedHook(object):
+    """
+    Wraps a function of a payload, such as a hook or a step several hooks share, so that it runs
+    once for the payloads with the same key: its result is cached, and returned for the following
+    ones until it expires or is evicted. Deliveries describing the same object, such as the
+    ``check_run`` and ``status`` events of one commit, thus pay for it once.
+
+    Exceptions are not cached. While the function runs for a key, concurrent calls for that key
+    wait for its result rather than running it too. Payloads lacking the key are not cached.
+
+    :param func: The synchronous function to memoise
+    :param key: Dotted path, such as ``"check_run.head_sha"``, list of dotted paths, or function
+                returning the key of a payload
+    :param max_size: Maximum number of results cached; the least recently used are evicted
+    :param ttl: Optional number of seconds results are cached for
+    :param metrics: Optional :class:`~github_webhook.metrics.MetricsSink` counting hits and misses
+    :param name: Name of the function, used as the label of its metrics
+    """
+
+    def __init__(self, func, key, max_size=1024, ttl=None, metrics=None, name=None):
+        iscoroutinefunction = getattr(inspect, "iscoroutinefunction", None)
+        if iscoroutinefunction is not None and iscoroutinefunction(func):
+            raise TypeError("Coroutine functions cannot be memoized")
+
+        if isinstance(key, six.string_types):
+            key = [key]
+        self.__wrapped__ = func
+        self.__name__ = name or getattr(func, "__name__", repr(func))
+        self.cache = LRUCache(max_size, ttl)
+        self.metrics = metrics
+        self.hits = 0
+        self.misses = 0
+        self._key = key if callable(key) else _key_function([_split(path) for path in key])
+        self._lock = threading.Lock()
+        self._running = {}  # key -> Event set once the function has returned for it
+
+    def __call__(self, data):
+        key = self._key(data)
+        if key is None or (isinstance(key, tuple) and None in key):
+            return self.__wrapped__(data)
+
+        while True:
+            with self._lock:
+                value = self.cache.get(key, _MISSING)
+                if value is not _MISSING:
+                    self._count("hit")
+                    return value
+                running = self._running.get(key)
+                if running is None:
+                    running = self._running[key] = threading.Event()
+                    self._count("miss")
+                    break
+            running.wait()  # then look in the cache again, or run the function if it raised
+
+        try:
+            value = self.__wrapped__(data)
+            self.cache.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                del self._running[key]
+            running.set()
+
+    def _count(self, result):
+        if result == "hit":
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.metrics is not None:
+            self.metrics.increment("github_webhook_memo_total", {"hook": self.__name__, "result": result})
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
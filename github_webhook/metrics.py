@@ -0,0 +1,223 @@
+"""Metrics about deliveries and hooks, and a sink exposing them in the Prometheus text format."""
+
+import threading
+import time
+
+_clock = getattr(time, "perf_counter", time.time)
+
+#: Metrics recorded by :class:`~github_webhook.core.WebhookCore`: type and description
+METRICS = {
+    "github_webhook_deliveries_total": ("counter", "Deliveries received, by event type"),
+    "github_webhook_payload_bytes": ("histogram", "Size of delivery bodies, by event type"),
+    "github_webhook_stage_seconds": ("histogram", "Time spent reading, verifying and parsing deliveries, by stage"),
+    "github_webhook_hook_seconds": ("histogram", "Time spent in each hook"),
+    "github_webhook_hook_errors_total": ("counter", "Exceptions raised by each hook"),
+    "github_webhook_responses_total": ("counter", "Responses sent, by status code"),
+    "github_webhook_memo_total": ("counter", "Calls of memoized hooks, by hook and whether the cache was hit"),
+    "github_webhook_shed_total": ("counter", "Deliveries refused by admission control, by event type and reason"),
+    "github_webhook_retries_total": ("counter", "Retries of failed hooks, by hook and outcome"),
+}
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = tuple(1024 * 4**i for i in range(9))  # 1KB to 64MB
+
+
+class MetricsSink(object):
+    """
+    Interface of the objects :class:`~github_webhook.core.WebhookCore` reports metrics to, see
+    :data:`METRICS`. Implement it to forward them to statsd or any other monitoring system.
+    """
+
+    def increment(self, name, labels, value=1):
+        """
+        Add :code:`value` to a counter.
+
+        :param name: Name of the metric
+        :param labels: Dict of label names to values
+        """
+
+        raise NotImplementedError
+
+    def observe(self, name, value, labels):
+        """
+        Record a sample, such as a duration in seconds, in a histogram.
+
+        :param name: Name of the metric
+        :param labels: Dict of label names to values
+        """
+
+        raise NotImplementedError
+
+
+class PrometheusMetrics(MetricsSink):
+    """
+    Aggregate metrics in memory, and render them in the Prometheus text exposition format.
+
+    :param buckets: Optional dict of histogram names to upper bounds of their buckets. Histograms
+                    measured in bytes default to :data:`BYTES_BUCKETS`, others to
+                    :data:`SECONDS_BUCKETS`.
+    """
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, buckets=None):
+        self.buckets = dict(buckets or {})
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def increment(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, tuple(sorted(labels.items())))
+        bounds = self._bounds(name)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(bounds) + 2)
+            for i, bound in enumerate(bounds):
+                if value <= bound:
+                    histogram[i] += 1
+                    break
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def render(self):
+        """Return all metrics recorded so far, as a Prometheus text document"""
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(value)) for key, value in self._histograms.items())
+
+        lines = []
+        described = set()
+        for (name, labels), value in counters:
+            self._describe(lines, described, name, "counter")
+            lines.append("{0}{1} {2}".format(name, _labels(labels), _number(value)))
+
+        for (name, labels), histogram in histograms:
+            self._describe(lines, described, name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self._bounds(name), histogram):
+                cumulative += count
+                lines.append("{0}_bucket{1} {2}".format(name, _labels(labels + (("le", _number(bound)),)), cumulative))
+            lines.append("{0}_bucket{1} {2}".format(name, _labels(labels + (("le", "+Inf"),)), histogram[-1]))
+            lines.append("{0}_sum{1} {2}".format(name, _labels(labels), _number(histogram[-2])))
+            lines.append("{0}_count{1} {2}".format(name, _labels(labels), histogram[-1]))
+
+        return "".join(line + "\n" for line in lines)
+
+    def _bounds(self, name):
+        bounds = self.buckets.get(name)
+        if bounds is None:
+            bounds = BYTES_BUCKETS if name.endswith("_bytes") else SECONDS_BUCKETS
+        return bounds
+
+    @staticmethod
+    def _describe(lines, described, name, kind):
+        if name not in described:
+            described.add(name)
+            if name in METRICS:
+                lines.append("# HELP {0} {1}".format(name, METRICS[name][1]))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+
+
+class Timer(object):
+    """Context manager recording the time spent in its block in a histogram"""
+
+    __slots__ = ("sink", "name", "labels", "start")
+
+    def __init__(self, sink, name, labels):
+        self.sink = sink
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.sink.observe(self.name, _clock() - self.start, self.labels)
+
+
+class TimedHook(object):
+    """
+    Wraps a synchronous hook to record how long it runs, and whether it raises, under its name.
+
+    :param hook: The hook to call
+    :param sink: The :class:`MetricsSink` to report to
+    :param name: Name of the hook, see :func:`hook_name`
+    """
+
+    def __init__(self, hook, sink, name):
+        self.hook = hook
+        self.sink = sink
+        self.labels = {"hook": name}
+        self.__name__ = name
+
+    def __call__(self, data):
+        start = _clock()
+        try:
+            return self.hook(data)
+        except Exception:
+            self.sink.increment("github_webhook_hook_errors_total", self.labels)
+            raise
+        finally:
+            self.sink.observe("github_webhook_hook_seconds", _clock() - start, self.labels)
+
+
+def hook_name(hook):
+    """Return the qualified name of :code:`hook`, seeing through wrappers"""
+
+    hook = getattr(hook, "__wrapped__", hook)
+    name = getattr(hook, "__qualname__", None) or getattr(hook, "__name__", None)
+    if name is None:
+        return repr(hook)
+    module = getattr(hook, "__module__", None)
+    return module + "." + name if module else name
+
+
+class _Untimed(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+#: Context manager standing in for a :class:`Timer` when metrics are disabled
+UNTIMED = _Untimed()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        '{0}="{1}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,236 @@
+"""Lazily decoded delivery payloads, and hooks that only read some of their fields."""
+
+import threading
+
+from github_webhook.decoders import _bytes
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+try:
+    import simdjson
+except ImportError:  # pragma: no cover
+    simdjson = None
+
+_MISSING = object()
+
+
+class LazyPayload(Mapping):
+    """
+    A read-only, dict-like payload that is only decoded once a hook reads it.
+
+    With `pysimdjson <https://pypi.org/project/pysimdjson/>`_ installed, the body is parsed (and
+    validated) up front without building any Python object; each top-level value is then only
+    converted when it is first read, and :func:`extract` only converts the fields it is asked
+    for. Otherwise the whole body is decoded with :code:`decode` on first access, raising
+    :class:`ValueError` if it is invalid; the webhook decodes it before running any hook, so that
+    an invalid body is still refused with ``400 Bad Request``.
+
+    :param body: Raw JSON document, whose top level must be an object
+    :param decode: Function decoding the whole document, used without pysimdjson
+    """
+
+    def __init__(self, body, decode):
+        self._body = body
+        self._decode = decode
+        self._lock = threading.Lock()
+        self._data = None
+        self._document = None
+        self._values = {}
+
+        if simdjson is not None:
+            self._document = simdjson.Parser().parse(body)
+            if not isinstance(self._document, simdjson.Object):
+                raise ValueError("Payload is not a JSON object")
+
+    def __getitem__(self, key):
+        if self._document is None:
+            return self._decoded()[key]
+
+        with self._lock:
+            value = self._values.get(key, _MISSING)
+            if value is _MISSING:
+                value = self._values[key] = _to_python(self._document[key])
+        return value
+
+    def __contains__(self, key):
+        if self._document is None:
+            return key in self._decoded()
+        return key in self._document
+
+    def __iter__(self):
+        return iter(self._document.keys() if self._document is not None else self._decoded())
+
+    def __len__(self):
+        return len(self._document if self._document is not None else self._decoded())
+
+    def __repr__(self):
+        return "<LazyPayload of {0} bytes>".format(len(self._body))
+
+    def __reduce__(self):
+        # Ship the raw bytes, not the decoded tree, to worker processes
+        return LazyPayload, (_bytes(self._body), self._decode)
+
+    def lookup(self, path):
+        """
+        Return the value at :code:`path`, a sequence of keys and list indices, converting nothing
+        else. Raises :class:`KeyError` (or :class:`IndexError`) if there is no such value.
+        """
+
+        if self._document is None:
+            return _walk(self._decoded(), path)
+
+        pointer = "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in path)
+        with self._lock:
+            return _to_python(self._document.at_pointer(pointer))
+
+    def _locate(self, path):
+        """Return the value at :code:`path`, as :meth:`lookup` does, and which of its parents are lists"""
+
+        if self._document is None:
+            return _locate(self._decoded(), path)
+
+        lists = []
+        with self._lock:
+            value = self._document
+            for part in path:
+                lists.append(isinstance(value, simdjson.Array))
+                value = value[_index(part)] if lists[-1] else value[part]
+            return _to_python(value), lists
+
+    def _decoded(self):
+        with self._lock:
+            if self._data is None:
+                data = self._decode(self._body)
+                if not isinstance(data, dict):
+                    raise ValueError("Payload is not a JSON object")
+                self._data = data
+        return self._data
+
+
+class FieldsHook(object):
+    """
+    Wraps a hook so that it receives only the given fields of each payload, see :func:`extract`.
+    Coroutine hooks stay coroutine hooks.
+
+    :param hook: The hook to call
+    :param fields: Dotted paths, such as ``"repository.full_name"``
+    """
+
+    def __init__(self, hook, fields):
+        self.__wrapped__ = hook
+        self.__name__ = getattr(hook, "__name__", repr(hook))
+        self.paths = [_split(field) for field in fields]
+
+    def __call__(self, data):
+        return self.__wrapped__(_extract(data, self.paths))
+
+
+def extract(data, fields):
+    """
+    Return a dict holding only the given :code:`fields` of :code:`data`, nested as in the
+    payload. Fields absent from the payload are left out, and lists only hold the elements asked
+    for, in their order.
+
+    >>> extract({"action": "opened", "repository": {"full_name": "a/b"}}, ["repository.full_name"])
+    {'repository': {'full_name': 'a/b'}}
+    >>> extract({"commits": [{"id": "c1"}, {"id": "c2"}]}, ["commits.1.id"])
+    {'commits': [{'id': 'c2'}]}
+
+    :param data: The payload, a dict or :class:`LazyPayload`
+    :param fields: Dotted paths; a numeric component indexes into a list, and is a key otherwise
+    """
+
+    return _extract(data, [_split(field) for field in fields])
+
+
+def _extract(data, paths):
+    locate = data._locate if isinstance(data, LazyPayload) else lambda path: _locate(data, path)
+    result = {}
+    built = {id(result): result}  # the containers built here, rather than taken from the payload
+    for path in paths:
+        try:
+            value, lists = locate(path)
+        except (LookupError, TypeError):
+            continue
+
+        target = result
+        for depth, part in enumerate(path):
+            key = _index(part) if lists[depth] else part
+            if depth == len(path) - 1:
+                target[key] = value
+            elif key not in target:
+                # Lists are built as dicts by index, turned into lists once every field is in
+                target[key] = _Elements() if lists[depth + 1] else {}
+                built[id(target[key])] = target[key]
+            elif id(target[key]) not in built:  # a field asked for holds this one already
+                break
+            target = target[key]
+    return _listed(result, built)
+
+
+class _Elements(dict):
+    """The elements of a list extracted so far, by index"""
+
+
+def _listed(container, built):
+    for key, value in container.items():
+        if id(value) in built:
+            container[key] = _listed(value, built)
+    if isinstance(container, _Elements):
+        return [container[index] for index in sorted(container)]
+    return container
+
+
+def _split(field):
+    return tuple(field.split("."))
+
+
+def _index(part):
+    """Return a path component as a list index: an int, or a string of digits"""
+
+    if isinstance(part, int):
+        return part
+    if not part.isdigit():
+        raise TypeError("List indices must be integers, not {0!r}".format(part))
+    return int(part)
+
+
+def _locate(data, path):
+    lists = []
+    for part in path:
+        lists.append(isinstance(data, list))
+        data = data[_index(part)] if lists[-1] else data[part]
+    return data, lists
+
+
+def _walk(data, path):
+    return _locate(data, path)[0]
+
+
+def _to_python(value):
+    if simdjson is not None:
+        if isinstance(value, simdjson.Object):
+            return value.as_dict()
+        if isinstance(value, simdjson.Array):
+            return value.as_list()
+    return value
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,291 @@
+"""
+Recording of live deliveries to a compressed archive, and replay of archives through a webhook
+to measure its hooks offline. Run ``python -m github_webhook.recording --help`` for the
+command-line interface.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import gzip
+import importlib
+import json
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+
+import six
+from concurrent import futures
+
+from github_webhook.batching import BatchHook
+from github_webhook.core import _TENANT, _synchronous
+from github_webhook.decoders import _bytes
+from github_webhook.forward import _Forwarding
+from github_webhook.journal import JOURNAL_HEADERS
+from github_webhook.metrics import hook_name
+from github_webhook.workers import WORKER_ENV
+
+_RECORD = struct.Struct(">dII")  # time received, length of the headers, length of the body
+
+# Python 2 takes the end of a truncated archive for its checksum, and fails to check it
+_TRUNCATED = (EOFError, IOError) if six.PY2 else EOFError
+
+_clock = getattr(time, "perf_counter", time.time)
+
+Recorded = collections.namedtuple("Recorded", ["timestamp", "headers", "body"])
+
+logger = logging.getLogger("webhook")
+
+
+class Recorder(object):
+    """
+    Archive of the deliveries a webhook receives, with the headers needed to replay them and
+    their raw body, compressed with gzip. Only verified deliveries are recorded, so an archive
+    replays through a webhook with the same secret.
+
+    Reopening an archive appends to it. Deliveries are buffered before they are compressed, so
+    the last ones may be lost if the process crashes before :meth:`close`. In the processes of a
+    :class:`~github_webhook.workers.WorkerFleet`, which import the webhook but leave recording
+    to the process feeding them, the archive is not opened.
+
+    :param path: Path of the archive
+    :param compresslevel: gzip compression level, from 1 (fastest) to 9 (smallest)
+    """
+
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self._file = gzip.open(path, "ab", compresslevel) if WORKER_ENV not in os.environ else None
+        self._lock = threading.Lock()
+
+    def record(self, headers, body):
+        """
+        Append a delivery to the archive.
+
+        :param headers: Mapping of lower-cased request header names to values
+        :param body: Raw request body, as a bytes-like object
+        """
+
+        headers = dict((k, v) for k, v in headers.items() if k.startswith(JOURNAL_HEADERS))
+        encoded = json.dumps(headers, sort_keys=True).encode("utf-8")
+        if six.PY2 and not isinstance(body, bytes):  # pragma: no cover
+            body = _bytes(body)  # gzip only checksums strings and read-only buffers there
+        if self._file is None:
+            raise ValueError("Archive {0} is recorded by the process feeding the workers".format(self.path))
+        with self._lock:
+            self._file.write(_RECORD.pack(time.time(), len(encoded), len(body)))
+            self._file.write(encoded)
+            self._file.write(body)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+
+
+def read_recording(path):
+    """
+    Yield the deliveries of an archive as :class:`Recorded` tuples, oldest first. A delivery
+    truncated by a crash ends the archive.
+    """
+
+    with gzip.open(path, "rb") as archive:
+        while True:
+            try:
+                prefix = archive.read(_RECORD.size)
+                if not prefix:
+                    return
+                if len(prefix) == _RECORD.size:
+                    timestamp, headers_length, body_length = _RECORD.unpack(prefix)
+                    headers = archive.read(headers_length)
+                    body = archive.read(body_length)
+                    if len(headers) == headers_length and len(body) == body_length:
+                        yield Recorded(timestamp, json.loads(headers.decode("utf-8")), body)
+                        continue
+            except _TRUNCATED:
+                pass
+            logger.warning("Discarding a truncated delivery at the end of %s", path)
+            return
+
+
+def replay_recording(webhook, path, speed=None, processes=1, forward=False):
+    """
+    Run the hooks of every delivery of an archive, one at a time, timing each hook. Deliveries
+    are verified and parsed as they were when received, but their hooks run in the calling thread
+    rather than through the dispatcher, without being retried, and nothing is journaled,
+    deduplicated or recorded. Batch hooks are called as soon as a batch reaches its maximum size,
+    and with the rest at the end, regardless of their window. Forwarding hooks are skipped, so
+    that replaying does not post to live services, unless :code:`forward` is set.
+
+    :param webhook: The :class:`~github_webhook.core.WebhookCore` to replay the deliveries
+                    through; or, with several :code:`processes`, its name as
+                    ``module:attribute``, importable from the current directory
+    :param path: Path of the archive
+    :param speed: Optional replay speed relative to the original timing: ``1.0`` waits as long
+                  between deliveries as there was when they were recorded, ``10.0`` ten times
+                  less. By default deliveries are replayed as fast as possible.
+    :param processes: Number of processes sharing the deliveries
+    :param forward: Run the forwarding hooks too, posting the deliveries to their targets
+    :return: a dict of the number of ``deliveries``, those ``refused`` as invalid, the
+             ``seconds`` the replay took and, for each hook by name, its ``calls``, ``errors``
+             and total ``seconds``
+    """
+
+    start = _clock()
+    if processes <= 1:
+        if not hasattr(webhook, "receive"):
+            webhook = _import(webhook)
+        report = _replay(webhook, path, speed, 0, 1, forward)
+    else:
+        executor = futures.ProcessPoolExecutor(processes)
+        try:
+            parts = [
+                executor.submit(_replay_part, webhook, path, speed, i, processes, forward) for i in range(processes)
+            ]
+            report = _merge([part.result() for part in parts])
+        finally:
+            executor.shutdown()
+    report["seconds"] = _clock() - start
+    return report
+
+
+def _replay_part(webhook, path, speed, part, parts, forward=False):
+    webhook = _import(webhook)
+    try:
+        return _replay(webhook, path, speed, part, parts, forward)
+    finally:
+        webhook.shutdown()
+
+
+def _replay(webhook, path, speed, part, parts, forward=False):
+    report = {"deliveries": 0, "refused": 0, "hooks": {}}
+    batches = collections.OrderedDict()  # the payloads pending for each batch hook, by key
+    first, start = None, _clock()
+    for i, delivery in enumerate(read_recording(path)):
+        if i % parts != part:
+            continue
+        if speed:
+            first = delivery.timestamp if first is None else first
+            delay = (delivery.timestamp - first) / speed - (_clock() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        report["deliveries"] += 1
+        try:
+            hooks, data = webhook.receive(delivery.headers, delivery.body, delivery.headers.get(_TENANT))
+        except Exception as e:
+            logger.error("Refused recorded delivery %s: %s", delivery.headers.get("x-github-delivery"), e)
+            report["refused"] += 1
+            continue
+
+        for hook in hooks:
+            if isinstance(hook, BatchHook):
+                pending = batches.setdefault(hook, collections.OrderedDict())
+                key, payload = hook._entry(data)
+                pending[key] = payload
+                if len(pending) == hook.max_size:
+                    _time(report, hook.name, hook.hook, list(pending.values()))
+                    pending.clear()
+            elif forward or not isinstance(hook, _Forwarding):
+                _time(report, hook_name(hook), _synchronous(hook), data)
+
+    for hook, pending in batches.items():
+        if pending:
+            _time(report, hook.name, hook.hook, list(pending.values()))
+    return report
+
+
+def _time(report, name, hook, data):
+    """Run a hook, adding its outcome and duration to the stats of the report"""
+
+    stats = report["hooks"].setdefault(name, {"calls": 0, "errors": 0, "seconds": 0.0})
+    before = _clock()
+    try:
+        hook(data)
+    except Exception:
+        logger.exception("Hook %s raised an exception", name)
+        stats["errors"] += 1
+    stats["seconds"] += _clock() - before
+    stats["calls"] += 1
+
+
+def _merge(reports):
+    merged = {"deliveries": 0, "refused": 0, "hooks": {}}
+    for report in reports:
+        merged["deliveries"] += report["deliveries"]
+        merged["refused"] += report["refused"]
+        for name, stats in report["hooks"].items():
+            total = merged["hooks"].setdefault(name, {"calls": 0, "errors": 0, "seconds": 0.0})
+            for key in total:
+                total[key] += stats[key]
+    return merged
+
+
+def _import(name):
+    module, _, attribute = name.partition(":")
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), attribute)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m github_webhook.recording", description=__doc__.split(",")[0])
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True  # as they always are on Python 2
+    list_parser = commands.add_parser("list", help="list the deliveries of an archive")
+    list_parser.add_argument("archive", help="recorded archive")
+    replay_parser = commands.add_parser("replay", help="replay an archive, and report the throughput of each hook")
+    replay_parser.add_argument("archive", help="recorded archive")
+    replay_parser.add_argument("webhook", help="webhook to replay it through, as module:attribute")
+    replay_parser.add_argument("--speed", type=float, help="follow the original timing, sped up by this factor")
+    replay_parser.add_argument("--processes", type=int, default=1, help="number of processes to replay it with")
+    replay_parser.add_argument("--forward", action="store_true", help="post the deliveries to the forwarding targets")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for delivery in read_recording(args.archive):
+            print(
+                time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(delivery.timestamp)),
+                delivery.headers.get("x-github-delivery", "-"),
+                delivery.headers.get("x-github-event", "-"),
+                len(delivery.body),
+            )
+    else:
+        report = replay_recording(args.webhook, args.archive, args.speed, args.processes, args.forward)
+        print(
+            "Replayed {0} deliveries in {1:.3f}s, {2} refused".format(
+                report["deliveries"], report["seconds"], report["refused"]
+            )
+        )
+        print("{0:<60} {1:>8} {2:>8} {3:>10} {4:>10}".format("hook", "calls", "errors", "calls/s", "mean ms"))
+        for name, stats in sorted(report["hooks"].items()):
+            seconds = stats["seconds"] or float("nan")
+            print(
+                "{0:<60} {1:>8} {2:>8} {3:>10.0f} {4:>10.3f}".format(
+                    name, stats["calls"], stats["errors"], stats["calls"] / seconds, 1000 * seconds / stats["calls"]
+                )
+            )
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
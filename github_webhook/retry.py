@@ -0,0 +1,359 @@
+"""Retries of failed hook invocations, with exponential backoff, and a store of those that never succeed."""
+
+import collections
+import errno
+import heapq
+import itertools
+import json
+import logging
+import os
+import pickle
+import random
+import threading
+import time
+
+from concurrent import futures
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover
+    from collections import Mapping
+
+_clock = getattr(time, "monotonic", time.time)
+
+DeadLetter = collections.namedtuple("DeadLetter", ["hook", "data", "attempts", "error", "timestamp"])
+
+logger = logging.getLogger("webhook")
+
+
+class DeadLetterStore(object):
+    """
+    The hook invocations that failed every attempt, most recent last, for inspection or to be run
+    again by hand. With a :code:`path`, they are also appended to that file, one JSON document per
+    line, and read back from it when the store is created.
+
+    :param path: Optional path of the file dead letters are kept in
+    :param max_size: Maximum number of dead letters kept in memory; the oldest are dropped
+    """
+
+    def __init__(self, path=None, max_size=1000):
+        self.path = path
+        self._letters = collections.deque(maxlen=max_size)
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as handle:
+                for line in handle:
+                    if line.strip():
+                        self._letters.append(DeadLetter(**json.loads(line)))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._letters)
+
+    def add(self, letter):
+        """Store a :class:`DeadLetter`"""
+
+        with self._lock:
+            self._letters.append(letter)
+            if self.path is not None:
+                document = dict(letter._asdict(), data=_jsonable(letter.data))
+                with open(self.path, "a") as handle:
+                    handle.write(json.dumps(document, sort_keys=True, default=str) + "\n")
+
+    def letters(self):
+        """Return the dead letters kept in memory, oldest first"""
+
+        with self._lock:
+            return list(self._letters)
+
+    def clear(self):
+        """Forget every dead letter, emptying the file too"""
+
+        with self._lock:
+            self._letters.clear()
+            if self.path is not None:
+                open(self.path, "w").close()
+
+
+class RetryScheduler(object):
+    """
+    Run failed hook invocations again later, on a pool of threads, until they succeed or have
+    been tried :code:`max_attempts` times; those are then logged and added to the dead-letter
+    store. The n-th retry waits ``base_delay * 2 ** (n - 1)`` seconds, capped to
+    :code:`max_delay`, less a random share of that delay of up to :code:`jitter`, so that the
+    invocations failing together, say while a service is down, are not all retried at once.
+
+    Retries wait in memory. With a :code:`spill` directory, the payloads of the retries beyond
+    :code:`max_in_memory` wait in files there instead. This only bounds the memory of a running
+    process: hooks are not saved with their payloads, so the retries spilled by a process are not
+    resumed by the next. A scheduler created on the directory dead-letters those left by
+    processes that exited without closing their scheduler. Retries still pending when the
+    scheduler is closed are dead-lettered.
+
+    :param max_attempts: Number of times an invocation is tried in all, the first included
+    :param base_delay: Number of seconds before the first retry
+    :param max_delay: Maximum number of seconds between two attempts
+    :param jitter: Share of each delay that is random, from 0 (none) to 1 (all of it)
+    :param max_workers: Number of threads running retries
+    :param max_in_memory: Number of pending retries whose payload is kept in memory
+    :param spill: Optional directory the payloads of further retries are written to
+    :param dead_letters: Optional :class:`DeadLetterStore`; an in-memory one by default
+    :param metrics: Optional :class:`~github_webhook.metrics.MetricsSink` counting retries by
+                    hook and outcome
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        base_delay=1.0,
+        max_delay=300.0,
+        jitter=1.0,
+        max_workers=2,
+        max_in_memory=1000,
+        spill=None,
+        dead_letters=None,
+        metrics=None,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        if not 0 <= jitter <= 1:
+            raise ValueError("jitter must be between 0 and 1")
+        if spill is not None and not os.path.isdir(spill):
+            os.makedirs(spill)
+
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.max_in_memory = max_in_memory
+        self.spill = spill
+        self.dead_letters = dead_letters if dead_letters is not None else DeadLetterStore()
+        self.metrics = metrics
+        self._max_workers = max_workers
+        self._closed = False
+        self._start()
+        if spill is not None:
+            self._reclaim()
+
+    @property
+    def pending(self):
+        """Number of retries waiting to run"""
+
+        with self._cond:
+            return len(self._queue)
+
+    def delay(self, attempts):
+        """Return the number of seconds to wait after the :code:`attempts`-th failed attempt"""
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def schedule(self, hook, data, error, attempts=1, name=None):
+        """
+        Retry :code:`hook` with :code:`data` later, or dead-letter it if it was tried enough.
+
+        :param hook: The synchronous hook that failed
+        :param data: The payload it was called with
+        :param error: The exception it raised
+        :param attempts: Number of times it was tried
+        :param name: Name of the hook, used in logs, metrics and dead letters
+        """
+
+        name = name or getattr(hook, "__name__", repr(hook))
+        with self._cond:
+            closed = self._closed
+            if not closed and attempts < self.max_attempts:
+                retry = _Retry(_clock() + self.delay(attempts), next(self._counter), hook, name, attempts, str(error))
+                if self.spill is not None and self._in_memory >= self.max_in_memory:
+                    self._write(retry, data)
+                else:
+                    retry.data = data
+                    self._in_memory += 1
+                heapq.heappush(self._queue, retry)
+                self._cond.notify_all()
+                self._count(name, "scheduled")
+                return
+
+        reason = "the scheduler was closed" if closed else "{0} attempts".format(attempts)
+        self._bury(name, data, attempts, str(error), reason)
+
+    def close(self, wait=True):
+        """
+        Stop retrying, and dead-letter the retries still pending.
+
+        :param wait: Block until the retries running have finished
+        """
+
+        with self._cond:
+            self._closed = True
+            pending, self._queue = self._queue, []
+            self._in_memory = 0
+            self._cond.notify_all()
+        self._thread.join()
+        for retry in sorted(pending):
+            self._bury(retry.name, self._load(retry), retry.attempts, retry.error, "the scheduler was closed")
+        self._executor.shutdown(wait=wait)
+
+    def after_fork(self):
+        """
+        Start afresh in a child process forked from this one, where the scheduler and the pool
+        threads are not running. The retries pending in the parent are left to it.
+        """
+
+        self._start()
+
+    def _start(self):
+        self._executor = futures.ThreadPoolExecutor(self._max_workers)
+        self._cond = threading.Condition()
+        self._queue = []  # heap of _Retry, by due time
+        self._in_memory = 0
+        self._counter = itertools.count()
+        self._thread = threading.Thread(target=self._run, name="webhook-retries")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reclaim(self):
+        """Dead-letter the retries spilled by processes that have exited"""
+
+        for filename in sorted(os.listdir(self.spill)):
+            pid, _, rest = filename.partition("-")
+            if not pid.isdigit() or not rest.endswith(".retry") or _alive(int(pid)):
+                continue
+            path = os.path.join(self.spill, filename)
+            try:
+                with open(path, "rb") as handle:
+                    name, attempts, error, data = pickle.load(handle)
+            except Exception:
+                logger.warning("Discarding the unreadable retry %s", path, exc_info=True)
+            else:
+                self._bury(name, data, attempts, error, "its process exited")
+            os.remove(path)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                remaining = self._queue[0].due - _clock()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+                retry = heapq.heappop(self._queue)
+                if retry.path is None:
+                    self._in_memory -= 1
+            self._executor.submit(self._attempt, retry, self._load(retry))
+
+    def _attempt(self, retry, data):
+        try:
+            retry.hook(data)
+        except Exception as e:
+            logger.warning("Hook %s failed again (attempt %d): %s", retry.name, retry.attempts + 1, e)
+            self.schedule(retry.hook, data, e, retry.attempts + 1, retry.name)
+        else:
+            logger.info("Hook %s succeeded on attempt %d", retry.name, retry.attempts + 1)
+            self._count(retry.name, "succeeded")
+
+    def _write(self, retry, data):
+        """Spill the payload of :code:`retry` to a file, or keep it in memory if it cannot be"""
+
+        try:
+            pickled = pickle.dumps((retry.name, retry.attempts, retry.error, data), pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            logger.warning("Keeping the payload of a retry of %s in memory", retry.name, exc_info=True)
+            retry.data = data
+            self._in_memory += 1
+            return
+        retry.path = os.path.join(self.spill, "{0}-{1}.retry".format(os.getpid(), retry.seq))
+        with open(retry.path, "wb") as handle:
+            handle.write(pickled)
+
+    def _load(self, retry):
+        if retry.path is None:
+            return retry.data
+        with open(retry.path, "rb") as handle:
+            data = pickle.load(handle)[-1]
+        os.remove(retry.path)
+        return data
+
+    def _bury(self, name, data, attempts, error, reason):
+        logger.error("Giving up on hook %s after %s: %s", name, reason, error)
+        self.dead_letters.add(DeadLetter(name, data, attempts, error, time.time()))
+        self._count(name, "dead")
+
+    def _count(self, name, outcome):
+        if self.metrics is not None:
+            self.metrics.increment("github_webhook_retries_total", {"hook": name, "outcome": outcome})
+
+
+class RetryingHook(object):
+    """
+    Wraps a synchronous hook so that its failures are handed to a :class:`RetryScheduler` rather
+    than raised, and so neither fail the delivery nor stop the other hooks.
+
+    :param hook: The hook to call
+    :param scheduler: The :class:`RetryScheduler` retrying it
+    :param name: Name of the hook; its own by default
+    """
+
+    def __init__(self, hook, scheduler, name=None):
+        self.__wrapped__ = hook
+        self.__name__ = name or getattr(hook, "__name__", repr(hook))
+        self.scheduler = scheduler
+
+    def __call__(self, data):
+        try:
+            self.__wrapped__(data)
+        except Exception as e:
+            logger.warning("Hook %s raised an exception; retrying it later", self.__name__, exc_info=True)
+            self.scheduler.schedule(self.__wrapped__, data, e, name=self.__name__)
+
+
+class _Retry(object):
+    """A pending retry, ordered by due time"""
+
+    __slots__ = ("due", "seq", "hook", "name", "attempts", "error", "data", "path")
+
+    def __init__(self, due, seq, hook, name, attempts, error):
+        self.due = due
+        self.seq = seq
+        self.hook = hook
+        self.name = name
+        self.attempts = attempts
+        self.error = error
+        self.data = None
+        self.path = None  # of the file its payload was spilled to
+
+    def __lt__(self, other):
+        return (self.due, self.seq) < (other.due, other.seq)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno != errno.ESRCH
+    return True
+
+
+def _jsonable(data):
+    return dict(data) if isinstance(data, Mapping) else data
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
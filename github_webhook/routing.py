@@ -0,0 +1,180 @@
+"""Index of hooks by event type, action, repository, ref and sender."""
+
+import fnmatch
+import itertools
+import re
+
+import six
+
+from github_webhook.payload import LazyPayload, _walk
+
+# Key of the glob patterns in a repository node; never a valid repository name
+_PATTERNS = "*"
+
+#: Event type of the hooks invoked for deliveries of every event type
+ANY_EVENT = "*"
+_GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+class Route(object):
+    """
+    A hook, with the filters on ref and sender left to check once its event type, action and
+    repository have been looked up in the index.
+
+    :param hook: The hook to call
+    :param order: Registration order, hooks run in
+    :param ref: Optional compiled pattern the ref must match
+    :param senders: Optional set of sender logins
+    """
+
+    __slots__ = ("hook", "order", "ref", "senders")
+
+    def __init__(self, hook, order, ref=None, senders=None):
+        self.hook = hook
+        self.order = order
+        self.ref = ref
+        self.senders = senders
+
+    def matches(self, data):
+        if self.ref is not None:
+            ref = _ref(data)
+            if ref is None or not self.ref.match(ref):
+                return False
+        if self.senders is not None and _get(data, ("sender", "login")) not in self.senders:
+            return False
+        return True
+
+
+class Router(object):
+    """
+    Registry of hooks, indexed by a trie of dicts keyed on event type, then action, then
+    repository, so that finding the hooks of a delivery only looks at the hooks that may match it,
+    however many are registered.
+    """
+
+    def __init__(self):
+        self._index = {}  # event type -> action or None -> repository or None -> [Route]
+        self._order = itertools.count()
+
+    def add(self, event_type, hook, action=None, repository=None, ref=None, sender=None):
+        """
+        Register :code:`hook` for deliveries of :code:`event_type`, or of every event type if it is
+        :data:`ANY_EVENT`, matching every given filter. Each filter may be a string or a list of
+        strings, any of which must match.
+
+        :param action: The payload's ``action``
+        :param repository: Glob pattern, such as ``"my-org/*"``, matching the repository's
+                           ``full_name`` regardless of case
+        :param ref: Glob pattern, such as ``"refs/heads/release/*"``, matching the payload's
+                    ``ref``, or the base branch of a pull request
+        :param sender: Login of the user who triggered the event
+        """
+
+        route = Route(
+            hook,
+            next(self._order),
+            ref=_compile(_strings(ref)) if ref is not None else None,
+            senders=frozenset(_strings(sender)) if sender is not None else None,
+        )
+
+        by_action = self._index.setdefault(event_type, {})
+        for action_key in _strings(action) if action is not None else [None]:
+            by_repo = by_action.setdefault(action_key, {})
+            if repository is None:
+                by_repo.setdefault(None, []).append(route)
+                continue
+
+            patterns = [p for p in _strings(repository) if _GLOB_CHARS.search(p)]
+            for name in _strings(repository):
+                if name not in patterns:
+                    by_repo.setdefault(name.lower(), []).append(route)
+            if patterns:
+                by_repo.setdefault(_PATTERNS, []).append((_compile(patterns, re.IGNORECASE), route))
+
+    def handles(self, event_type):
+        """Return whether hooks may be invoked for a delivery of :code:`event_type`"""
+
+        return event_type in self._index or ANY_EVENT in self._index
+
+    def match(self, event_type, data):
+        """Return the hooks to call for a delivery, in the order they were registered"""
+
+        nodes = []
+        action = False
+        for by_action in (self._index.get(event_type), self._index.get(ANY_EVENT) if event_type != ANY_EVENT else None):
+            if by_action is None:
+                continue
+            nodes.append(by_action.get(None))
+            if len(by_action) > (None in by_action):
+                if action is False:
+                    action = _get(data, ("action",))
+                nodes.append(by_action.get(action))
+        if not nodes:
+            return []
+
+        routes = []
+        repository = False
+        for by_repo in nodes:
+            if by_repo is None:
+                continue
+            routes.extend(by_repo.get(None, ()))
+            if len(by_repo) > (None in by_repo):
+                if repository is False:
+                    repository = _get(data, ("repository", "full_name"))
+                    repository = repository.lower() if isinstance(repository, six.string_types) else None
+                if repository is None:
+                    continue
+                routes.extend(by_repo.get(repository, ()))
+                routes.extend(route for regex, route in by_repo.get(_PATTERNS, ()) if regex.match(repository))
+
+        if len(nodes) > 1 or repository is not False:
+            routes = sorted(set(routes), key=lambda route: route.order)
+        return [route.hook for route in routes if route.matches(data)]
+
+
+def _strings(value):
+    return [value] if isinstance(value, six.string_types) else list(value)
+
+
+def _compile(patterns, flags=0):
+    return re.compile("|".join("(?:{0})".format(fnmatch.translate(pattern)) for pattern in patterns), flags)
+
+
+def _get(data, path):
+    try:
+        return data.lookup(path) if isinstance(data, LazyPayload) else _walk(data, path)
+    except (LookupError, TypeError):
+        return None
+
+
+def _key_function(paths):
+    """Return a function of a payload returning the tuple of its values at :code:`paths`"""
+
+    def key(data):
+        return tuple(_get(data, path) for path in paths)
+
+    return key
+
+
+def _ref(data):
+    ref = _get(data, ("ref",))
+    if ref is None:
+        ref = _get(data, ("pull_request", "base", "ref"))
+    return ref if isinstance(ref, six.string_types) else None
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
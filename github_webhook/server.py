@@ -0,0 +1,513 @@
+"""
+A pre-forking HTTP server for webhooks: the master process imports and warms the webhook and its
+hooks once, then forks workers sharing that memory copy-on-write. Run ``python -m github_webhook
+--help`` for its options.
+"""
+
+from __future__ import print_function
+
+import argparse
+import errno
+import gc
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+import six
+from six.moves import BaseHTTPServer, socketserver
+
+from github_webhook.core import WebhookError, _endpoint_tenant
+from github_webhook.dedup import MemoryDeliveryStore
+
+_LISTENER_FD = "GITHUB_WEBHOOK_LISTENER_FD"  # listening socket inherited across a reload
+_OLD_WORKERS = "GITHUB_WEBHOOK_OLD_WORKERS"  # workers of the previous generation, to retire once replaced
+
+_WARMUP_PAYLOAD = b'{"zen": "Keep it logically awesome.", "hook_id": 1}'
+
+_MIN_UPTIME = 10  # seconds a worker must run for its exit not to count as a crash
+_RESPAWN_DELAY = 0.5  # seconds before forking again after the second crash in a row, doubled for each next one
+_MAX_RESPAWN_DELAY = 30
+
+_clock = getattr(time, "monotonic", time.time)
+
+logger = logging.getLogger("webhook")
+
+
+class Server(object):
+    """
+    Serve a webhook over HTTP/1.1 from :code:`workers` processes forked from this one, so that
+    they share the modules and objects it has loaded, and accept connections on the same socket.
+    Idle connections are kept open for :code:`keepalive` seconds.
+
+    :meth:`run` supervises the workers: one that exits is forked again, after a delay growing
+    with the number of workers in a row that exited within seconds of starting. ``SIGTERM`` and
+    ``SIGINT`` stop them gracefully: they stop accepting connections, finish the requests in
+    progress and shut the webhook down, within :code:`graceful_timeout` seconds. ``SIGHUP``
+    reloads: a new generation of workers is started, and the old one retired once it is serving.
+
+    Each worker restarts the threads of the webhook's dispatcher, retry scheduler, batch hooks and
+    forwarding hooks with :meth:`~github_webhook.core.WebhookCore.after_fork`. A journal or a
+    recorder, whose files a single process must write, and a fleet of worker processes are
+    refused. So are, with several workers, a :code:`metrics_endpoint`, which would serve the
+    metrics of whichever worker answers, and a
+    :class:`~github_webhook.dedup.MemoryDeliveryStore`, which each worker would keep on its own.
+    The rates of an :code:`admission` control apply to each worker; a warning says so.
+
+    :param webhook: The :class:`~github_webhook.core.WebhookCore` to serve
+    :param bind: Host and port to listen on
+    :param workers: Number of worker processes; one per CPU by default
+    :param endpoint: The path deliveries are posted to. With :code:`tenants`, it may hold a
+                     ``<tenant>`` segment, such as ``"/postreceive/<tenant>"``, naming the tenant
+                     of each delivery.
+    :param metrics_endpoint: Optional path serving the metrics in the Prometheus text format, on
+                             ``GET``. Requires a :code:`metrics` sink that can render them.
+    :param keepalive: Number of seconds an idle connection is kept open; ``0`` closes each
+                      connection after its response
+    :param graceful_timeout: Number of seconds workers have to finish once asked to stop
+    """
+
+    def __init__(
+        self,
+        webhook,
+        bind=("127.0.0.1", 8000),
+        workers=None,
+        endpoint="/postreceive",
+        metrics_endpoint=None,
+        keepalive=5,
+        graceful_timeout=30,
+    ):
+        if metrics_endpoint is not None and not hasattr(webhook.metrics, "render"):
+            raise ValueError("metrics_endpoint requires a metrics sink with a render() method")
+        if webhook.journal is not None or webhook.recorder is not None:
+            raise ValueError("A journal or recorder cannot be shared by worker processes")
+        if webhook.workers is not None:
+            raise ValueError("A fleet of worker processes cannot be shared by worker processes")
+        workers = workers or multiprocessing.cpu_count()
+        if workers > 1:
+            if metrics_endpoint is not None:
+                raise ValueError("metrics_endpoint would serve the metrics of a single worker; use one worker")
+            if isinstance(webhook.dedup, MemoryDeliveryStore):
+                raise ValueError("A MemoryDeliveryStore is not shared by worker processes; use a SqliteDeliveryStore")
+            if webhook.admission is not None:
+                logger.warning("The admission control rates apply to each of the %d workers", workers)
+        self.webhook = webhook
+        self.bind = bind
+        self.workers = workers
+        self.endpoint = endpoint
+        self.metrics_endpoint = metrics_endpoint
+        self.keepalive = keepalive
+        self.graceful_timeout = graceful_timeout
+        self.listener = None
+        self.address = None
+        self._workers = set()
+        self._retiring = set()  # workers of a previous generation, asked to stop
+        self._started = {}  # pid -> when each worker was forked
+        self._crashes = 0  # number of workers in a row that exited soon after starting
+        self._respawns = []  # when to fork again the workers that exited
+        self._signal = None
+        self._stopping = threading.Event()
+
+    def listen(self):
+        """Open the listening socket, or take over the one inherited from before a reload"""
+
+        family = socket.AF_INET6 if ":" in self.bind[0] else socket.AF_INET
+        fd = os.environ.pop(_LISTENER_FD, None)
+        if fd is not None:
+            self.listener = socket.fromfd(int(fd), family, socket.SOCK_STREAM)
+            os.close(int(fd))
+        else:
+            self.listener = socket.socket(family, socket.SOCK_STREAM)
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listener.bind(self.bind)
+            self.listener.listen(1024)
+        self.address = self.listener.getsockname()[:2]
+        logger.info("Listening on http://%s:%d%s", self.address[0], self.address[1], self.endpoint)
+
+    def run(self, argv=None):
+        """
+        Listen, fork the workers and supervise them until the server is stopped.
+
+        :param argv: Arguments of ``python -m github_webhook`` the master process is executed
+                     again with on reload, so that the webhook and hooks are imported afresh.
+                     Without them, the workers are forked again from this process.
+        """
+
+        self.listen()
+        gc.collect()
+        if hasattr(gc, "freeze"):
+            gc.freeze()  # keep the collector from touching, and so copying, the objects loaded
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, self._on_signal)
+
+        for _ in range(self.workers):
+            self._spawn()
+        self._retire([int(pid) for pid in os.environ.pop(_OLD_WORKERS, "").split(",") if pid])
+
+        while True:
+            self._reap()
+            self._respawn()
+            if self._signal in (signal.SIGTERM, signal.SIGINT):
+                break
+            if self._signal == signal.SIGHUP:
+                self._signal = None
+                self._reload(argv)
+            time.sleep(0.1)
+
+        logger.info("Stopping %d workers", len(self._workers))
+        self._retire(self._workers)
+        deadline = _clock() + self.graceful_timeout
+        while self._retiring and _clock() < deadline:
+            time.sleep(0.1)
+            self._reap()
+        for pid in self._retiring:
+            logger.warning("Killing worker %d, still running after %ss", pid, self.graceful_timeout)
+            _kill(pid, signal.SIGKILL)
+        self.listener.close()
+
+    def _on_signal(self, signum, frame):
+        self._signal = signum
+
+    def _spawn(self):
+        started = _clock()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = self._work(started)
+            except BaseException:
+                logger.exception("Worker %d crashed", os.getpid())
+            finally:
+                os._exit(code)
+        self._workers.add(pid)
+        self._started[pid] = started
+
+    def _respawn(self):
+        """Fork again the workers that exited, once their delay has passed"""
+
+        now = _clock()
+        due = [when for when in self._respawns if when <= now]
+        self._respawns = [when for when in self._respawns if when > now]
+        for _ in due:
+            self._spawn()
+
+    def _retire(self, pids):
+        for pid in list(pids):
+            self._workers.discard(pid)
+            self._started.pop(pid, None)
+            self._retiring.add(pid)
+            _kill(pid, signal.SIGTERM)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            if pid in self._retiring:
+                self._retiring.discard(pid)
+            elif pid in self._workers:
+                self._workers.discard(pid)
+                self._crashes = self._crashes + 1 if _clock() - self._started.pop(pid) < _MIN_UPTIME else 0
+                delay = 0
+                if self._crashes > 1:
+                    delay = min(_MAX_RESPAWN_DELAY, _RESPAWN_DELAY * 2 ** (self._crashes - 2))
+                    logger.warning("Worker %d exited with status %d; forking another in %.1fs", pid, status, delay)
+                else:
+                    logger.warning("Worker %d exited with status %d; forking another", pid, status)
+                self._respawns.append(_clock() + delay)
+
+    def _reload(self, argv):
+        if argv is None:
+            logger.info("Reloading: forking %d new workers", self.workers)
+            old = list(self._workers)
+            self._respawns, self._crashes = [], 0  # the new generation replaces them
+            for _ in range(self.workers):
+                self._spawn()
+            self._retire(old)
+            return
+
+        logger.info("Reloading: executing the server again")
+        fd = self.listener.fileno()
+        if hasattr(os, "set_inheritable"):
+            os.set_inheritable(fd, True)
+        os.environ[_LISTENER_FD] = str(fd)
+        os.environ[_OLD_WORKERS] = ",".join(str(pid) for pid in sorted(self._workers | self._retiring))
+        try:
+            os.execv(sys.executable, [sys.executable, "-m", "github_webhook"] + list(argv))
+        except OSError:
+            logger.exception("Could not execute the server again; keeping the current workers")
+            del os.environ[_LISTENER_FD], os.environ[_OLD_WORKERS]
+
+    def _work(self, started):
+        """Serve requests in a worker process until it is asked to stop; return its exit status"""
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._stopping.set())
+        signal.signal(signal.SIGINT, signal.SIG_IGN)  # the master stops the workers
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.webhook.after_fork()
+
+        server = _HTTPServer(self)
+        thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.1})
+        thread.start()
+        logger.info("Worker %d ready in %.3fs, %s", os.getpid(), _clock() - started, _describe_memory())
+
+        while not self._stopping.is_set():
+            self._stopping.wait(1)
+        server.shutdown()
+        server.close_idle()
+        server.server_close()
+        thread.join()
+        self.webhook.shutdown(timeout=self.graceful_timeout)
+        return 0
+
+
+class _HTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """An HTTP server accepting connections on the listening socket of a :class:`Server`"""
+
+    def __init__(self, app):
+        BaseHTTPServer.HTTPServer.__init__(self, app.address, _Handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = app.listener
+        self.app = app
+        self.idle = set()  # connections waiting for their next request
+        self.lock = threading.Lock()
+
+    def close_idle(self):
+        """Close the connections waiting for their next request, so that a stopping worker can exit"""
+
+        with self.lock:
+            for connection in self.idle:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except (OSError, socket.error):
+                    pass
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "github-webhook"
+
+    def setup(self):
+        self.timeout = self.server.app.keepalive or self.server.app.graceful_timeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def handle_one_request(self):
+        with self.server.lock:
+            self.server.idle.add(self.connection)
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            with self.server.lock:
+                self.server.idle.discard(self.connection)
+
+    def parse_request(self):
+        with self.server.lock:
+            self.server.idle.discard(self.connection)
+        return BaseHTTPServer.BaseHTTPRequestHandler.parse_request(self)
+
+    def do_POST(self):
+        app = self.server.app
+        tenant = _endpoint_tenant(app.endpoint, self.path.partition("?")[0])
+        if tenant is False:
+            self._respond(404, "Not Found", close=True)
+            return
+        length = self.headers.get("content-length")
+        if length is None or not length.isdigit():
+            self._respond(411, "Length Required", close=True)
+            return
+
+        body = _Body(self.rfile, int(length))
+        try:
+            result = app.webhook.handle_stream(dict(self.headers.items()), body, tenant)
+        except WebhookError as e:
+            status, description = e.status, e.description
+        except Exception:
+            logger.exception("Hook raised an exception")
+            status, description = 500, "Internal Server Error"
+        else:
+            status, description = result
+        app.webhook._count_response(status)
+        self._respond(status, description, close=body.remaining > 0)  # the rest of the body was not read
+
+    def do_GET(self):
+        app = self.server.app
+        path = self.path.partition("?")[0]
+        if app.metrics_endpoint is not None and path == app.metrics_endpoint:
+            metrics = app.webhook.metrics
+            self._respond(200, metrics.render(), content_type=metrics.content_type)
+        elif _endpoint_tenant(app.endpoint, path) is not False:
+            self._respond(405, "Method Not Allowed", headers=[("Allow", "POST")])
+        else:
+            self._respond(404, "Not Found")
+
+    def _respond(self, status, body, content_type="text/plain; charset=utf-8", headers=(), close=False):
+        body = body.encode("utf-8") if isinstance(body, six.text_type) else body
+        app = self.server.app
+        self.close_connection = close or not app.keepalive or app._stopping.is_set() or self.close_connection
+        self.send_response(status)
+        if body:
+            self.send_header("Content-Type", content_type)
+        if status != 204:
+            self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("%s " + format, self.address_string(), *args)
+
+
+class _Body(object):
+    """The body of a request, read from the connection up to its Content-Length"""
+
+    def __init__(self, stream, length):
+        self._stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self._stream.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readinto(self, buffer):
+        readinto = getattr(self._stream, "readinto", None)
+        if readinto is None:
+            data = self.read(len(buffer))
+            buffer[: len(data)] = data
+            return len(data)
+        size = min(len(buffer), self.remaining)
+        count = readinto(memoryview(buffer)[:size]) if size else 0
+        self.remaining -= count
+        return count
+
+
+def load(webhook, hooks=(), warmup=()):
+    """
+    Import a webhook and the modules registering its hooks, and warm them up, so that worker
+    processes forked afterwards start ready to serve.
+
+    :param webhook: The webhook, as ``module:attribute``, importable from the current directory
+    :param hooks: Names of further modules to import, such as those registering hooks
+    :param warmup: Functions called with the webhook once it is loaded, as ``module:attribute``,
+                   to fill caches or open connections before forking
+    :return: the webhook
+    """
+
+    started = _clock()
+    sys.path.insert(0, os.getcwd())
+    name, webhook = webhook, _import(webhook)
+    for module in hooks:
+        importlib.import_module(module)
+    webhook.json_decoder(_WARMUP_PAYLOAD)
+    for function in warmup:
+        _import(function)(webhook)
+    logger.info("Loaded %s in %.3fs, %s", name, _clock() - started, _describe_memory())
+    return webhook
+
+
+def _import(name):
+    module, _, attribute = name.partition(":")
+    return getattr(importlib.import_module(module), attribute)
+
+
+def _kill(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _memory():
+    """
+    Return the resident memory of this process, and how much of it is shared with others, such
+    as the master process, in bytes. The shared memory is None where it is not known.
+    """
+
+    try:
+        with open("/proc/self/smaps_rollup") as smaps:
+            fields = dict((line.split(":")[0], line.split()[1]) for line in smaps if ":" in line)
+        shared = int(fields.get("Shared_Clean", 0)) + int(fields.get("Shared_Dirty", 0))
+        return int(fields["Rss"]) * 1024, shared * 1024
+    except (IOError, OSError, KeyError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak * (1 if sys.platform == "darwin" else 1024), None
+
+
+def _describe_memory():
+    rss, shared = _memory()
+    if shared is None:
+        return "RSS {0:.1f}MB".format(rss / 1048576.0)
+    return "RSS {0:.1f}MB ({1:.1f}MB shared)".format(rss / 1048576.0, shared / 1048576.0)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(prog="python -m github_webhook", description=__doc__.split(":")[0])
+    parser.add_argument("--config", help="JSON file of default values for the options below, by name")
+    parser.add_argument("webhook", nargs="?", help="webhook to serve, as module:attribute")
+    parser.add_argument("--hooks", nargs="*", default=[], help="modules to import, registering hooks")
+    parser.add_argument("--warmup", nargs="*", default=[], help="functions warming the webhook up, as module:attribute")
+    parser.add_argument("--bind", default="127.0.0.1:8000", help="address to listen on, as host:port")
+    parser.add_argument("--workers", type=int, help="number of worker processes; one per CPU by default")
+    parser.add_argument("--endpoint", default="/postreceive", help="path deliveries are posted to")
+    parser.add_argument("--metrics-endpoint", help="path serving the metrics")
+    parser.add_argument("--keepalive", type=float, default=5, help="seconds idle connections are kept open")
+    parser.add_argument("--graceful-timeout", type=float, default=30, help="seconds workers have to finish")
+    parser.add_argument("--log-level", default="INFO", help="level of the logs written to stderr")
+
+    known, _ = parser.parse_known_args(argv)
+    if known.config is not None:
+        with open(known.config) as handle:
+            parser.set_defaults(**dict((key.replace("-", "_"), value) for key, value in json.load(handle).items()))
+    args = parser.parse_args(argv)
+    if args.webhook is None:
+        parser.error("the webhook to serve is required")
+
+    logging.basicConfig(level=args.log_level, format="%(asctime)s [%(process)d] %(levelname)s %(message)s")
+    host, _, port = args.bind.rpartition(":")
+    server = Server(
+        load(args.webhook, args.hooks, args.warmup),
+        bind=(host.strip("[]") or "0.0.0.0", int(port)),
+        workers=args.workers,
+        endpoint=args.endpoint,
+        metrics_endpoint=args.metrics_endpoint,
+        keepalive=args.keepalive,
+        graceful_timeout=args.graceful_timeout,
+    )
+    server.run(argv)
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
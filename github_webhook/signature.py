@@ -0,0 +1,119 @@
+"""Verification of the signatures Github attaches to deliveries."""
+
+import hashlib
+import hmac
+
+import six
+
+#: Signature header sent by Github for each supported digest algorithm
+HEADERS = {"sha256": "X-Hub-Signature-256", "sha1": "X-Hub-Signature"}
+
+#: Algorithms each policy accepts, in order of preference
+POLICIES = {"sha256": ("sha256",), "prefer-sha256": ("sha256", "sha1"), "sha1": ("sha1",)}
+
+
+class InvalidSignature(ValueError):
+    """Raised when a delivery is not signed in a way the policy accepts"""
+
+
+class Verifier(object):
+    """
+    Verify deliveries against one or more secrets, so a secret can be rotated without dropping
+    deliveries signed with the old one.
+
+    The keyed HMAC state for each secret is computed once, up front, and copied for every
+    delivery; only the digest selected by the signature policy is computed.
+
+    :param secrets: Sequence of secrets, as bytes
+    """
+
+    def __init__(self, secrets):
+        self.secrets = tuple(secrets)
+        self._templates = dict(
+            (algorithm, [hmac.new(secret, digestmod=getattr(hashlib, algorithm)) for secret in self.secrets])
+            for algorithm in HEADERS
+        )
+
+    def signature(self, headers, policy="prefer-sha256"):
+        """
+        Return the :class:`Signature` a delivery must be verified against.
+
+        :param headers: Mapping of lower-cased request header names to values
+        :param policy: One of :data:`POLICIES`
+        :raises InvalidSignature: if the delivery carries no signature acceptable under the policy
+        """
+
+        try:
+            algorithms = POLICIES[policy]
+        except KeyError:
+            raise ValueError("Unknown signature policy: {0!r}".format(policy))
+
+        for algorithm in algorithms:
+            header = headers.get(HEADERS[algorithm].lower())
+            if header is not None:
+                break
+        else:
+            raise InvalidSignature("Missing header: " + HEADERS[algorithms[0]])
+
+        sig_parts = header.split("=", 1)
+        if len(sig_parts) < 2 or sig_parts[0] != algorithm:
+            raise InvalidSignature("Invalid signature")
+
+        return Signature(sig_parts[1], [template.copy() for template in self._templates[algorithm]])
+
+
+class Signature(object):
+    """
+    The digest a delivery claims, and one HMAC per candidate secret to check it against. Every
+    chunk of the body is fed to all of them as it is read, so the body is only traversed once.
+
+    :param expected: Hex digest sent by Github, as text or bytes
+    :param macs: HMAC objects, one per candidate secret
+    """
+
+    def __init__(self, expected, macs):
+        self.expected = expected if isinstance(expected, six.binary_type) else expected.encode("utf-8")
+        self.macs = macs
+
+    def update(self, data):
+        for mac in self.macs:
+            mac.update(data)
+
+    def verify(self):
+        """Return whether the body matches the signature under any of the candidate secrets"""
+
+        matches = [hmac.compare_digest(self.expected, mac.hexdigest().encode("ascii")) for mac in self.macs]
+        return any(matches)
+
+
+def encode_secrets(secret):
+    """
+    Return a tuple of secrets, as bytes, from :code:`None`, a single secret or a list of them.
+
+    :param secret: Secret or list of secrets, as text or bytes
+    """
+
+    if secret is None:
+        secrets = []
+    elif isinstance(secret, (six.binary_type, six.text_type)):
+        secrets = [secret]
+    else:
+        secrets = list(secret)
+    return tuple(s if isinstance(s, six.binary_type) else s.encode("utf-8") for s in secrets)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
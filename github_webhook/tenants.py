@@ -0,0 +1,75 @@
+"""Secrets of the tenants of a webhook serving many Github integrations on a single endpoint."""
+
+from github_webhook.cache import LRUCache
+from github_webhook.signature import Verifier, encode_secrets
+
+#: Header identifying the repository, organization or app a delivery's hook is installed on
+TENANT_HEADER = "X-GitHub-Hook-Installation-Target-ID"
+
+_MISSING = object()
+_UNKNOWN = object()
+
+
+class TenantSecrets(object):
+    """
+    Look up the secrets of tenants as their deliveries arrive, and cache them, so that only the
+    tenants currently active are held in memory, however many there are. Unknown tenants are
+    cached too, so that deliveries for them do not each query the provider.
+
+    :param provider: Mapping or function returning the secret of a tenant: a secret, a list of
+                     secrets while rotating them, an empty list if its deliveries are not signed,
+                     or :code:`None` if the tenant is unknown
+    :param max_size: Maximum number of tenants cached
+    :param ttl: Number of seconds a secret is cached for, so that rotated secrets are picked up
+    """
+
+    def __init__(self, provider, max_size=10000, ttl=300):
+        self._load = provider if callable(provider) else provider.get
+        self._cache = LRUCache(max_size=max_size, ttl=ttl)
+
+    def verifier(self, tenant):
+        """
+        Return the :class:`~github_webhook.signature.Verifier` of a tenant, or :code:`None` if its
+        deliveries are not signed.
+
+        :raises KeyError: if the tenant is unknown
+        """
+
+        verifier = self._cache.get(tenant, _MISSING)
+        if verifier is _MISSING:
+            secret = self._load(tenant)
+            if secret is None:
+                verifier = _UNKNOWN
+            else:
+                secrets = encode_secrets(secret)
+                verifier = Verifier(secrets) if secrets else None
+            self._cache.set(tenant, verifier)
+
+        if verifier is _UNKNOWN:
+            raise KeyError(tenant)
+        return verifier
+
+    def invalidate(self, tenant=None):
+        """Forget the cached secret of :code:`tenant`, or of every tenant"""
+
+        if tenant is None:
+            self._cache.clear()
+        else:
+            self._cache.discard(tenant)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
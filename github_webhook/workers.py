@@ -0,0 +1,368 @@
+"""
+Pool of worker processes running the hooks of verified deliveries, fed over a Unix socket, so that
+CPU-bound hooks scale across cores. Workers run ``python -m github_webhook.workers``.
+"""
+
+import argparse
+import collections
+import importlib
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from github_webhook.dispatch import DispatcherClosed, QueueFull
+
+_DELIVERY = struct.Struct(">QII")  # sequence number, length of the headers, length of the body
+_ACK = struct.Struct(">QB")  # sequence number, whether every hook succeeded
+
+#: Environment variable set in worker processes. The journal and recorder that importing the
+#: webhook builds there are left to the process feeding the workers: journals are opened
+#: read-only, and recorders do not open their archive.
+WORKER_ENV = "GITHUB_WEBHOOK_WORKER"
+
+_clock = getattr(time, "monotonic", time.time)
+
+logger = logging.getLogger("webhook")
+
+
+class WorkerFleet(object):
+    """
+    Run the hooks of deliveries in a pool of worker processes, each importing the webhook named by
+    :code:`webhook`, so that they neither hold the GIL of the process answering Github nor share
+    a single core. Verified deliveries are sent, as their raw headers and body, over a Unix
+    socket to the workers, which parse them, run their hooks and acknowledge them once the hooks
+    have returned.
+
+    A worker that exits is restarted, and the deliveries it had not acknowledged are handed to the
+    others; a delivery during which :code:`max_attempts` workers died is dropped as failed. The
+    workers are started with the first delivery, or by :meth:`start`.
+
+    :param webhook: The webhook whose hooks workers run, as ``module:attribute``, importable from
+                    the current directory
+    :param workers: Number of worker processes; one per CPU by default
+    :param max_pending: Maximum number of deliveries queued or running at once. Further
+                        deliveries are refused with ``503 Service Unavailable``.
+    :param prefetch: Number of deliveries sent to a worker ahead of its acknowledgements
+    :param max_attempts: Number of workers a delivery may be sent to
+    :param socket_path: Optional path of the Unix socket; by default in a temporary directory
+    """
+
+    def __init__(self, webhook, workers=None, max_pending=1024, prefetch=2, max_attempts=3, socket_path=None):
+        self.webhook = webhook
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_pending = max_pending
+        self.prefetch = prefetch
+        self.max_attempts = max_attempts
+        self.socket_path = socket_path
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._pending = 0
+        self._seq = itertools.count(1)
+        self._connections = set()
+        self._processes = []
+        self._listener = None
+        self._tempdir = None
+        self._stopping = threading.Event()
+        self._started = False
+        self._closed = False
+
+    @property
+    def pending(self):
+        """Number of deliveries queued or running"""
+
+        with self._cond:
+            return self._pending
+
+    def start(self):
+        """Start the workers, unless they are already running"""
+
+        with self._cond:
+            if self._closed:
+                raise DispatcherClosed("Worker fleet is shutting down")
+            if self._started:
+                return
+            self._started = True
+
+            if self.socket_path is None:
+                self._tempdir = tempfile.mkdtemp(prefix="webhook-workers-")
+                self.socket_path = os.path.join(self._tempdir, "workers.sock")
+            self._listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._listener.bind(self.socket_path)
+            self._listener.listen(self.workers)
+            self._processes = [self._spawn() for _ in range(self.workers)]
+
+        for target, name in [(self._accept, "webhook-workers-accept"), (self._supervise, "webhook-workers-supervise")]:
+            thread = threading.Thread(target=target, name=name)
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, headers, body, on_complete=None):
+        """
+        Queue a verified delivery for the workers.
+
+        :param headers: Mapping of lower-cased request header names to values
+        :param body: Raw request body, as a bytes-like object
+        :param on_complete: Optional callable, passed whether every hook succeeded once a worker
+                            has acknowledged the delivery, or it was dropped
+        :raises QueueFull: if :code:`max_pending` deliveries are already pending, or the fleet
+                           is shutting down
+        """
+
+        if not self._started:
+            self.start()
+
+        encoded = json.dumps(dict(headers)).encode("utf-8")
+        with self._cond:
+            if self._closed:
+                raise DispatcherClosed("Worker fleet is shutting down")
+            if self._pending >= self.max_pending:
+                raise QueueFull("Too many pending deliveries")
+            seq = next(self._seq)
+            frame = (_DELIVERY.pack(seq, len(encoded), len(body)), encoded, body)
+            self._queue.append(_Delivery(seq, frame, on_complete))
+            self._pending += 1
+            self._cond.notify_all()
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop accepting deliveries, wait for those pending to be acknowledged if :code:`wait` is
+        true, and stop the workers. Deliveries still pending after :code:`timeout` seconds are
+        abandoned; their :code:`on_complete` callback is not called.
+
+        :param wait: Block until pending deliveries have been acknowledged; otherwise the workers are
+                     killed at once
+        :param timeout: Optional maximum number of seconds to wait
+        """
+
+        deadline = None if timeout is None else _clock() + timeout
+        if not wait:
+            deadline = _clock()
+        with self._cond:
+            self._closed = True
+            if not self._started:
+                return
+            while self._pending:
+                remaining = None if deadline is None else deadline - _clock()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            connections = list(self._connections)
+            for connection in connections:
+                connection.alive = False
+            self._stopping.set()
+            self._cond.notify_all()
+
+        _close(self._listener)
+        for connection in connections:
+            _close(connection.sock)
+
+        for process in self._processes:
+            while process.poll() is None and (deadline is None or _clock() < deadline):
+                time.sleep(0.01)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        if self._tempdir is not None:
+            shutil.rmtree(self._tempdir, ignore_errors=True)
+
+    def _spawn(self):
+        command = [sys.executable, "-m", "github_webhook.workers", self.socket_path, self.webhook]
+        return subprocess.Popen(command, env=dict(os.environ, **{WORKER_ENV: "1"}))
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._listener.accept()
+            except (OSError, socket.error):  # the listener was closed
+                return
+
+            connection = _Connection(sock)
+            with self._cond:
+                if self._stopping.is_set():
+                    sock.close()
+                    continue
+                self._connections.add(connection)
+            for target in (self._send, self._receive_acks):
+                thread = threading.Thread(target=target, args=(connection,), name="webhook-workers-connection")
+                thread.daemon = True
+                thread.start()
+
+    def _send(self, connection):
+        while True:
+            with self._cond:
+                while connection.alive and (not self._queue or len(connection.in_flight) >= self.prefetch):
+                    self._cond.wait()
+                if not connection.alive:
+                    return
+                delivery = self._queue.popleft()
+                connection.in_flight[delivery.seq] = delivery
+
+            try:
+                for chunk in delivery.frame:
+                    connection.sock.sendall(chunk)
+            except (OSError, socket.error):
+                self._lost(connection)
+                return
+
+    def _receive_acks(self, connection):
+        while True:
+            frame = _recv_exactly(connection.sock, _ACK.size)
+            if frame is None:
+                break
+            seq, succeeded = _ACK.unpack(frame)
+            with self._cond:
+                delivery = connection.in_flight.pop(seq, None)
+                if delivery is not None:
+                    self._pending -= 1
+                    self._cond.notify_all()
+            if delivery is not None:
+                _complete(delivery, bool(succeeded))
+        self._lost(connection)
+
+    def _lost(self, connection):
+        """Hand the deliveries a worker had not acknowledged to the others"""
+
+        with self._cond:
+            if not connection.alive:
+                return
+            connection.alive = False
+            self._connections.discard(connection)
+            unacknowledged = sorted(connection.in_flight.values(), key=lambda delivery: delivery.seq)
+            connection.in_flight.clear()
+            # Workers run deliveries in order: only the oldest was running, the others are not to blame
+            dropped = []
+            if unacknowledged:
+                unacknowledged[0].attempts += 1
+            for delivery in reversed(unacknowledged):
+                if delivery.attempts >= self.max_attempts:
+                    dropped.append(delivery)
+                    self._pending -= 1
+                else:
+                    self._queue.appendleft(delivery)
+            self._cond.notify_all()
+
+        _close(connection.sock)
+        if unacknowledged:
+            logger.warning("Lost a worker with %d unacknowledged deliveries", len(unacknowledged))
+        for delivery in dropped:
+            logger.error("Dropping a delivery after %d workers died running it", delivery.attempts)
+            _complete(delivery, False)
+
+    def _supervise(self):
+        # Workers are restarted until the fleet has drained, even while it is shutting down
+        while not self._stopping.wait(0.2):
+            with self._cond:
+                for i, process in enumerate(self._processes):
+                    if process.poll() is not None and not self._stopping.is_set():
+                        logger.warning(
+                            "Worker %d exited with status %s, restarting it", process.pid, process.returncode
+                        )
+                        self._processes[i] = self._spawn()
+
+
+class _Delivery(object):
+    __slots__ = ("seq", "frame", "on_complete", "attempts")
+
+    def __init__(self, seq, frame, on_complete):
+        self.seq = seq
+        self.frame = frame
+        self.on_complete = on_complete
+        self.attempts = 0
+
+
+class _Connection(object):
+    __slots__ = ("sock", "in_flight", "alive")
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.in_flight = {}  # seq -> _Delivery
+        self.alive = True
+
+
+def _complete(delivery, succeeded):
+    if delivery.on_complete is not None:
+        try:
+            delivery.on_complete(succeeded)
+        except Exception:
+            logger.exception("Completion callback raised an exception")
+
+
+def _close(sock):
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except (OSError, socket.error):
+        pass
+    sock.close()
+
+
+def _recv_exactly(sock, size):
+    """Read :code:`size` bytes, or return None if the connection is closed first"""
+
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        try:
+            count = sock.recv_into(view[received:], size - received)
+        except (OSError, socket.error):
+            return None
+        if not count:
+            return None
+        received += count
+    return bytes(buffer)
+
+
+def serve(webhook, sock):
+    """
+    Run the hooks of every delivery received on :code:`sock`, one at a time, and acknowledge
+    each, until the connection is closed.
+
+    :param webhook: The :class:`~github_webhook.core.WebhookCore` whose hooks to run
+    :param sock: Socket connected to a :class:`WorkerFleet`
+    """
+
+    while True:
+        frame = _recv_exactly(sock, _DELIVERY.size)
+        if frame is None:
+            return
+        seq, headers_length, body_length = _DELIVERY.unpack(frame)
+        headers = _recv_exactly(sock, headers_length)
+        body = _recv_exactly(sock, body_length)
+        if headers is None or body is None:
+            return
+        succeeded = webhook._run_verified(json.loads(headers.decode("utf-8")), body)
+        sock.sendall(_ACK.pack(seq, succeeded))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m github_webhook.workers", description=__doc__.split(",")[0])
+    parser.add_argument("socket", help="Unix socket of the worker fleet")
+    parser.add_argument("webhook", help="webhook whose hooks to run, as module:attribute")
+    args = parser.parse_args(argv)
+
+    module, _, attribute = args.webhook.partition(":")
+    sys.path.insert(0, os.getcwd())
+    webhook = getattr(importlib.import_module(module), attribute)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(args.socket)
+    try:
+        serve(webhook, sock)
+    finally:
+        sock.close()
+        webhook.shutdown()
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
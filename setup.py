@@ -9,7 +9,8 @@ setup(
     author_email="achamberlai9@bloomberg.net, fphillips7@bloomberg.net, dkiss1@bloomberg.net, dbeer1@bloomberg.net",
     license="Apache 2.0",
     packages=["github_webhook"],
-    install_requires=["flask", "six"],
+    install_requires=["flask", "six", 'futures; python_version < "3"'],
+    extras_require={"orjson": ["orjson"], "simdjson": ["pysimdjson"], "ujson": ["ujson"]},
     tests_require=["mock", "pytest"],
     classifiers=[
         "Development Status :: 4 - Beta",
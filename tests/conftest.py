@@ -0,0 +1,4 @@
+import sys
+
+# Coroutine hooks and the ASGI adapter need Python 3
+collect_ignore = ["test_asgi.py"] if sys.version_info < (3, 5) else []
@@ -0,0 +1,221 @@
+"""Tests for github_webhook.admission"""
+
+import io
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.admission import HIGH, LOW, AdmissionControl, TokenBucket
+from github_webhook.core import WebhookCore, WebhookError
+from github_webhook.metrics import PrometheusMetrics
+
+HEADERS = {"X-Github-Event": "push", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+
+@mock.patch("github_webhook.admission._clock")
+def test_token_bucket_refills_over_time(clock):
+    # GIVEN
+    clock.return_value = 100.0
+    bucket = TokenBucket(rate=2, burst=3)
+
+    # WHEN
+    taken = [bucket.take() for _ in range(4)]
+    clock.return_value = 101.0
+    refilled = bucket.tokens
+    clock.return_value = 1000.0
+
+    # THEN
+    assert taken == [True, True, True, False]
+    assert refilled == 2.0
+    assert bucket.tokens == 3.0
+
+
+def test_token_bucket_keeps_a_reserve():
+    # GIVEN
+    bucket = TokenBucket(rate=0.001, burst=4)
+
+    # WHEN
+    taken = [bucket.take(reserve=0.5) for _ in range(3)]
+
+    # THEN
+    assert taken == [True, True, False]
+    assert bucket.take()
+
+
+@pytest.mark.parametrize("rate, burst", [(0, None), (-1, 5)])
+def test_token_bucket_rejects_invalid_rates(rate, burst):
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        TokenBucket(rate, burst)
+
+
+def test_low_priority_events_are_shed_first():
+    # GIVEN
+    admission = AdmissionControl(rate=(0.001, 4), priorities={"issues": LOW, "gollum": HIGH})
+
+    # WHEN
+    reasons = [admission.admit(event) for event in ["watch", "issues", "ping", "watch", "push", "gollum", "push"]]
+
+    # THEN
+    assert reasons == [None, None, None, "overload", None, "overload", "overload"]
+    assert admission.shed == {("watch", "overload"): 1, ("gollum", "overload"): 1, ("push", "overload"): 1}
+
+
+def test_event_types_have_limits_of_their_own():
+    # GIVEN
+    admission = AdmissionControl(event_rates={"status": (0.001, 2), "push": 1000})
+
+    # WHEN
+    reasons = [admission.admit("status") for _ in range(3)] + [admission.admit("push"), admission.admit("ping")]
+
+    # THEN
+    assert reasons == [None, None, "event", None, None]
+    assert admission.shed == {("status", "event"): 1}
+
+
+def test_repositories_have_limits_of_their_own():
+    # GIVEN
+    admission = AdmissionControl(repository_rate=(0.001, 2), max_repositories=2)
+
+    # WHEN
+    reasons = [admission.admit_repository("push", "org/a") for _ in range(3)]
+    reasons += [admission.admit_repository("watch", "org/b"), admission.admit_repository("watch", "org/b")]
+    reasons += [admission.admit_repository("push", None)]
+
+    # THEN
+    assert reasons == [None, None, "repository", None, "repository", None]
+    assert admission.shed == {("push", "repository"): 1, ("watch", "repository"): 1}
+
+
+def test_repository_buckets_are_shared_between_threads():
+    # GIVEN
+    admission = AdmissionControl(repository_rate=(0.001, 1))
+    admission._repository_buckets = mock.Mock(wraps=admission._repository_buckets)
+    admission._repository_buckets.get.side_effect = [None, TokenBucket(0.001, 1)]
+    admission._repository_buckets.add.return_value = False
+
+    # WHEN
+    reason = admission.admit_repository("push", "org/a")
+
+    # THEN
+    assert reason is None
+    admission._repository_buckets.get.assert_called_with("org/a", mock.ANY)
+
+
+def test_repository_limits_are_off_by_default():
+    # WHEN, THEN
+    assert AdmissionControl().admit_repository("push", "org/a") is None
+
+
+def test_shed_deliveries_are_refused_before_their_body_is_read():
+    # GIVEN
+    metrics = PrometheusMetrics()
+    core = WebhookCore(admission=AdmissionControl(event_rates={"push": (0.001, 1)}), metrics=metrics)
+    handler = mock.Mock()
+    core.hook()(handler)
+    core.handle_stream(HEADERS, io.BytesIO(b"{}"))
+    stream = mock.Mock()
+
+    # WHEN
+    with pytest.raises(WebhookError) as error:
+        core.handle_stream(HEADERS, stream)
+
+    # THEN
+    assert error.value.status == 429
+    stream.read.assert_not_called()
+    handler.assert_called_once_with({})
+    assert 'github_webhook_shed_total{event="push",reason="event"} 1' in metrics.render()
+
+
+def test_deliveries_over_the_limit_of_their_repository_are_refused():
+    # GIVEN
+    core = WebhookCore(admission=AdmissionControl(repository_rate=(0.001, 1)))
+    handler = mock.Mock()
+    core.hook()(handler)
+    body = b'{"repository": {"full_name": "org/repo"}}'
+
+    # WHEN
+    core.handle(HEADERS, body)
+    with pytest.raises(WebhookError) as error:
+        core.handle(HEADERS, body)
+
+    # THEN
+    assert error.value.status == 429
+    assert handler.call_count == 1
+
+
+def test_deliveries_without_event_type_are_left_to_verification():
+    # GIVEN
+    core = WebhookCore(admission=AdmissionControl(rate=1))
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as error:
+        core.handle({"content-type": "application/json"}, b"{}")
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize("reserve", [0.0, 0.25, 0.5])
+def test_full_token_buckets_give_a_token_whatever_the_reserve(reserve):
+    # GIVEN
+    bucket = TokenBucket(rate=0.001, burst=1)
+
+    # WHEN, THEN
+    assert bucket.take(reserve)
+    assert not bucket.take(reserve)
+
+
+def test_token_buckets_reject_bursts_below_one():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        TokenBucket(0.5, 0.5)
+
+
+def test_every_priority_class_is_admitted_by_small_buckets():
+    # GIVEN
+    admission = AdmissionControl(rate=1, repository_rate=1)
+
+    # WHEN
+    reasons = [admission.admit("watch"), admission.admit_repository("issues", "org/a")]
+
+    # THEN
+    assert reasons == [None, None]
+
+
+def test_unknown_event_types_are_counted_together():
+    # GIVEN
+    metrics = PrometheusMetrics()
+    admission = AdmissionControl(event_rates={"made-up": (0.001, 1)}, rate=(0.001, 3))
+    core = WebhookCore(admission=admission, metrics=metrics)
+    core.hook()(mock.Mock())
+    core.handle_stream(dict(HEADERS, **{"X-Github-Event": "made-up"}), io.BytesIO(b"{}"))
+
+    # WHEN
+    for event_type in ["made-up", "invented", "fabricated"]:
+        with pytest.raises(WebhookError):
+            core.handle_stream(dict(HEADERS, **{"X-Github-Event": event_type}), mock.Mock())
+
+    # THEN
+    assert admission.shed == {("made-up", "event"): 1, ("other", "overload"): 2}
+    assert 'github_webhook_shed_total{event="other",reason="overload"} 2' in metrics.render()
+    assert 'github_webhook_shed_total{event="made-up",reason="event"} 1' in metrics.render()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,574 @@
+"""Tests for github_webhook.asgi"""
+
+import asyncio
+import hashlib
+import hmac
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.admission import AdmissionControl
+from github_webhook.asgi import AsgiWebhook
+from github_webhook.core import WebhookCore
+from github_webhook.dedup import MemoryDeliveryStore
+from github_webhook.dispatch import PoolDispatcher, QueueFull
+from github_webhook.journal import Journal
+from github_webhook.memo import MemoizedHook
+from github_webhook.metrics import PrometheusMetrics
+from github_webhook.recording import Recorder, read_recording
+
+HEADERS = [
+    (b"x-github-event", b"push"),
+    (b"x-github-delivery", b"72d3162e"),
+    (b"content-type", b"application/json"),
+]
+
+
+@pytest.fixture(autouse=True)
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)  # for the events and queues tests create before running it
+    yield loop
+    loop.close()
+    asyncio.set_event_loop(None)
+
+
+def _run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+
+def _call(app, body=b'{"key": "value"}', path="/postreceive", method="POST", headers=HEADERS):
+    messages = [
+        {"type": "http.request", "body": body[:1], "more_body": True},
+        {"type": "http.request", "body": body[1:]},
+    ]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": path, "method": method, "headers": headers}
+    _run(app(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+
+@pytest.fixture
+def app():
+    yield AsgiWebhook()
+
+
+def test_runs_hooks(app):
+    # GIVEN
+    handler = mock.Mock()
+    app.hook()(handler)
+
+    # WHEN
+    status, body = _call(app)
+
+    # THEN
+    assert (status, body) == (204, b"")
+    handler.assert_called_once_with({"key": "value"})
+
+
+def test_awaits_coroutine_hooks_concurrently(app):
+    # GIVEN
+    first_started, second_started = asyncio.Event(), asyncio.Event()
+    finished = []
+
+    async def first(data):
+        first_started.set()
+        await asyncio.wait_for(second_started.wait(), 5)
+        finished.append("first")
+
+    async def second(data):
+        second_started.set()
+        await asyncio.wait_for(first_started.wait(), 5)
+        finished.append("second")
+
+    app.hook()(first)
+    app.hook()(second)
+
+    # WHEN
+    status, _ = _call(app)
+
+    # THEN
+    assert status == 204
+    assert sorted(finished) == ["first", "second"]
+
+
+def test_unknown_path(app):
+    # WHEN, THEN
+    assert _call(app, path="/other") == (404, b"Not Found")
+
+
+def test_wrong_method(app):
+    # WHEN, THEN
+    assert _call(app, method="GET") == (405, b"Method Not Allowed")
+
+
+def test_refused_delivery(app):
+    # WHEN, THEN
+    assert _call(app, headers=HEADERS[1:]) == (400, b"Missing header: X-Github-Event")
+
+
+def test_failing_hook(app, caplog):
+    # GIVEN
+    async def broken(data):
+        raise RuntimeError("boom")
+
+    app.hook()(broken)
+
+    # WHEN, THEN
+    assert _call(app) == (500, b"Internal Server Error")
+    assert "Hook raised an exception" in caplog.text
+
+
+def test_asynchronous_dispatcher_acknowledges_before_hooks_finish(caplog):
+    # GIVEN
+    app = AsgiWebhook(dispatcher=PoolDispatcher())
+    release = asyncio.Event()
+    done = []
+    blocking = mock.Mock()
+
+    async def handler(data):
+        await release.wait()
+        done.append(data)
+
+    async def broken(data):
+        raise RuntimeError("boom")
+
+    app.hook()(handler)
+    app.hook()(broken)
+    app.hook()(blocking)
+
+    # WHEN
+    status, _ = _call(app)
+
+    # THEN
+    assert status == 202
+    assert done == []
+    release.set()
+    _run(app.drain())
+    app.shutdown()
+    assert done == [{"key": "value"}]
+    blocking.assert_called_once_with({"key": "value"})
+    assert "Hook raised an exception" in caplog.text
+
+
+def test_full_dispatcher_closes_coroutines():
+    # GIVEN
+    dispatcher = mock.Mock(asynchronous=True)
+    dispatcher.dispatch.side_effect = QueueFull("Too many pending deliveries")
+    app = AsgiWebhook(dispatcher=dispatcher)
+    handler = mock.Mock()
+
+    async def coroutine_hook(data):
+        handler(data)
+
+    app.hook()(coroutine_hook)
+
+    # WHEN, THEN
+    assert _call(app) == (503, b"Too many pending deliveries")
+    handler.assert_not_called()
+
+
+def test_lifespan_drains_on_shutdown():
+    # GIVEN
+    dispatcher = mock.Mock(asynchronous=True)
+    app = AsgiWebhook(dispatcher=dispatcher)
+    messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message["type"])
+
+    # WHEN
+    _run(app({"type": "lifespan"}, receive, send))
+
+    # THEN
+    assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+    dispatcher.shutdown.assert_called_once_with(wait=True, timeout=None)
+
+
+def test_synchronous_dispatchers_run_coroutine_hooks_on_their_own_loop():
+    # GIVEN
+    core = WebhookCore()
+    calls = []
+
+    async def handler(data):
+        calls.append(threading.current_thread())
+
+    core.hook()(handler)
+
+    # WHEN
+    core.handle({"X-Github-Event": "push", "X-Github-Delivery": "", "content-type": "application/json"}, b"{}")
+
+    # THEN
+    assert calls == [threading.current_thread()]
+
+
+def test_oversized_delivery():
+    # GIVEN
+    app = AsgiWebhook(max_payload_size=8)
+
+    # WHEN, THEN
+    assert _call(app) == (413, b"Payload exceeds 8 bytes")
+
+
+def test_coroutine_hooks_can_declare_fields(app):
+    # GIVEN
+    received = []
+
+    async def handler(data):
+        received.append(data)
+
+    app.hook(fields=["key"])(handler)
+
+    # WHEN
+    status, _ = _call(app, body=b'{"key": "value", "other": 1}')
+
+    # THEN
+    assert status == 204
+    assert received == [{"key": "value"}]
+
+
+def test_redelivery_is_acknowledged_without_running_hooks():
+    # GIVEN
+    app = AsgiWebhook(dedup=MemoryDeliveryStore())
+    handler = mock.Mock()
+    app.hook()(handler)
+    _call(app)
+
+    # WHEN, THEN
+    assert _call(app) == (200, b"")
+    handler.assert_called_once_with({"key": "value"})
+
+
+def test_concurrent_redelivery_is_acknowledged_once_received():
+    # GIVEN
+    store = mock.Mock(spec=MemoryDeliveryStore)
+    store.__contains__ = mock.Mock(return_value=False)
+    store.claim.return_value = False
+    app = AsgiWebhook(dedup=store)
+    handler = mock.Mock()
+    app.hook()(handler)
+
+    # WHEN, THEN
+    assert _call(app) == (200, b"")
+    handler.assert_not_called()
+
+
+def test_failed_delivery_can_be_redelivered():
+    # GIVEN
+    app = AsgiWebhook(dedup=MemoryDeliveryStore())
+    handler = mock.Mock(side_effect=[RuntimeError("boom"), None])
+    app.hook()(handler)
+    assert _call(app) == (500, b"Internal Server Error")
+
+    # WHEN, THEN
+    assert _call(app) == (204, b"")
+    assert handler.call_count == 2
+
+
+def test_metrics():
+    # GIVEN
+    app = AsgiWebhook(metrics=PrometheusMetrics(), metrics_endpoint="/metrics")
+
+    async def broken(data):
+        raise RuntimeError("boom")
+
+    def blocking(data):
+        pass
+
+    app.hook()(blocking)
+    _call(app)
+    app.hook("ping")(broken)
+    _call(app, headers=[(b"x-github-event", b"ping")] + HEADERS[1:])
+    _call(app, headers=HEADERS[1:])
+
+    # WHEN
+    status, body = _call(app, path="/metrics", method="GET")
+
+    # THEN
+    assert status == 200
+    text = body.decode("utf-8")
+    assert 'github_webhook_responses_total{status="500"} 1' in text
+    assert 'github_webhook_responses_total{status="400"} 1' in text
+    assert 'github_webhook_hook_errors_total{hook="tests.test_asgi.test_metrics.<locals>.broken"} 1' in text
+    assert 'github_webhook_hook_seconds_count{hook="tests.test_asgi.test_metrics.<locals>.blocking"} 1' in text
+
+
+def test_metrics_endpoint_only_serves_get():
+    # GIVEN
+    app = AsgiWebhook(metrics=PrometheusMetrics(), metrics_endpoint="/metrics")
+
+    # WHEN, THEN
+    assert _call(app, path="/metrics") == (405, b"Method Not Allowed")
+    assert _call(app)[0] == 204
+
+
+def test_metrics_endpoint_requires_renderable_sink():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        AsgiWebhook(metrics_endpoint="/metrics")
+
+
+def test_journal_keeps_deliveries_until_hooks_succeed(tmpdir):
+    # GIVEN
+    journal = Journal(str(tmpdir))
+    app = AsgiWebhook(journal=journal)
+    handler = mock.Mock(side_effect=[RuntimeError("boom"), None])
+    app.hook()(handler)
+
+    # WHEN
+    assert _call(app)[0] == 500
+    assert _call(app, headers=[(b"x-github-delivery", b"other")] + HEADERS[:1] + HEADERS[2:])[0] == 204
+
+    # THEN
+    assert [entry.headers["x-github-delivery"] for entry in journal.entries()] == ["72d3162e"]
+
+
+@pytest.mark.parametrize("fail", [False, True])
+def test_journal_with_asynchronous_dispatcher(tmpdir, fail):
+    # GIVEN
+    journal = Journal(str(tmpdir))
+    app = AsgiWebhook(dispatcher=PoolDispatcher(), journal=journal)
+
+    async def coroutine_hook(data):
+        if fail:
+            raise RuntimeError("boom")
+
+    app.hook()(coroutine_hook)
+    app.hook()(mock.Mock())
+
+    # WHEN
+    assert _call(app)[0] == 202
+    _run(app.drain())
+    app.shutdown()
+
+    # THEN
+    assert len(journal) == (1 if fail else 0)
+
+
+def test_journal_drops_refused_deliveries(tmpdir):
+    # GIVEN
+    journal = Journal(str(tmpdir))
+    dispatcher = mock.Mock(asynchronous=True)
+    dispatcher.dispatch.side_effect = QueueFull("Too many pending deliveries")
+    app = AsgiWebhook(dispatcher=dispatcher, journal=journal)
+    app.hook()(mock.Mock())
+
+    # WHEN, THEN
+    assert _call(app)[0] == 503
+    assert len(journal) == 0
+
+
+def test_batch_hooks_are_fed_after_hooks_run():
+    # GIVEN
+    app = AsgiWebhook()
+    handler = mock.Mock()
+    app.batch_hook(window=3600)(handler)
+    app.hook()(mock.Mock())
+
+    # WHEN
+    assert _call(app)[0] == 204
+    app.shutdown()
+
+    # THEN
+    handler.assert_called_once_with([{"key": "value"}])
+
+
+def test_batch_hooks_with_asynchronous_dispatcher():
+    # GIVEN
+    app = AsgiWebhook(dispatcher=PoolDispatcher())
+    handler = mock.Mock()
+    app.batch_hook(window=3600)(handler)
+
+    # WHEN
+    assert _call(app)[0] == 202
+    app.shutdown()
+
+    # THEN
+    handler.assert_called_once_with([{"key": "value"}])
+
+
+def test_workers_receive_verified_deliveries():
+    # GIVEN
+    fleet = mock.Mock()
+    app = AsgiWebhook(workers=fleet)
+
+    # WHEN
+    status, _ = _call(app)
+
+    # THEN
+    assert status == 202
+    headers, body = fleet.submit.call_args[0]
+    assert (headers["x-github-delivery"], bytes(body)) == ("72d3162e", b'{"key": "value"}')
+
+
+def test_admission_control():
+    # GIVEN
+    app = AsgiWebhook(admission=AdmissionControl(event_rates={"push": (0.001, 1)}, repository_rate=(0.001, 1)))
+    app.hook()(mock.Mock())
+
+    # WHEN
+    statuses = [_call(app)[0], _call(app)[0]]
+    app.admission = AdmissionControl(repository_rate=(0.001, 1))
+    body = b'{"repository": {"full_name": "org/repo"}}'
+    statuses += [_call(app, body)[0], _call(app, body)[0]]
+
+    # THEN
+    assert statuses == [204, 429, 204, 429]
+
+
+def test_unhandled_events_are_acknowledged_without_reading_the_body():
+    # GIVEN
+    app = AsgiWebhook(skip_unhandled=True)
+    app.hook("ping")(mock.Mock())
+
+    # WHEN
+    status, _ = _call(app, body=b"not json")
+
+    # THEN
+    assert status == 200
+
+
+def test_recorder_archives_deliveries(tmpdir):
+    # GIVEN
+    recorder = Recorder(str(tmpdir.join("deliveries.gz")))
+    app = AsgiWebhook(recorder=recorder)
+    app.hook()(mock.Mock())
+
+    # WHEN
+    assert _call(app)[0] == 204
+    recorder.close()
+
+    # THEN
+    assert [delivery.body for delivery in read_recording(recorder.path)] == [b'{"key": "value"}']
+
+
+def test_failing_hooks_are_retried(app):
+    # GIVEN
+    scheduler = mock.Mock()
+    app.retries = scheduler
+    app.metrics = PrometheusMetrics()
+    error = RuntimeError("boom")
+
+    async def failing(data):
+        raise error
+
+    app.hook()(failing)
+    app.hook()(mock.Mock(side_effect=error))
+
+    # WHEN
+    status, _ = _call(app)
+
+    # THEN
+    assert status == 204
+    assert scheduler.schedule.call_count == 2
+    assert scheduler.schedule.call_args_list[0] == mock.call(mock.ANY, {"key": "value"}, error, name=mock.ANY)
+
+
+def test_core_batch_hooks_may_be_coroutines():
+    # GIVEN
+    core = WebhookCore()
+    batches = []
+
+    async def handler(batch):
+        batches.append(batch)
+
+    core.batch_hook("status", window=3600)(handler)
+    headers = {"X-Github-Event": "status", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+    # WHEN
+    core.handle(headers, b"{}")
+    core.shutdown()
+
+    # THEN
+    assert batches == [[{}]]
+
+
+@pytest.mark.parametrize(
+    "path, status",
+    [
+        ("/hooks/1/postreceive", 204),
+        ("/hooks/4/postreceive", 404),
+        ("/hooks/1/2/postreceive", 404),
+        ("/postreceive", 404),
+    ],
+)
+def test_endpoint_names_the_tenant(path, status):
+    # GIVEN
+    app = AsgiWebhook(endpoint="/hooks/<tenant>/postreceive", tenants={"1": "one"})
+    body = b'{"key": "value"}'
+    signature = "sha256=" + hmac.new(b"one", body, hashlib.sha256).hexdigest()
+    headers = HEADERS + [(b"x-hub-signature-256", signature.encode("latin-1"))]
+
+    # WHEN, THEN
+    assert _call(app, body, path=path, headers=headers)[0] == status
+
+
+def test_coroutine_functions_are_not_memoized():
+    # GIVEN
+    async def hook(data):
+        pass
+
+    # WHEN, THEN
+    with pytest.raises(TypeError):
+        MemoizedHook(hook, "sha")
+
+
+def test_every_hook_runs_when_some_fail(caplog):
+    # GIVEN
+    dispatcher = mock.Mock(asynchronous=False)
+    dispatcher.dispatch.side_effect = RuntimeError("sync boom")
+    app = AsgiWebhook(dispatcher=dispatcher)
+    finished = []
+
+    async def broken(data):
+        raise ValueError("async boom")
+
+    async def working(data):
+        await asyncio.sleep(0)
+        finished.append(data)
+
+    for hook in (broken, working, mock.Mock()):
+        app.hook()(hook)
+
+    # WHEN
+    status, body = _call(app)
+
+    # THEN
+    assert status == 500
+    assert finished == [{"key": "value"}]
+    [(hooks, data)] = [call[0] for call in dispatcher.dispatch.call_args_list]
+    assert len(hooks) == 1 and data == {"key": "value"}
+    assert "async boom" in caplog.text and "sync boom" in caplog.text
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,294 @@
+"""Tests for github_webhook.batching"""
+
+import json
+import logging
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.batching import BatchHook
+from github_webhook.core import WebhookCore
+from github_webhook.dispatch import PoolDispatcher
+from github_webhook.journal import Journal
+from github_webhook.metrics import PrometheusMetrics, hook_name
+from github_webhook.payload import LazyPayload
+
+HEADERS = {"X-Github-Event": "status", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+
+def _status(repo, sha, state):
+    return {"repository": {"full_name": repo}, "sha": sha, "state": state}
+
+
+def test_batch_is_run_once_the_window_ends():
+    # GIVEN
+    called = threading.Event()
+    handler = mock.Mock(side_effect=lambda batch: called.set())
+    batch = BatchHook(handler, window=0.05)
+
+    # WHEN
+    batch({"n": 1})
+    batch({"n": 2})
+
+    # THEN
+    assert called.wait(5)
+    handler.assert_called_once_with([{"n": 1}, {"n": 2}])
+    assert len(batch) == 0
+
+
+def test_full_batch_is_run_before_the_window_ends():
+    # GIVEN
+    called = threading.Event()
+    handler = mock.Mock(side_effect=lambda batch: called.set())
+    batch = BatchHook(handler, window=3600, max_size=3)
+
+    # WHEN
+    for n in range(3):
+        batch({"n": n})
+
+    # THEN
+    assert called.wait(5)
+    handler.assert_called_once_with([{"n": 0}, {"n": 1}, {"n": 2}])
+
+
+def test_payloads_with_the_same_key_are_collapsed():
+    # GIVEN
+    handler = mock.Mock()
+    batch = BatchHook(handler, window=3600, key=["repository.full_name", "sha"])
+
+    # WHEN
+    batch(_status("org/a", "1", "pending"))
+    batch(_status("org/b", "1", "pending"))
+    batch(_status("org/a", "1", "success"))
+    batch(_status("org/a", "2", "pending"))
+    assert len(batch) == 3
+    batch.close()
+
+    # THEN
+    handler.assert_called_once_with(
+        [_status("org/a", "1", "success"), _status("org/b", "1", "pending"), _status("org/a", "2", "pending")]
+    )
+
+
+def test_key_may_be_a_function():
+    # GIVEN
+    handler = mock.Mock()
+    batch = BatchHook(handler, window=3600, key=lambda data: data["n"] % 2)
+
+    # WHEN
+    for n in range(4):
+        batch({"n": n})
+    batch.close()
+
+    # THEN
+    handler.assert_called_once_with([{"n": 2}, {"n": 3}])
+
+
+def test_fields_are_extracted_as_payloads_arrive():
+    # GIVEN
+    handler = mock.Mock()
+    batch = BatchHook(handler, window=3600, fields=["sha"])
+
+    # WHEN
+    batch(LazyPayload(b'{"sha": "1", "state": "success"}', json.loads))
+    batch.close()
+
+    # THEN
+    handler.assert_called_once_with([{"sha": "1"}])
+
+
+def test_closing_runs_pending_payloads_then_every_later_one():
+    # GIVEN
+    handler = mock.Mock()
+    batch = BatchHook(handler, window=3600)
+    batch({"n": 1})
+
+    # WHEN
+    batch.close()
+    batch({"n": 2})
+
+    # THEN
+    assert handler.call_args_list == [mock.call([{"n": 1}]), mock.call([{"n": 2}])]
+
+
+def test_closing_an_idle_batch():
+    # GIVEN
+    handler = mock.Mock()
+    batch = BatchHook(handler)
+
+    # WHEN
+    batch.close()
+
+    # THEN
+    handler.assert_not_called()
+
+
+def test_exceptions_are_logged(caplog):
+    # GIVEN
+    batch = BatchHook(mock.Mock(side_effect=RuntimeError("boom")), window=3600, name="statuses")
+    batch({"n": 1})
+
+    # WHEN
+    with caplog.at_level(logging.ERROR, logger="webhook"):
+        batch.close()
+
+    # THEN
+    assert "Batch hook statuses raised an exception on 1 payloads" in caplog.text
+
+
+@pytest.mark.parametrize("window, max_size", [(0, 10), (1, 0)])
+def test_invalid_sizes(window, max_size):
+    with pytest.raises(ValueError):
+        BatchHook(mock.Mock(), window=window, max_size=max_size)
+
+
+def test_core_batches_matching_deliveries():
+    # GIVEN
+    core = WebhookCore()
+    handler = mock.Mock()
+    other = mock.Mock()
+    core.batch_hook("status", window=3600, key=["sha"], fields=["sha", "state"], repository="org/*")(handler)
+    core.hook("status")(other)
+
+    # WHEN
+    core.handle(HEADERS, b'{"sha": "1", "state": "pending", "repository": {"full_name": "org/a"}}')
+    core.handle(HEADERS, b'{"sha": "1", "state": "success", "repository": {"full_name": "org/a"}}')
+    core.handle(HEADERS, b'{"sha": "2", "state": "pending", "repository": {"full_name": "elsewhere/a"}}')
+    core.shutdown()
+
+    # THEN
+    handler.assert_called_once_with([{"sha": "1", "state": "success"}])
+    assert other.call_count == 3
+
+
+def test_core_batches_are_not_fed_deliveries_whose_hooks_fail():
+    # GIVEN
+    core = WebhookCore()
+    handler = mock.Mock()
+    core.batch_hook("status", window=3600)(handler)
+    core.hook("status")(mock.Mock(side_effect=RuntimeError("boom")))
+
+    # WHEN
+    with pytest.raises(RuntimeError):
+        core.handle(HEADERS, b"{}")
+    core.shutdown()
+
+    # THEN
+    handler.assert_not_called()
+
+
+def test_core_batches_with_a_process_pool():
+    # GIVEN
+    core = WebhookCore(dispatcher=PoolDispatcher(executor="process", max_workers=1))
+    handler = mock.Mock()
+    core.batch_hook("status", window=3600)(handler)
+
+    # WHEN
+    result = core.handle(HEADERS, b"{}")
+    core.shutdown()
+
+    # THEN
+    assert result.status == 202
+    handler.assert_called_once_with([{}])
+
+
+def test_core_times_batch_hooks():
+    # GIVEN
+    metrics = PrometheusMetrics()
+    core = WebhookCore(metrics=metrics)
+
+    def statuses(batch):
+        pass
+
+    core.batch_hook("status", window=3600)(statuses)
+
+    # WHEN
+    core.handle(HEADERS, b"{}")
+    core.shutdown()
+
+    # THEN
+    assert '{0}"}} 1'.format(hook_name(statuses)) in metrics.render()
+
+
+def test_replay_feeds_batches(tmpdir):
+    # GIVEN
+    journal = Journal(str(tmpdir))
+    journal.append({"x-github-event": "status", "x-github-delivery": "1", "content-type": "application/json"}, b"{}")
+    core = WebhookCore()
+    handler = mock.Mock()
+    core.batch_hook("status", window=3600)(handler)
+
+    # WHEN
+    count = core.replay(journal)
+    core.shutdown()
+
+    # THEN
+    assert count == 1
+    assert len(journal) == 0
+    handler.assert_called_once_with([{}])
+
+
+def test_idle_batches_collect_payloads_after_fork():
+    # GIVEN
+    handler = mock.Mock()
+    batch = BatchHook(handler, window=3600)
+
+    # WHEN
+    batch.after_fork()
+    batch({"n": 1})
+    batch.close()
+
+    # THEN
+    handler.assert_called_once_with([{"n": 1}])
+
+
+def _batch_in_child(batch, queue):
+    batch.after_fork()
+    batch({"n": 2})
+    batch.close()
+    queue.put([call[0][0] for call in batch.hook.call_args_list])
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_payloads_collected_are_left_behind_in_forked_processes():
+    # GIVEN
+    batch = BatchHook(mock.Mock(), window=3600)
+    batch({"n": 1})
+    # Python 2 has no contexts, and always forks
+    context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+    queue = context.Queue()
+
+    # WHEN
+    process = context.Process(target=_batch_in_child, args=(batch, queue))
+    process.start()
+    calls = queue.get(timeout=15)
+    process.join()
+
+    # THEN
+    assert calls == [[{"n": 2}]]
+    batch.close()
+    batch.hook.assert_called_once_with([{"n": 1}])
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
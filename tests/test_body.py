@@ -0,0 +1,101 @@
+"""Tests for github_webhook.body"""
+
+import hashlib
+import hmac
+import io
+
+import pytest
+
+from github_webhook import body
+from github_webhook.body import BodyReader, PayloadTooLarge
+from github_webhook.signature import Signature
+
+BODY = b'{"commits": [' + b",".join([b'{"id": "c0ffee"}'] * 1000) + b"]}"
+
+
+class _ReadOnlyStream(object):
+    """A stream without readinto, like some WSGI inputs"""
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size):
+        return self._stream.read(size)
+
+
+@pytest.mark.parametrize("content_length", [None, len(BODY), len(BODY) // 2, len(BODY) * 2])
+@pytest.mark.parametrize("stream_type", [io.BytesIO, _ReadOnlyStream])
+def test_read_from_stream(content_length, stream_type):
+    # GIVEN
+    expected = hmac.new(b"secret", BODY, hashlib.sha256).hexdigest()
+    signature = Signature(expected, [hmac.new(b"secret", digestmod=hashlib.sha256)])
+    reader = BodyReader(signature, content_length=content_length)
+
+    # WHEN
+    body = reader.read_from(stream_type(BODY), chunk_size=1000)
+
+    # THEN
+    assert body.tobytes() == BODY
+    assert signature.verify()
+
+
+def test_feed_chunks():
+    # GIVEN
+    reader = BodyReader(content_length=len(BODY))
+
+    # WHEN
+    for start in range(0, len(BODY), 4096):
+        reader.feed(BODY[start : start + 4096])
+
+    # THEN
+    assert reader.getvalue().tobytes() == BODY
+    assert reader.signature is None
+
+
+def test_declared_length_over_limit_is_refused_before_reading():
+    # WHEN, THEN
+    with pytest.raises(PayloadTooLarge) as e:
+        BodyReader(content_length=1001, max_size=1000)
+    assert e.value.max_size == 1000
+
+
+def test_undeclared_length_over_limit_is_refused_while_reading():
+    # GIVEN
+    reader = BodyReader(max_size=1000)
+    stream = io.BytesIO(BODY)
+
+    # WHEN, THEN
+    with pytest.raises(PayloadTooLarge):
+        reader.read_from(stream, chunk_size=100)
+    assert stream.tell() == 1100
+
+
+def test_declared_length_only_presizes_up_to_a_cap(monkeypatch):
+    # GIVEN
+    monkeypatch.setattr(body, "MAX_PRESIZE", 1000)
+    reader = BodyReader(content_length=2000000000)
+    presized = len(reader._buffer)
+
+    # WHEN
+    value = reader.read_from(io.BytesIO(BODY), chunk_size=100)
+
+    # THEN
+    assert presized == 1000
+    assert value.tobytes() == BODY
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
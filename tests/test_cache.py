@@ -0,0 +1,108 @@
+"""Tests for github_webhook.cache"""
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.cache import LRUCache
+
+
+def test_get_and_set():
+    # GIVEN
+    cache = LRUCache()
+
+    # WHEN
+    cache.set("key", "value")
+
+    # THEN
+    assert cache.get("key") == "value"
+    assert cache.get("other", "default") == "default"
+    assert "key" in cache
+    assert len(cache) == 1
+
+
+def test_least_recently_used_entry_is_evicted():
+    # GIVEN
+    cache = LRUCache(max_size=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+
+    # WHEN
+    cache.set("c", 3)
+
+    # THEN
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+
+
+@mock.patch("github_webhook.cache._clock")
+def test_entries_expire(clock):
+    # GIVEN
+    clock.return_value = 100
+    cache = LRUCache(ttl=10)
+    cache.set("key", "value")
+
+    # WHEN
+    clock.return_value = 110
+
+    # THEN
+    assert cache.get("key") is None
+    assert len(cache) == 0
+
+
+@mock.patch("github_webhook.cache._clock")
+def test_add_only_stores_absent_or_expired_keys(clock):
+    # GIVEN
+    clock.return_value = 100
+    cache = LRUCache(ttl=10)
+
+    # WHEN, THEN
+    assert cache.add("key", 1)
+    assert not cache.add("key", 2)
+    assert cache.get("key") == 1
+    clock.return_value = 110
+    assert cache.add("key", 3)
+    assert cache.get("key") == 3
+
+
+def test_discard_and_clear():
+    # GIVEN
+    cache = LRUCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    # WHEN
+    cache.discard("a")
+    cache.discard("missing")
+
+    # THEN
+    assert list(cache._entries) == ["b"]
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_size_must_be_positive():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        LRUCache(max_size=0)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
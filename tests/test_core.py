@@ -0,0 +1,506 @@
+"""Tests for github_webhook.core"""
+
+import hashlib
+import hmac
+import io
+import json
+import logging
+
+import pytest
+import six
+from six.moves.urllib.parse import parse_qs, urlencode
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import DUPLICATE, UNHANDLED, Result, WebhookCore, WebhookError, _form_field
+from github_webhook.dedup import MemoryDeliveryStore
+from github_webhook import payload as payload_module
+from github_webhook.payload import LazyPayload
+
+HEADERS = {"X-Github-Event": "push", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+
+@pytest.fixture
+def core():
+    yield WebhookCore()
+
+
+def test_handle_runs_hooks(core):
+    # GIVEN
+    handler = mock.Mock()
+    core.hook()(handler)
+
+    # WHEN
+    result = core.handle(HEADERS, b'{"key": "value"}')
+
+    # THEN
+    assert result == Result(204, "")
+    handler.assert_called_once_with({"key": "value"})
+
+
+def test_headers_are_case_insensitive(core):
+    # GIVEN
+    handler = mock.Mock()
+    core.hook()(handler)
+    headers = dict((key.upper(), value) for key, value in HEADERS.items())
+
+    # WHEN
+    core.handle(headers, b"{}")
+
+    # THEN
+    handler.assert_called_once_with({})
+
+
+def test_hooks_may_be_registered_before_the_app(core):
+    # GIVEN
+    handler = mock.Mock()
+
+    # WHEN
+    core.hook("ping")(handler)
+
+    # THEN
+    assert core.receive(dict(HEADERS, **{"X-Github-Event": "ping"}), b"{}") == ([handler], {})
+
+
+@pytest.mark.parametrize("content_type", ["application/json; charset=utf-8", "application/vnd.github+json"])
+def test_json_content_types(core, content_type):
+    # WHEN
+    _, data = core.receive(dict(HEADERS, **{"content-type": content_type}), b'{"key": "value"}')
+
+    # THEN
+    assert data == {"key": "value"}
+
+
+@pytest.mark.parametrize(
+    "content_type, body",
+    [
+        ("application/json", b"{not json"),
+        ("application/x-www-form-urlencoded", b"other=field"),
+        ("text/plain", b'{"key": "value"}'),
+    ],
+)
+def test_request_without_json_is_refused(core, content_type, body):
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.receive(dict(HEADERS, **{"content-type": content_type}), body)
+    assert e.value.status == 400
+
+
+def test_handle_stream(core):
+    # GIVEN
+    handler = mock.Mock()
+    core.hook()(handler)
+
+    # WHEN
+    result = core.handle_stream(dict(HEADERS, **{"Content-Length": "16"}), io.BytesIO(b'{"key": "value"}'))
+
+    # THEN
+    assert result == Result(204, "")
+    handler.assert_called_once_with({"key": "value"})
+
+
+@pytest.mark.parametrize("secret", [None, "secret"])
+def test_oversized_body_is_refused(secret):
+    # GIVEN
+    core = WebhookCore(secret=secret, max_payload_size=8)
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.receive(HEADERS, b'{"key": "value"}')
+    assert e.value.status == 413
+
+
+def test_oversized_stream_is_refused_before_reading():
+    # GIVEN
+    core = WebhookCore(max_payload_size=8)
+    stream = io.BytesIO(b'{"key": "value"}')
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.receive_stream(dict(HEADERS, **{"Content-Length": "16"}), stream)
+    assert e.value.status == 413
+    assert stream.tell() == 0
+
+
+def test_oversized_stream_without_length_is_refused():
+    # GIVEN
+    core = WebhookCore(max_payload_size=8)
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.receive_stream(HEADERS, io.BytesIO(b'{"key": "value"}'))
+    assert e.value.status == 413
+
+
+def test_invalid_content_length_is_refused(core):
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.receive_stream(dict(HEADERS, **{"Content-Length": "lots"}), io.BytesIO(b"{}"))
+    assert e.value.status == 400
+
+
+def test_stream_signature_is_verified():
+    # GIVEN
+    core = WebhookCore(secret="secret")
+    body = b'{"key": "value"}'
+    signature = "sha1=" + hmac.new(b"secret", body, hashlib.sha1).hexdigest()
+
+    # WHEN
+    _, data = core.receive_stream(dict(HEADERS, **{"X-Hub-Signature": signature}), io.BytesIO(body))
+
+    # THEN
+    assert data == {"key": "value"}
+
+
+def test_secrets_can_be_rotated():
+    # GIVEN
+    core = WebhookCore(secret=["new", b"old"])
+    body = b'{"key": "value"}'
+    signature = "sha256=" + hmac.new(b"old", body, hashlib.sha256).hexdigest()
+
+    # WHEN
+    _, data = core.receive(dict(HEADERS, **{"X-Hub-Signature-256": signature}), body)
+
+    # THEN
+    assert core.secret == b"new"
+    assert core.secrets == (b"new", b"old")
+    assert data == {"key": "value"}
+
+
+def test_signature_policy_is_enforced():
+    # GIVEN
+    core = WebhookCore(secret="secret", signature_policy="sha256")
+    body = b'{"key": "value"}'
+    signature = "sha1=" + hmac.new(b"secret", body, hashlib.sha1).hexdigest()
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.receive(dict(HEADERS, **{"X-Hub-Signature": signature}), body)
+    assert e.value.description == "Missing header: X-Hub-Signature-256"
+
+
+def test_unknown_signature_policy_is_refused_up_front():
+    # WHEN, THEN
+    with pytest.raises(ValueError, match="Unknown signature policy: 'sha-256'"):
+        WebhookCore(secret="secret", signature_policy="sha-256")
+
+
+def test_secret_can_be_removed():
+    # GIVEN
+    core = WebhookCore(secret="secret")
+
+    # WHEN
+    core.secret = None
+
+    # THEN
+    assert core.secret is None
+    assert core.receive(HEADERS, b"{}") == ([], {})
+
+
+def test_json_decoder_can_be_chosen():
+    # GIVEN
+    decoder = mock.Mock(return_value={"decoded": True})
+    core = WebhookCore(json_decoder=decoder)
+
+    # WHEN
+    _, data = core.receive(HEADERS, b"{}")
+
+    # THEN
+    assert data == {"decoded": True}
+    decoder.assert_called_once_with(b"{}")
+
+
+def test_lazy_payloads():
+    # GIVEN
+    core = WebhookCore(lazy_payloads=True)
+
+    # WHEN
+    _, data = core.receive(HEADERS, b' {"key": "value"}')
+
+    # THEN
+    assert isinstance(data, LazyPayload)
+    assert data["key"] == "value"
+
+
+@pytest.fixture(params=["simdjson", "decoder"])
+def simdjson(request):
+    if request.param == "simdjson":
+        pytest.importorskip("simdjson")
+        yield request.param
+    else:
+        with mock.patch.object(payload_module, "simdjson", None):
+            yield request.param
+
+
+@pytest.mark.parametrize("body", [b"null", b"{not json", b'{"action": '])
+@pytest.mark.parametrize("hook_filters", [{}, {"action": "opened"}])
+def test_lazy_payloads_refuse_invalid_json(simdjson, body, hook_filters, caplog):
+    # GIVEN
+    caplog.set_level(logging.INFO, "webhook")
+    core = WebhookCore(lazy_payloads=True)
+    hook = mock.Mock()
+    core.hook(**hook_filters)(hook)
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as e:
+        core.handle(HEADERS, body)
+    assert (e.value.status, e.value.description) == (400, "Request body must contain json")
+    hook.assert_not_called()
+
+
+def test_lazy_payloads_are_only_decoded_for_hooks():
+    # GIVEN
+    core = WebhookCore(lazy_payloads=True)
+
+    # WHEN
+    with mock.patch.object(payload_module, "simdjson", None):
+        hooks, data = core.receive(HEADERS, b"{not json")
+
+    # THEN
+    assert hooks == []
+    assert isinstance(data, LazyPayload)
+
+
+def test_lazy_form_encoded_payloads():
+    # GIVEN
+    core = WebhookCore(lazy_payloads=True)
+    headers = dict(HEADERS, **{"content-type": "application/x-www-form-urlencoded"})
+
+    # WHEN
+    _, data = core.receive(headers, b"payload=%7B%22key%22%3A+%22value%22%7D")
+
+    # THEN
+    assert isinstance(data, LazyPayload)
+    assert data == {"key": "value"}
+
+
+def test_hooks_can_declare_the_fields_they_read(core):
+    # GIVEN
+    handler = mock.Mock()
+    core.hook(fields=["repository.full_name"])(handler)
+
+    # WHEN
+    core.handle(HEADERS, b'{"ref": "refs/heads/master", "repository": {"full_name": "a/b", "id": 1}}')
+
+    # THEN
+    handler.assert_called_once_with({"repository": {"full_name": "a/b"}})
+
+
+def test_event_is_logged(core, caplog):
+    # GIVEN
+    caplog.set_level(logging.INFO, logger="webhook")
+
+    # WHEN
+    core.receive(HEADERS, b'{"pusher": {"name": "octocat"}, "ref": "master", "repository": {"full_name": "a/b"}}')
+
+    # THEN
+    assert "octocat pushed master in a/b (72d3162e)" in caplog.text
+
+
+def test_event_without_description_is_logged_by_type(core, caplog):
+    # GIVEN
+    caplog.set_level(logging.INFO, logger="webhook")
+
+    # WHEN
+    core.receive(dict(HEADERS, **{"X-Github-Event": "workflow_run"}), b"{}")
+
+    # THEN
+    assert "workflow_run (72d3162e)" in caplog.text
+
+
+@mock.patch("github_webhook.core.describe")
+def test_event_is_not_formatted_unless_logged(mock_format, core, caplog):
+    # GIVEN
+    caplog.set_level(logging.WARNING, logger="webhook")
+
+    # WHEN
+    core.receive(HEADERS, b"{}")
+
+    # THEN
+    mock_format.assert_not_called()
+
+
+def test_redelivery_is_acknowledged_without_running_hooks():
+    # GIVEN
+    core = WebhookCore(dedup=MemoryDeliveryStore())
+    handler = mock.Mock()
+    core.hook()(handler)
+    core.handle(HEADERS, b"{}")
+
+    # WHEN
+    result = core.handle(HEADERS, b"{}")
+
+    # THEN
+    assert result == DUPLICATE
+    handler.assert_called_once_with({})
+
+
+@mock.patch("github_webhook.core._parse")
+def test_known_redelivery_is_not_read(mock_parse):
+    # GIVEN
+    store = MemoryDeliveryStore()
+    store.claim(HEADERS["X-Github-Delivery"])
+    core = WebhookCore(dedup=store)
+    stream = io.BytesIO(b"{}")
+
+    # WHEN
+    result = core.handle_stream(HEADERS, stream)
+
+    # THEN
+    assert result == DUPLICATE
+    assert stream.tell() == 0
+    mock_parse.assert_not_called()
+
+
+def test_concurrent_redelivery_is_acknowledged_once_received():
+    # GIVEN
+    store = mock.Mock(spec=MemoryDeliveryStore)
+    store.__contains__ = mock.Mock(return_value=False)
+    store.claim.return_value = False
+    core = WebhookCore(dedup=store)
+    handler = mock.Mock()
+    core.hook()(handler)
+
+    # WHEN
+    result = core.handle(HEADERS, b"{}")
+
+    # THEN
+    assert result == DUPLICATE
+    handler.assert_not_called()
+
+
+def test_failed_delivery_can_be_redelivered():
+    # GIVEN
+    core = WebhookCore(dedup=MemoryDeliveryStore())
+    handler = mock.Mock(side_effect=[RuntimeError("boom"), None])
+    core.hook()(handler)
+    with pytest.raises(RuntimeError):
+        core.handle(HEADERS, b"{}")
+
+    # WHEN
+    result = core.handle(HEADERS, b"{}")
+
+    # THEN
+    assert result == Result(204, "")
+    assert handler.call_count == 2
+
+
+def test_delivery_without_id_is_refused_with_dedup():
+    # GIVEN
+    core = WebhookCore(dedup=MemoryDeliveryStore())
+    headers = dict(HEADERS)
+    del headers["X-Github-Delivery"]
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as exc:
+        core.handle(headers, b"{}")
+    assert exc.value.status == 400
+
+
+@pytest.mark.parametrize(
+    "body, expected",
+    [
+        (b"payload=%7B%22a%22%3A+1%7D", b'{"a": 1}'),
+        (b"other=1&payload=%7b%7D&payload=second", b"{}"),
+        (b"xpayload=1&payload=%25%5C%5Cx41", b"%\\\\x41"),
+        (b"payload=50%+off%2", b"50% off%2"),
+        (b"payload=caf\xc3\xa9", b"caf\xc3\xa9"),
+        (b"payload=%E2%9C%93&other=%zz", b"\xe2\x9c\x93"),
+        (bytearray(b"payload=abc"), b"abc"),
+        (memoryview(b"payload=a%26b"), b"a&b"),
+        (b"xpayload=1", None),
+        (b"", None),
+    ],
+)
+def test_form_field(body, expected):
+    # WHEN
+    value = _form_field(body, b"payload")
+
+    # THEN
+    assert value == expected
+    if expected is not None:
+        assert value == _parse_qs(body.tobytes() if isinstance(body, memoryview) else bytes(body))["payload"][0]
+
+
+def _parse_qs(body):
+    """Parse a form with the standard library, which works on bytes on Python 2 and on text on Python 3"""
+
+    if six.PY2:
+        return parse_qs(body, keep_blank_values=True)
+    fields = parse_qs(body.decode("latin-1"), keep_blank_values=True, encoding="latin-1")
+    return dict((name, [value.encode("latin-1") for value in values]) for name, values in fields.items())
+
+
+def test_form_encoded_payloads(core):
+    # GIVEN
+    headers = dict(HEADERS, **{"content-type": "application/x-www-form-urlencoded"})
+    document = json.dumps({"message": b"caf\xc3\xa9 & 100% + more\\n".decode("utf-8")})
+
+    # WHEN
+    _, data = core.receive(headers, urlencode({"other": "x", "payload": document}).encode("ascii"))
+
+    # THEN
+    assert data == json.loads(document)
+
+
+def test_unhandled_events_are_acknowledged_from_their_headers():
+    # GIVEN
+    core = WebhookCore(secret="secret", skip_unhandled=True)
+    core.hook("push")(mock.Mock())
+    stream = mock.Mock()
+    headers = dict(HEADERS, **{"X-Github-Event": "watch", "X-Hub-Signature-256": "sha256=0"})
+
+    # WHEN
+    results = [core.handle_stream(headers, stream), core.handle(headers, b"not even json")]
+
+    # THEN
+    assert results == [UNHANDLED, UNHANDLED]
+    stream.read.assert_not_called()
+
+
+def test_catch_all_and_tenant_hooks_handle_events():
+    # GIVEN
+    core = WebhookCore(skip_unhandled=True)
+    watch, everything = mock.Mock(), mock.Mock()
+    core.hook("watch", tenant="acme")(watch)
+    headers = dict(HEADERS, **{"X-Github-Event": "watch"})
+
+    # WHEN
+    results = [core.handle(headers, b"{}", tenant="acme"), core.handle(headers, b"{}", tenant="other")]
+    core.hook("*")(everything)
+    results.append(core.handle(headers, b"{}", tenant="other"))
+
+    # THEN
+    assert results == [Result(204, ""), UNHANDLED, Result(204, "")]
+    watch.assert_called_once_with({})
+    everything.assert_called_once_with({})
+
+
+def test_deliveries_without_event_type_are_not_skipped():
+    # GIVEN
+    core = WebhookCore(skip_unhandled=True)
+
+    # WHEN, THEN
+    with pytest.raises(WebhookError) as error:
+        core.handle({"X-Github-Delivery": "72d3162e", "content-type": "application/json"}, b"{}")
+    assert error.value.status == 400
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
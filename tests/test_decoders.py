@@ -0,0 +1,106 @@
+"""Tests for github_webhook.decoders"""
+
+import json
+import sys
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.decoders import get_decoder
+
+DOCUMENT = b'{"ref": "refs/heads/master", "commits": [{"id": "c0ffee", "distinct": true}], "size": 1}'
+
+
+def _fake_backend():
+    return mock.Mock(loads=mock.Mock(side_effect=lambda data: json.loads(data.decode("utf-8"))))
+
+
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview, lambda data: data.decode("utf-8")])
+def test_stdlib_decodes_bytes_like_objects(wrap):
+    # WHEN, THEN
+    assert get_decoder("json")(wrap(DOCUMENT)) == json.loads(DOCUMENT.decode("utf-8"))
+
+
+@pytest.mark.parametrize("backend", ["ujson", "simdjson"])
+def test_buffers_are_passed_to_backends_as_bytes(backend):
+    # GIVEN
+    module = _fake_backend()
+
+    # WHEN
+    with mock.patch.dict(sys.modules, {backend: module}):
+        decoded = get_decoder(backend)(memoryview(bytearray(DOCUMENT)))
+
+    # THEN
+    assert decoded["size"] == 1
+    module.loads.assert_called_once_with(DOCUMENT)
+
+
+@pytest.mark.parametrize("backend", ["ujson", "simdjson"])
+def test_bytes_are_passed_to_backends_unchanged(backend):
+    # GIVEN
+    module = _fake_backend()
+
+    # WHEN
+    with mock.patch.dict(sys.modules, {backend: module}):
+        get_decoder(backend)(DOCUMENT)
+
+    # THEN
+    assert module.loads.call_args[0][0] is DOCUMENT
+
+
+def test_orjson():
+    # GIVEN
+    orjson = pytest.importorskip("orjson")
+
+    # WHEN, THEN
+    assert get_decoder("orjson") is orjson.loads
+
+
+def test_auto_falls_back_to_the_standard_library():
+    # WHEN
+    with mock.patch.dict(sys.modules, {"orjson": None, "simdjson": None, "ujson": None}):
+        decode = get_decoder()
+
+    # THEN
+    assert decode(DOCUMENT)["size"] == 1
+    with pytest.raises(ValueError):
+        decode(b"{not json")
+
+
+def test_missing_backend():
+    # WHEN, THEN
+    with mock.patch.dict(sys.modules, {"ujson": None}):
+        with pytest.raises(ImportError):
+            get_decoder("ujson")
+
+
+def test_unknown_backend():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        get_decoder("yaml")
+
+
+def test_callables_are_used_as_is():
+    # WHEN, THEN
+    assert get_decoder(json.loads) is json.loads
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
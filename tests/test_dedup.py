@@ -0,0 +1,148 @@
+"""Tests for github_webhook.dedup"""
+
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.dedup import DeliveryStore, MemoryDeliveryStore, SqliteDeliveryStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmpdir):
+    if request.param == "memory":
+        yield MemoryDeliveryStore()
+    else:
+        yield SqliteDeliveryStore(str(tmpdir.join("deliveries.db")))
+
+
+def test_delivery_is_claimed_once(store):
+    # WHEN, THEN
+    assert "72d3162e" not in store
+    assert store.claim("72d3162e")
+    assert "72d3162e" in store
+    assert not store.claim("72d3162e")
+
+
+def test_released_delivery_can_be_claimed_again(store):
+    # GIVEN
+    store.claim("72d3162e")
+
+    # WHEN
+    store.release("72d3162e")
+
+    # THEN
+    assert "72d3162e" not in store
+    assert store.claim("72d3162e")
+
+
+def test_memory_store_is_bounded():
+    # GIVEN
+    store = MemoryDeliveryStore(max_size=2)
+
+    # WHEN
+    for delivery in ["a", "b", "c"]:
+        store.claim(delivery)
+
+    # THEN
+    assert "a" not in store
+    assert "c" in store
+
+
+@mock.patch("github_webhook.dedup.time")
+def test_sqlite_ids_expire_and_are_purged(mock_time, tmpdir):
+    # GIVEN
+    mock_time.time.return_value = 1000.0
+    store = SqliteDeliveryStore(str(tmpdir.join("deliveries.db")), ttl=10, purge_interval=2)
+    store.claim("a")
+
+    # WHEN
+    mock_time.time.return_value = 1010.0
+
+    # THEN
+    assert "a" not in store
+    assert store.claim("a")
+    store.claim("b")  # second claim purges expired IDs
+    mock_time.time.return_value = 1020.0
+    store.claim("c")
+    store.claim("d")
+    assert store._connection().execute("SELECT id FROM deliveries ORDER BY id").fetchall() == [("c",), ("d",)]
+
+
+def test_sqlite_store_is_shared_between_threads(tmpdir):
+    # GIVEN
+    store = SqliteDeliveryStore(str(tmpdir.join("deliveries.db")))
+    claims = []
+
+    def claim():
+        claims.append(store.claim("72d3162e"))
+
+    # WHEN
+    threads = [threading.Thread(target=claim) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # THEN
+    assert sorted(claims) == [False, False, False, True]
+
+
+def _claim_in_child(store, queue):
+    queue.put((os.getpid(), store.claim("72d3162e")))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_sqlite_store_is_shared_between_processes(tmpdir):
+    # GIVEN
+    store = SqliteDeliveryStore(str(tmpdir.join("deliveries.db")))
+    store.claim("72d3162e")
+    # Python 2 has no contexts, and always forks
+    context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+    queue = context.Queue()
+
+    # WHEN
+    process = context.Process(target=_claim_in_child, args=(store, queue))
+    process.start()
+    pid, claimed = queue.get(timeout=10)
+    process.join()
+
+    # THEN
+    assert pid != os.getpid()
+    assert not claimed
+
+
+def test_interface_is_abstract():
+    # GIVEN
+    store = DeliveryStore()
+
+    # WHEN, THEN
+    with pytest.raises(NotImplementedError):
+        "72d3162e" in store
+    with pytest.raises(NotImplementedError):
+        store.claim("72d3162e")
+    with pytest.raises(NotImplementedError):
+        store.release("72d3162e")
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
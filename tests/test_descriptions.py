@@ -0,0 +1,136 @@
+"""Tests for github_webhook.descriptions"""
+
+import json
+import logging
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore
+from github_webhook.descriptions import EVENT_DESCRIPTIONS, Description, describe
+from github_webhook.payload import LazyPayload
+
+DEPLOYMENT_STATUS = {
+    "deployment": {"ref": "main", "environment": "production"},
+    "deployment_status": {"state": "success"},
+    "repository": {"full_name": "a/b"},
+}
+
+
+@pytest.mark.parametrize(
+    "template, expected",
+    [
+        ("{sender[login]} pushed {ref}", "octocat pushed refs/heads/main"),
+        ("{sender.login} pushed {commits[1][id]}", "octocat pushed def"),
+        ("{size:>4}|{ref!r}", "  42|'refs/heads/main'"),
+        ("{missing} {sender[missing]} {ref[x]} {{literal}}", "? ? ? {literal}"),
+        ("no fields", "no fields"),
+    ],
+)
+def test_description(template, expected):
+    # GIVEN
+    data = {
+        "sender": {"login": "octocat"},
+        "ref": "refs/heads/main",
+        "commits": [{"id": "abc"}, {"id": "def"}],
+        "size": 42,
+    }
+
+    # WHEN, THEN
+    assert Description(template).format(data) == expected
+
+
+@pytest.mark.parametrize("template", ["{}", "{0}", "{[key]}", "{a[b]c}", "{a[b]c[d]}", "{a!x}", "{unclosed"])
+def test_invalid_templates_are_refused(template):
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        Description(template)
+
+
+def test_lazy_payloads_are_looked_up():
+    # GIVEN
+    data = LazyPayload(b'{"sender": {"login": "octocat"}, "ref": "main"}', json.loads)
+
+    # WHEN, THEN
+    assert Description("{sender[login]} pushed {ref}").format(data) == "octocat pushed main"
+
+
+def test_every_builtin_template_compiles():
+    # WHEN, THEN
+    for template in EVENT_DESCRIPTIONS.values():
+        Description(template)
+
+
+def test_deployment_status():
+    # WHEN, THEN
+    assert describe("deployment_status", DEPLOYMENT_STATUS) == "deployment of main to production success in a/b"
+
+
+def test_changes_to_builtin_templates_are_picked_up():
+    # GIVEN
+    with mock.patch.dict(EVENT_DESCRIPTIONS, {"check_suite": "suite {check_suite[id]}"}):
+        # WHEN, THEN
+        assert describe("check_suite", {"check_suite": {"id": 7}}) == "suite 7"
+        assert describe("check_suite", {"check_suite": {"id": 8}}) == "suite 8"
+    assert describe("check_suite", {}) == "check_suite"
+
+
+def test_registered_templates_are_logged(caplog):
+    # GIVEN
+    caplog.set_level(logging.INFO, logger="webhook")
+    core = WebhookCore()
+    core.describe("workflow_run", "{workflow_run[name]} {action} in {repository[full_name]}")
+    headers = {"X-Github-Event": "workflow_run", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+    # WHEN
+    core.receive(
+        headers, b'{"action": "completed", "workflow_run": {"name": "CI"}, "repository": {"full_name": "a/b"}}'
+    )
+
+    # THEN
+    assert "CI completed in a/b (72d3162e)" in caplog.text
+    assert describe("workflow_run", {}) == "workflow_run"
+
+
+def test_missing_fields_ignore_conversions_and_specs():
+    # WHEN, THEN
+    assert Description("{a!r} {b:.2f} {c!s:>3}").format({}) == "? ?   ?"
+    assert repr(Description("{a}")) == "Description('{a}')"
+
+
+def test_lazy_payloads_with_missing_fields():
+    # GIVEN
+    data = LazyPayload(b'{"ref": "main"}', json.loads)
+
+    # WHEN, THEN
+    assert Description("{sender[login]} pushed {ref}").format(data) == "? pushed main"
+
+
+def test_unsuitable_format_spec_falls_back_to_event_type():
+    # GIVEN
+    core = WebhookCore()
+    core.describe("push", "{ref:.2f}")
+
+    # WHEN, THEN
+    assert describe("push", {"ref": "main"}, core._descriptions) == "push"
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,525 @@
+"""Tests for github_webhook.dispatch"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.dispatch import DispatcherClosed, KeyedDispatcher, PoolDispatcher, QueueFull, SerialDispatcher
+from github_webhook.payload import LazyPayload
+
+
+def _broken(data):
+    raise RuntimeError("boom")
+
+
+def _wait_idle(dispatcher):
+    with dispatcher._cond:
+        while dispatcher._pending:
+            dispatcher._cond.wait()
+
+
+def test_serial_dispatcher_runs_hooks_inline():
+    # GIVEN
+    dispatcher = SerialDispatcher()
+    hooks = [mock.Mock(), mock.Mock()]
+
+    # WHEN
+    dispatcher.dispatch(hooks, {"key": "value"})
+    dispatcher.shutdown()
+
+    # THEN
+    for hook in hooks:
+        hook.assert_called_once_with({"key": "value"})
+
+
+def test_pool_dispatcher_runs_hooks():
+    # GIVEN
+    dispatcher = PoolDispatcher(max_workers=2)
+    hooks = [mock.Mock(), mock.Mock()]
+
+    # WHEN
+    dispatcher.dispatch(hooks, {"key": "value"})
+    dispatcher.shutdown()
+
+    # THEN
+    for hook in hooks:
+        hook.assert_called_once_with({"key": "value"})
+    assert dispatcher.pending == 0
+
+
+def test_pool_dispatcher_ignores_empty_hook_list():
+    # GIVEN
+    dispatcher = PoolDispatcher(max_queue=1)
+
+    # WHEN
+    dispatcher.dispatch([], {})
+    dispatcher.dispatch([], {})
+
+    # THEN
+    assert dispatcher.pending == 0
+    dispatcher.shutdown()
+
+
+def test_pool_dispatcher_refuses_when_queue_is_full():
+    # GIVEN
+    release = threading.Event()
+    dispatcher = PoolDispatcher(max_workers=1, max_queue=1)
+    dispatcher.dispatch([lambda data: release.wait()], {})
+
+    # WHEN, THEN
+    with pytest.raises(QueueFull):
+        dispatcher.dispatch([mock.Mock()], {})
+
+    release.set()
+    dispatcher.shutdown()
+
+
+def test_pool_dispatcher_frees_slot_once_delivery_completes():
+    # GIVEN
+    dispatcher = PoolDispatcher(max_workers=1, max_queue=1)
+    dispatcher.dispatch([mock.Mock(), mock.Mock()], {})
+    _wait_idle(dispatcher)
+    hook = mock.Mock()
+
+    # WHEN
+    dispatcher.dispatch([hook], {})
+    dispatcher.shutdown()
+
+    # THEN
+    hook.assert_called_once_with({})
+
+
+def test_pool_dispatcher_refuses_after_shutdown():
+    # GIVEN
+    dispatcher = PoolDispatcher()
+    dispatcher.shutdown()
+
+    # WHEN, THEN
+    with pytest.raises(QueueFull):
+        dispatcher.dispatch([mock.Mock()], {})
+
+
+def test_pool_dispatcher_logs_hook_errors(caplog):
+    # GIVEN
+    def broken(data):
+        raise RuntimeError("boom")
+
+    dispatcher = PoolDispatcher()
+
+    # WHEN
+    dispatcher.dispatch([broken], {})
+    dispatcher.shutdown()
+
+    # THEN
+    assert "Hook broken raised an exception" in caplog.text
+    assert dispatcher.pending == 0
+
+
+def test_pool_dispatcher_times_out_slow_hooks(caplog):
+    # GIVEN
+    release = threading.Event()
+
+    def slow(data):
+        release.wait()
+
+    queued = mock.Mock()
+    dispatcher = PoolDispatcher(max_workers=1, max_queue=1, hook_timeout=0.05)
+
+    # WHEN
+    dispatcher.dispatch([slow, queued], {})
+    with dispatcher._cond:
+        while dispatcher.pending > 1:
+            dispatcher._cond.wait()
+
+    # THEN
+    assert "Hook slow timed out after 0.05s" in caplog.text
+    queued.assert_not_called()
+    release.set()
+    _wait_idle(dispatcher)
+    queued.assert_called_once_with({})
+    dispatcher.shutdown()
+
+
+def test_pool_dispatcher_times_hooks_from_when_they_start():
+    # GIVEN
+    ran = []
+    on_complete = mock.Mock()
+    dispatcher = PoolDispatcher(max_workers=1, hook_timeout=0.5)
+
+    def hook(data):
+        time.sleep(0.2)
+        ran.append(data)
+
+    # WHEN
+    for i in range(3):
+        dispatcher.dispatch([hook], i, on_complete)
+    dispatcher.shutdown()
+
+    # THEN
+    assert ran == [0, 1, 2]
+    assert on_complete.call_args_list == [mock.call(True)] * 3
+
+
+def test_pool_dispatcher_times_out_hooks_on_processes(caplog):
+    # GIVEN
+    dispatcher = PoolDispatcher(max_workers=1, hook_timeout=0.05, executor="process")
+    on_complete = mock.Mock()
+
+    # WHEN
+    dispatcher.dispatch([time.sleep], 0.5, on_complete)
+    dispatcher.dispatch([len, len], [], mock.Mock())
+    _wait_idle(dispatcher)
+
+    # THEN
+    assert "Hook sleep timed out after 0.05s" in caplog.text
+    on_complete.assert_called_once_with(False)
+    dispatcher.shutdown()
+
+
+def test_pool_dispatcher_leaves_pending_hooks_behind_after_fork():
+    # GIVEN
+    release = threading.Event()
+    dispatcher = PoolDispatcher(max_workers=1, max_queue=1, hook_timeout=5)
+    dispatcher.dispatch([lambda data: release.wait(5)], {})
+
+    # WHEN
+    dispatcher.after_fork()  # as a child process would, where that hook is not running
+
+    # THEN
+    assert dispatcher.pending == 0
+    hook = mock.Mock()
+    dispatcher.dispatch([hook], {})
+    release.set()
+    dispatcher.shutdown()
+    hook.assert_called_once_with({})
+
+
+def _time_out_in_child(dispatcher, queue):
+    dispatcher.after_fork()
+    release, done = threading.Event(), threading.Event()
+    completed = []
+
+    def on_complete(succeeded):
+        completed.append(succeeded)
+        done.set()
+
+    dispatcher.dispatch([lambda data: release.wait(5)], {}, on_complete)
+    done.wait(10)
+    queue.put(completed)
+    release.set()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_pool_dispatcher_times_out_hooks_in_forked_processes():
+    # GIVEN
+    dispatcher = PoolDispatcher(max_workers=1, hook_timeout=0.05)
+    # Python 2 has no contexts, and always forks
+    context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+    queue = context.Queue()
+
+    # WHEN
+    process = context.Process(target=_time_out_in_child, args=(dispatcher, queue))
+    process.start()
+    completed = queue.get(timeout=15)
+    process.join()
+
+    # THEN
+    assert completed == [False]
+    dispatcher.shutdown()
+
+
+def test_pool_dispatcher_shutdown_drain_can_time_out():
+    # GIVEN
+    release = threading.Event()
+    dispatcher = PoolDispatcher(max_workers=1)
+    dispatcher.dispatch([lambda data: release.wait()], {})
+
+    # WHEN
+    dispatcher.shutdown(timeout=0.01)
+
+    # THEN
+    assert dispatcher.pending == 1
+    release.set()
+
+
+def test_pool_dispatcher_process_executor():
+    # GIVEN
+    dispatcher = PoolDispatcher(max_workers=1, executor="process")
+
+    # WHEN
+    dispatcher.dispatch([len], {"key": "value"})
+    dispatcher.shutdown()
+
+    # THEN
+    assert dispatcher.pending == 0
+
+
+def test_pool_dispatcher_rejects_unknown_executor():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        PoolDispatcher(executor="fibre")
+
+
+def test_serial_dispatcher_reports_completion():
+    # GIVEN
+    dispatcher = SerialDispatcher()
+    on_complete = mock.Mock()
+
+    # WHEN
+    dispatcher.dispatch([mock.Mock()], {}, on_complete)
+    with pytest.raises(RuntimeError):
+        dispatcher.dispatch([mock.Mock(side_effect=RuntimeError("boom"))], {}, on_complete)
+
+    # THEN
+    assert on_complete.call_args_list == [mock.call(True), mock.call(False)]
+
+
+@pytest.mark.parametrize("hooks, succeeded", [([], True), ([mock.Mock(), mock.Mock()], True), ([_broken], False)])
+def test_pool_dispatcher_reports_completion(hooks, succeeded):
+    # GIVEN
+    dispatcher = PoolDispatcher(max_workers=2)
+    completed = threading.Event()
+    on_complete = mock.Mock(side_effect=lambda succeeded: completed.set())
+
+    # WHEN
+    dispatcher.dispatch(hooks, {}, on_complete)
+
+    # THEN
+    assert completed.wait(5)
+    on_complete.assert_called_once_with(succeeded)
+    dispatcher.shutdown()
+
+
+def test_pool_dispatcher_reports_timed_out_deliveries_as_failed():
+    # GIVEN
+    release = threading.Event()
+    dispatcher = PoolDispatcher(max_workers=1, hook_timeout=0.05)
+    on_complete = mock.Mock()
+
+    # WHEN
+    dispatcher.dispatch([lambda data: release.wait()], {}, on_complete)
+    _wait_idle(dispatcher)
+
+    # THEN
+    on_complete.assert_called_once_with(False)
+    release.set()
+    dispatcher.shutdown()
+
+
+def test_closed_dispatcher_refuses_deliveries():
+    # GIVEN
+    dispatcher = PoolDispatcher()
+    dispatcher.shutdown()
+
+    # WHEN, THEN
+    with pytest.raises(DispatcherClosed):
+        dispatcher.dispatch([mock.Mock()], {})
+
+
+def _blocked(release, calls, name):
+    def hook(data):
+        calls.append((name, data))
+        release.wait(5)
+
+    return hook
+
+
+def test_keyed_dispatcher_runs_deliveries_of_a_key_in_order():
+    # GIVEN
+    dispatcher = KeyedDispatcher(max_workers=4)
+    calls = []
+
+    # WHEN
+    for n in range(20):
+        dispatcher.dispatch([lambda data: calls.append(data["n"])], {"repository": {"full_name": "org/repo"}, "n": n})
+    dispatcher.shutdown()
+
+    # THEN
+    assert calls == list(range(20))
+    assert dispatcher.pending == 0
+
+
+def test_keyed_dispatcher_runs_keys_in_parallel():
+    # GIVEN
+    dispatcher = KeyedDispatcher(max_workers=2)
+    other_ran = threading.Event()
+    waited = []
+
+    # WHEN
+    dispatcher.dispatch([lambda data: waited.append(other_ran.wait(5))], {"repository": {"full_name": "a"}})
+    dispatcher.dispatch([lambda data: other_ran.set()], {"repository": {"full_name": "b"}})
+    dispatcher.shutdown()
+
+    # THEN
+    assert waited == [True]
+
+
+def test_keyed_dispatcher_takes_turns_between_keys():
+    # GIVEN
+    release = threading.Event()
+    calls = []
+    dispatcher = KeyedDispatcher(max_workers=1)
+    dispatcher.dispatch([_blocked(release, calls, "hot")], {"repository": {"full_name": "hot"}, "n": 0})
+    for n in range(1, 3):
+        dispatcher.dispatch([lambda data: calls.append(("hot", data))], {"repository": {"full_name": "hot"}, "n": n})
+    dispatcher.dispatch([lambda data: calls.append(("cold", data))], {"repository": {"full_name": "cold"}, "n": 0})
+
+    # WHEN
+    depths = dispatcher.depths()
+    release.set()
+    dispatcher.shutdown()
+
+    # THEN
+    assert depths == {"hot": 3, "cold": 1}
+    assert [(name, data["n"]) for name, data in calls] == [("hot", 0), ("cold", 0), ("hot", 1), ("hot", 2)]
+
+
+def test_keyed_dispatcher_bounds_queues():
+    # GIVEN
+    release = threading.Event()
+    dispatcher = KeyedDispatcher(max_workers=1, max_queue=2, max_pending=3)
+    hook = _blocked(release, [], "slow")
+    dispatcher.dispatch([hook], {"repository": {"full_name": "a"}})
+    dispatcher.dispatch([hook], {"repository": {"full_name": "a"}})
+
+    # WHEN, THEN
+    with pytest.raises(QueueFull, match="for a"):
+        dispatcher.dispatch([hook], {"repository": {"full_name": "a"}})
+    dispatcher.dispatch([hook], {"repository": {"full_name": "b"}})
+    with pytest.raises(QueueFull):
+        dispatcher.dispatch([hook], {"repository": {"full_name": "c"}})
+
+    release.set()
+    dispatcher.shutdown()
+    assert dispatcher.depths() == {}
+
+
+@pytest.mark.parametrize(
+    "key, data, expected",
+    [
+        ("repository.full_name", {}, None),
+        (
+            ["repository.owner.login", "ref"],
+            {"repository": {"owner": {"login": "org"}}, "ref": "main"},
+            ("org", "main"),
+        ),
+        (lambda data: data["id"], {"id": 7}, 7),
+        ("repository.full_name", LazyPayload(b'{"repository": {"full_name": "org/repo"}}', json.loads), "org/repo"),
+    ],
+)
+def test_keyed_dispatcher_keys(key, data, expected):
+    # GIVEN
+    release = threading.Event()
+    dispatcher = KeyedDispatcher(key=key)
+
+    # WHEN
+    dispatcher.dispatch([_blocked(release, [], "slow")], data)
+    depths = dispatcher.depths()
+    release.set()
+    dispatcher.shutdown()
+
+    # THEN
+    assert depths == {expected: 1}
+
+
+def test_keyed_dispatcher_reports_completion(caplog):
+    # GIVEN
+    dispatcher = KeyedDispatcher()
+    after = mock.Mock()
+    on_complete = mock.Mock(side_effect=[RuntimeError("callback"), None])
+    no_hooks = mock.Mock()
+
+    # WHEN
+    dispatcher.dispatch([_broken, after], {}, on_complete)
+    dispatcher.dispatch([after], {}, on_complete)
+    dispatcher.dispatch([], {}, no_hooks)
+    dispatcher.shutdown()
+
+    # THEN
+    assert on_complete.call_args_list == [mock.call(False), mock.call(True)]
+    no_hooks.assert_called_once_with(True)
+    assert after.call_count == 2
+    assert "Hook _broken raised an exception" in caplog.text
+    assert "Completion callback raised an exception" in caplog.text
+
+
+def test_keyed_dispatcher_shutdown():
+    # GIVEN
+    release = threading.Event()
+    calls = []
+    dispatcher = KeyedDispatcher(max_workers=1)
+    for n in range(3):
+        dispatcher.dispatch([_blocked(release, calls, n)], {})
+
+    # WHEN
+    dispatcher.shutdown(timeout=0.01)
+    pending = dispatcher.pending
+    dispatcher.shutdown(wait=False)
+    release.set()
+    dispatcher._executor.shutdown()
+
+    # THEN
+    assert pending == 3
+    assert calls == [(0, {})]
+    with pytest.raises(DispatcherClosed):
+        dispatcher.dispatch([mock.Mock()], {})
+
+
+def test_serial_dispatcher_runs_every_hook_despite_failures(caplog):
+    # GIVEN
+    dispatcher = SerialDispatcher()
+    on_complete = mock.Mock()
+    hooks = [mock.Mock(side_effect=RuntimeError("first")), mock.Mock(side_effect=ValueError("second")), mock.Mock()]
+
+    # WHEN
+    with pytest.raises(RuntimeError, match="first"):
+        dispatcher.dispatch(hooks, {}, on_complete)
+
+    # THEN
+    hooks[2].assert_called_once_with({})
+    on_complete.assert_called_once_with(False)
+    assert "ValueError: second" in caplog.text
+
+
+def test_keyed_dispatcher_leaves_pending_deliveries_behind_after_fork():
+    # GIVEN
+    release = threading.Event()
+    dispatcher = KeyedDispatcher(max_workers=1)
+    dispatcher.dispatch([lambda data: release.wait(5)], {"repository": {"full_name": "a"}})
+
+    # WHEN
+    dispatcher.after_fork()  # as a child process would, where that delivery is not running
+
+    # THEN
+    assert dispatcher.pending == 0
+    hook = mock.Mock()
+    dispatcher.dispatch([hook], {"repository": {"full_name": "a"}})
+    dispatcher.shutdown()
+    release.set()
+    hook.assert_called_once_with({"repository": {"full_name": "a"}})
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,190 @@
+"""Tests for github_webhook.events"""
+
+import gc
+import json
+import weakref
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore
+from github_webhook.events import (
+    Event,
+    IssuesEvent,
+    PullRequestEvent,
+    PushEvent,
+    Record,
+    Repository,
+    User,
+    WorkflowRunEvent,
+    typed_event,
+)
+from github_webhook.payload import LazyPayload
+
+REPOSITORY = {"id": 1, "full_name": "org/repo", "name": "repo", "owner": {"login": "org"}, "private": False}
+SENDER = {"login": "octocat", "id": 2, "type": "User"}
+
+
+def test_push_event():
+    # GIVEN
+    payload = {
+        "ref": "refs/heads/main",
+        "before": "a" * 40,
+        "after": "b" * 40,
+        "forced": False,
+        "head_commit": {"id": "b" * 40, "message": "Fix"},
+        "pusher": {"name": "octocat"},
+        "repository": REPOSITORY,
+        "sender": SENDER,
+    }
+
+    # WHEN
+    event = typed_event("push", payload)
+
+    # THEN
+    assert isinstance(event, PushEvent)
+    assert (event.ref, event.branch, event.head_commit, event.pusher) == (
+        "refs/heads/main",
+        "main",
+        "b" * 40,
+        "octocat",
+    )
+    assert (event.repository.full_name, event.repository.owner, event.repository.private) == ("org/repo", "org", False)
+    assert (event.sender.login, event.sender.type) == ("octocat", "User")
+    assert event.action is None and event.created is None
+    assert event.payload is None
+    assert not hasattr(event, "__dict__")
+
+
+def test_events_do_not_keep_decoded_payloads():
+    # GIVEN
+    class Payload(dict):
+        pass
+
+    payload = Payload(repository=REPOSITORY, sender=SENDER)
+    reference = weakref.ref(payload)
+
+    # WHEN
+    event = typed_event("push", payload)
+    del payload
+    gc.collect()
+
+    # THEN
+    assert reference() is None
+    assert event.repository.full_name == "org/repo"
+
+
+def test_tags_have_no_branch():
+    # WHEN, THEN
+    assert PushEvent({"ref": "refs/tags/v1"}).branch is None
+    assert PushEvent({}).branch is None
+
+
+@pytest.mark.parametrize(
+    "event_type, payload, expected",
+    [
+        (
+            "pull_request",
+            {
+                "action": "opened",
+                "number": 7,
+                "pull_request": {"title": "Add", "head": {"ref": "topic", "sha": "c"}, "user": SENDER},
+            },
+            {"action": "opened", "number": 7, "title": "Add", "head_ref": "topic", "head_sha": "c", "base_ref": None},
+        ),
+        ("issues", {"action": "closed", "issue": {"number": 3, "state": "closed"}}, {"number": 3, "state": "closed"}),
+        (
+            "workflow_run",
+            {"action": "completed", "workflow_run": {"id": 9, "name": "CI", "conclusion": "success"}},
+            {"id": 9, "name": "CI", "conclusion": "success", "status": None},
+        ),
+        ("ping", {"zen": "Keep it simple"}, {"action": None, "repository": None, "sender": None}),
+    ],
+)
+def test_typed_events(event_type, payload, expected):
+    # WHEN
+    event = typed_event(event_type, payload)
+
+    # THEN
+    assert dict((name, getattr(event, name)) for name in expected) == expected
+
+
+def test_nested_records():
+    # WHEN
+    event = PullRequestEvent({"pull_request": {"user": SENDER}})
+    issue = IssuesEvent({"issue": {"user": None}})
+
+    # THEN
+    assert isinstance(event.author, User) and event.author.login == "octocat"
+    assert issue.author is None
+
+
+def test_events_read_lazy_payloads_field_by_field():
+    # GIVEN
+    body = json.dumps({"action": "requested", "workflow_run": {"id": 9}, "repository": REPOSITORY}).encode("utf-8")
+    decode = mock.Mock(side_effect=json.loads)
+
+    # WHEN
+    event = WorkflowRunEvent(LazyPayload(body, decode))
+
+    # THEN
+    assert (event.action, event.id, event.repository.full_name) == ("requested", 9, "org/repo")
+    assert event.payload["workflow_run"] == {"id": 9}
+    assert isinstance(event.payload, LazyPayload)
+
+
+def test_repr():
+    # GIVEN
+    class Commit(Record):
+        FIELDS = (("sha", "id"), ("author", ("author", User)))
+        __slots__ = ("sha", "author")
+
+    # WHEN, THEN
+    assert repr(Commit({"id": "abc"})) == "Commit(sha='abc', author=None)"
+    assert repr(Repository({"id": 1})).startswith("Repository(id=1, full_name=None")
+
+
+def test_typed_hooks():
+    # GIVEN
+    core = WebhookCore()
+    pushes, pings, custom = mock.Mock(), mock.Mock(), mock.Mock()
+    core.hook("push", typed=True)(pushes)
+    core.hook("ping", typed=True)(pings)
+    core.hook("push", typed=Event)(custom)
+    headers = {"X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+    # WHEN
+    core.handle(dict(headers, **{"X-Github-Event": "push"}), b'{"ref": "refs/heads/main"}')
+    core.handle(dict(headers, **{"X-Github-Event": "ping"}), b'{"zen": "Design for failure"}')
+
+    # THEN
+    assert pushes.call_args[0][0].branch == "main"
+    assert type(pings.call_args[0][0]) is Event
+    assert type(custom.call_args[0][0]) is Event
+
+
+def test_typed_hooks_cannot_read_fields():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        WebhookCore().hook("push", fields=["ref"], typed=True)
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,281 @@
+"""Tests for github_webhook.forward"""
+
+import collections
+import errno
+import socket
+import threading
+
+import pytest
+from six.moves import BaseHTTPServer, socketserver
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore
+from github_webhook.forward import ForwardHook, ForwardingError
+
+HEADERS = {
+    "X-Github-Event": "push",
+    "X-Github-Delivery": "72d3162e",
+    "content-type": "application/json",
+    "X-Hub-Signature-256": "sha256=0",
+    "Authorization": "Bearer secret",
+}
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests.append((self.path, dict((k.lower(), v) for k, v in self.headers.items()), body))
+        self.server.ports.add(self.client_address[1])
+        status = self.server.statuses.popleft() if self.server.statuses else 204
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        if self.path.endswith("/close"):
+            self.send_header("Connection", "close")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(path):
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.requests, server.ports, server.statuses = [], set(), collections.deque()
+    server.url = "http://127.0.0.1:{0}{1}".format(server.server_port, path)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01})
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+@pytest.fixture
+def server():
+    server = _serve("/github?source=edge")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def other_server():
+    server = _serve("/")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _closed_port():
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def test_deliveries_are_relayed_to_every_target(server, other_server):
+    # GIVEN
+    core = WebhookCore()
+    forwarder = ForwardHook([server.url, other_server.url])
+    core.hook("push")(forwarder)
+
+    # WHEN
+    result = core.handle(HEADERS, b'{"ref": "refs/heads/main"}', tenant="acme")
+    core.shutdown()
+
+    # THEN
+    assert result.status == 204
+    for target in (server, other_server):
+        [(path, headers, body)] = target.requests
+        assert body == b'{"ref": "refs/heads/main"}'
+        assert headers["x-github-delivery"] == "72d3162e"
+        assert headers["x-hub-signature-256"] == "sha256=0"
+        assert "authorization" not in headers and "x-github-webhook-tenant" not in headers
+    assert server.requests[0][0] == "/github?source=edge"
+
+
+def test_connections_are_reused(server):
+    # GIVEN
+    forwarder = ForwardHook([server.url])
+
+    # WHEN
+    for _ in range(5):
+        forwarder.forward({"content-type": "application/json"}, memoryview(b"{}"))
+    forwarder.close()
+
+    # THEN
+    assert len(server.requests) == 5
+    assert len(server.ports) == 1
+
+
+def test_idle_connections_closed_by_the_target_are_replaced(server):
+    # GIVEN
+    forwarder = ForwardHook([server.url])
+    stale = mock.Mock()
+    stale.request.side_effect = socket.error(errno.ECONNRESET, "reset")
+    forwarder.targets[0]._idle.append(stale)
+
+    # WHEN
+    forwarder.forward({}, b"{}")
+
+    # THEN
+    stale.close.assert_called_once_with()
+    assert len(server.requests) == 1
+
+
+def test_server_errors_are_retried(server):
+    # GIVEN
+    server.statuses.extend([503, 429])
+    forwarder = ForwardHook([server.url], backoff=0)
+
+    # WHEN
+    forwarder.forward({}, b"{}")
+
+    # THEN
+    assert len(server.requests) == 3
+
+
+@pytest.mark.parametrize("statuses, requests, reason", [([400], 1, "status 400"), ([500, 500], 2, "status 500")])
+def test_failures_are_raised_once_every_target_was_tried(server, other_server, statuses, requests, reason, caplog):
+    # GIVEN
+    server.statuses.extend(statuses)
+    forwarder = ForwardHook([server.url, other_server.url], retries=1, backoff=0)
+
+    # WHEN
+    with pytest.raises(ForwardingError) as error:
+        forwarder.forward({}, b"{}")
+
+    # THEN
+    assert error.value.failures == {server.url: reason}
+    assert len(server.requests) == requests
+    assert len(other_server.requests) == 1
+    assert "Forwarding to {0} failed after {1} attempts".format(server.url, requests) in caplog.text
+
+
+def test_unreachable_targets():
+    # GIVEN
+    url = "http://127.0.0.1:{0}/".format(_closed_port())
+    forwarder = ForwardHook([url], retries=1, backoff=0, timeout=1)
+
+    # WHEN
+    with pytest.raises(ForwardingError) as error:
+        forwarder.forward({}, b"{}")
+
+    # THEN
+    assert list(error.value.failures) == [url]
+
+
+@mock.patch("github_webhook.forward._clock")
+def test_circuit_opens_after_repeated_failures(clock, server, caplog):
+    # GIVEN
+    clock.return_value = 100.0
+    server.statuses.extend([500, 500, 500])
+    forwarder = ForwardHook([server.url], retries=0, failure_threshold=2, reset_timeout=30)
+    reasons = []
+
+    # WHEN
+    for now in [100.0, 101.0, 102.0, 131.0, 132.0, 170.0, 171.0]:
+        clock.return_value = now
+        try:
+            forwarder.forward({}, b"{}")
+            reasons.append(None)
+        except ForwardingError as e:
+            reasons.append(e.failures[server.url])
+
+    # THEN
+    assert reasons == ["status 500", "status 500", "circuit open", "status 500", "circuit open", None, None]
+    assert len(server.requests) == 5
+    assert caplog.text.count("Opened the circuit to") == 1
+
+
+def test_forward_hooks_need_the_raw_delivery():
+    # WHEN, THEN
+    with pytest.raises(TypeError):
+        ForwardHook(["http://localhost/"])({})
+
+
+@pytest.mark.parametrize(
+    "targets", [[], ["ftp://localhost/"], [{"timeout": 1}], [{"url": "http://localhost/", "failure_threshold": 1}]]
+)
+def test_invalid_targets(targets):
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        ForwardHook(targets)
+
+
+def test_https_targets():
+    # WHEN
+    forwarder = ForwardHook(["https://localhost/"])
+
+    # THEN
+    assert forwarder.targets[0]._path == "/"
+
+
+def test_connections_the_target_closes_are_not_pooled(server):
+    # GIVEN
+    forwarder = ForwardHook(["http://127.0.0.1:{0}/close".format(server.server_port)])
+
+    # WHEN
+    forwarder.forward({}, b"{}")
+    forwarder.forward({}, b"{}")
+
+    # THEN
+    assert len(server.ports) == 2
+    assert not forwarder.targets[0]._idle
+
+
+def test_targets_may_override_the_settings_of_the_hook(server, other_server):
+    # GIVEN
+    server.statuses.extend([500, 500, 500])
+    other_server.statuses.extend([500, 500, 500])
+    forwarder = ForwardHook(
+        [{"url": server.url, "retries": 2, "timeout": 1, "max_connections": 1}, other_server.url], retries=0, backoff=0
+    )
+
+    # WHEN
+    with pytest.raises(ForwardingError):
+        forwarder.forward({}, b"{}")
+
+    # THEN
+    assert len(server.requests) == 3
+    assert len(other_server.requests) == 1
+    assert [(t.timeout, t.max_connections) for t in forwarder.targets] == [(1, 1), (10, 4)]
+
+
+def test_connections_are_not_reused_after_fork(server):
+    # GIVEN
+    forwarder = ForwardHook([server.url])
+    forwarder.forward({}, b"{}")
+
+    # WHEN
+    forwarder.after_fork()  # as a child process would, which must not share the parent's sockets
+    forwarder.forward({}, b"{}")
+    forwarder.close()
+
+    # THEN
+    assert len(server.ports) == 2
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
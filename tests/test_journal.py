@@ -0,0 +1,444 @@
+"""Tests for github_webhook.journal"""
+
+import hashlib
+import hmac
+import os
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import Result, WebhookCore, WebhookError
+from github_webhook.dispatch import DispatcherClosed, PoolDispatcher, QueueFull
+from github_webhook.journal import Entry, Journal, main
+from github_webhook.workers import WORKER_ENV
+
+HEADERS = {"x-github-event": "push", "x-github-delivery": "72d3162e", "content-type": "application/json"}
+
+
+@pytest.fixture
+def directory(tmpdir):
+    yield str(tmpdir.join("journal"))
+
+
+def _segments(directory):
+    return sorted(os.listdir(directory))
+
+
+def test_pending_deliveries_are_listed(directory):
+    # GIVEN
+    journal = Journal(directory)
+    first = journal.append(dict(HEADERS, cookie="secret"), b'{"first": 1}')
+    second = journal.append(HEADERS, memoryview(bytearray(b'{"second": 2}')))
+    third = journal.append(HEADERS, b"{}")
+
+    # WHEN
+    journal.done(second)
+    journal.done(second)
+
+    # THEN
+    assert list(journal.entries()) == [Entry(first, HEADERS, b'{"first": 1}'), Entry(third, HEADERS, b"{}")]
+    assert len(journal) == 2
+
+
+def test_pending_deliveries_are_recovered(directory):
+    # GIVEN
+    journal = Journal(directory)
+    first = journal.append(HEADERS, b"1")
+    journal.done(journal.append(HEADERS, b"2"))
+    journal.close()
+
+    # WHEN
+    journal = Journal(directory)
+
+    # THEN
+    assert [entry.seq for entry in journal.entries()] == [first]
+    assert journal.append(HEADERS, b"3") == first + 2
+
+
+def test_torn_record_is_discarded(directory, caplog):
+    # GIVEN
+    journal = Journal(directory)
+    first = journal.append(HEADERS, b"1")
+    journal.append(HEADERS, b"2")
+    journal.close()
+    path = os.path.join(directory, _segments(directory)[-1])
+    size = os.path.getsize(path)
+    with open(path, "r+b") as handle:
+        handle.truncate(size - 1)
+
+    # WHEN
+    journal = Journal(directory)
+
+    # THEN
+    assert [entry.seq for entry in journal.entries()] == [first]
+    assert "Discarding" in caplog.text
+
+
+def test_read_only_journals_leave_the_directory_untouched(directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=100)
+    first = journal.append(HEADERS, b"1")
+    journal.done(first)
+    second = journal.append(HEADERS, b"2")
+    journal.append(HEADERS, b"3")  # as if still being written
+    journal.sync()
+    path = os.path.join(directory, _segments(directory)[-1])
+    with open(path, "r+b") as handle:
+        handle.truncate(os.path.getsize(path) - 1)
+    before = dict((name, os.path.getsize(os.path.join(directory, name))) for name in _segments(directory))
+
+    # WHEN
+    reader = Journal(directory, read_only=True)
+    seqs = [entry.seq for entry in reader.entries()]
+    reader.sync()
+    reader.close()
+
+    # THEN
+    assert seqs == [second]
+    assert dict((name, os.path.getsize(os.path.join(directory, name))) for name in _segments(directory)) == before
+    with pytest.raises(ValueError):
+        reader.append(HEADERS, b"4")
+    with pytest.raises(ValueError):
+        reader.done(second)
+    journal.close()
+
+
+def test_read_only_journals_may_not_exist_yet(directory):
+    # WHEN
+    journal = Journal(os.path.join(directory, "missing"), read_only=True)
+
+    # THEN
+    assert list(journal.entries()) == []
+    assert not os.path.exists(os.path.join(directory, "missing"))
+
+
+def test_journals_are_read_only_in_worker_processes(directory, monkeypatch):
+    # GIVEN
+    Journal(directory).close()
+    monkeypatch.setenv(WORKER_ENV, "1")
+
+    # WHEN
+    journal = Journal(directory)
+
+    # THEN
+    assert journal.read_only
+    assert _segments(directory) == ["000000000001.journal"]
+
+
+def test_corrupt_record_is_discarded(directory):
+    # GIVEN
+    journal = Journal(directory)
+    journal.append(HEADERS, b"1")
+    journal.close()
+    path = os.path.join(directory, _segments(directory)[-1])
+    with open(path, "r+b") as handle:
+        handle.seek(-1, os.SEEK_END)
+        handle.write(b"2")
+
+    # WHEN
+    journal = Journal(directory)
+
+    # THEN
+    assert list(journal.entries()) == []
+
+
+def test_segments_are_rotated_and_deleted_once_done(directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=256)
+    seqs = [journal.append(HEADERS, b"x" * 100) for _ in range(4)]
+    assert len(_segments(directory)) == 4
+
+    # WHEN
+    for seq in seqs[:3]:
+        journal.done(seq)
+
+    # THEN
+    assert len(_segments(directory)) == 1
+    assert [entry.seq for entry in journal.entries()] == seqs[3:]
+
+
+def test_done_segments_are_deleted_on_rotation_and_recovery(directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=256)
+    journal.done(journal.append(HEADERS, b"x" * 100))
+
+    # WHEN
+    journal.append(HEADERS, b"x" * 100)
+    journal.close()
+    Journal(directory).close()
+
+    # THEN
+    assert len(_segments(directory)) == 2
+
+
+def test_entries_skip_segments_deleted_while_listing(directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=256)
+    seqs = [journal.append(HEADERS, b"x" * 100) for _ in range(3)]
+    entries = journal.entries()
+    assert next(entries).seq == seqs[0]
+
+    # WHEN
+    journal.done(seqs[0])
+    journal.done(seqs[1])
+
+    # THEN
+    assert [entry.seq for entry in entries] == seqs[2:]
+
+
+def test_done_marks_outlive_the_segment_they_are_in(directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=400)
+    first, second = journal.append(HEADERS, b"x" * 50), journal.append(HEADERS, b"x" * 50)
+    third = journal.append(HEADERS, b"x" * 100)
+    journal.done(first)
+    journal.done(third)
+
+    # WHEN
+    fourth = journal.append(HEADERS, b"x" * 200)
+    journal.close()
+    journal = Journal(directory)
+
+    # THEN
+    assert [entry.seq for entry in journal.entries()] == [second, fourth]
+    journal.done(second)
+    assert len(_segments(directory)) == 2
+
+
+def test_gaps_between_segments_are_skipped(directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=256)
+    seqs = [journal.append(HEADERS, b"x" * 200) for _ in range(3)]
+    journal.close()
+    os.remove(os.path.join(directory, _segments(directory)[1]))
+    journal = Journal(directory)
+
+    # WHEN
+    journal.done(seqs[0])
+
+    # THEN
+    assert [entry.seq for entry in journal.entries()] == seqs[2:]
+    assert len(_segments(directory)) == 2
+
+
+@mock.patch("github_webhook.journal.os.fsync")
+def test_concurrent_appends_share_fsyncs(mock_fsync, directory):
+    # GIVEN
+    journal = Journal(directory)
+    mock_fsync.reset_mock()
+    started = threading.Event()
+    mock_fsync.side_effect = lambda fd: started.wait(0.05)
+
+    # WHEN
+    threads = [threading.Thread(target=journal.append, args=(HEADERS, b"{}")) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # THEN
+    assert len(journal) == 8
+    assert 1 <= mock_fsync.call_count < 8
+
+
+@mock.patch("github_webhook.journal.os.fsync")
+def test_fsync_can_be_disabled(mock_fsync, directory):
+    # GIVEN
+    journal = Journal(directory, segment_size=64, fsync=False)
+
+    # WHEN
+    journal.append(HEADERS, b"x" * 100)
+    journal.append(HEADERS, b"x" * 100)
+    journal.sync()
+    journal.close()
+
+    # THEN
+    mock_fsync.assert_not_called()
+
+
+def test_sync_writes_done_marks(directory):
+    # GIVEN
+    journal = Journal(directory)
+    journal.done(journal.append(HEADERS, b"{}"))
+
+    # WHEN
+    journal.sync()
+
+    # THEN
+    assert list(Journal(directory).entries()) == []
+
+
+def test_core_journals_deliveries_until_hooks_succeed(directory):
+    # GIVEN
+    journal = Journal(directory)
+    core = WebhookCore(journal=journal)
+    handler = mock.Mock(side_effect=[RuntimeError("boom"), None, None])
+    core.hook()(handler)
+
+    # WHEN
+    with pytest.raises(RuntimeError):
+        core.handle(HEADERS, b'{"key": "value"}')
+    core.handle(dict(HEADERS, **{"x-github-delivery": "other"}), b"{}")
+
+    # THEN
+    assert list(journal.entries()) == [Entry(1, HEADERS, b'{"key": "value"}')]
+    assert core.replay() == 1
+    assert handler.call_args == mock.call({"key": "value"})
+    assert len(journal) == 0
+
+
+def test_core_does_not_journal_deliveries_without_hooks(directory):
+    # GIVEN
+    journal = Journal(directory)
+    core = WebhookCore(journal=journal)
+
+    # WHEN
+    core.handle(HEADERS, b"{}")
+
+    # THEN
+    assert journal.append(HEADERS, b"{}") == 1
+
+
+def test_core_drops_refused_deliveries_from_the_journal(directory):
+    # GIVEN
+    dispatcher = mock.Mock(asynchronous=True)
+    dispatcher.dispatch.side_effect = QueueFull("Too many pending deliveries")
+    journal = Journal(directory)
+    core = WebhookCore(dispatcher=dispatcher, journal=journal)
+    core.hook()(mock.Mock())
+
+    # WHEN
+    with pytest.raises(WebhookError):
+        core.handle(HEADERS, b"{}")
+
+    # THEN
+    assert len(journal) == 0
+
+
+def test_asynchronous_deliveries_are_done_once_hooks_complete(directory):
+    # GIVEN
+    journal = Journal(directory)
+    core = WebhookCore(dispatcher=PoolDispatcher(), journal=journal)
+    core.hook()(mock.Mock())
+
+    # WHEN
+    assert core.handle(HEADERS, b"{}") == Result(202, "")
+    core.shutdown()
+
+    # THEN
+    assert len(journal) == 0
+
+
+def test_replay_verifies_deliveries_again(directory, caplog):
+    # GIVEN
+    journal = Journal(directory)
+    body = b"{}"
+    signature = "sha256=" + hmac.new(b"old", body, hashlib.sha256).hexdigest()
+    journal.append(dict(HEADERS, **{"x-hub-signature-256": signature}), body)
+    core = WebhookCore(secret="new")
+    handler = mock.Mock()
+    core.hook()(handler)
+
+    # WHEN
+    count = core.replay(journal)
+
+    # THEN
+    assert count == 0
+    handler.assert_not_called()
+    assert "Dropping delivery 1 from the journal: Invalid signature" in caplog.text
+    assert len(journal) == 0
+
+
+@mock.patch("github_webhook.core.time.sleep")
+def test_replay_waits_for_a_full_dispatcher(mock_sleep, directory):
+    # GIVEN
+    journal = Journal(directory)
+    journal.append(HEADERS, b"{}")
+    dispatcher = mock.Mock(asynchronous=True)
+    dispatcher.dispatch.side_effect = [QueueFull("full"), None]
+    core = WebhookCore(dispatcher=dispatcher)
+    core.hook()(mock.Mock())
+
+    # WHEN
+    count = core.replay(journal)
+
+    # THEN
+    assert count == 1
+    assert dispatcher.dispatch.call_count == 2
+    mock_sleep.assert_called_once_with(0.01)
+
+
+def test_replay_stops_once_dispatcher_is_closed(directory):
+    # GIVEN
+    journal = Journal(directory)
+    journal.append(HEADERS, b"{}")
+    core = WebhookCore(dispatcher=PoolDispatcher(), journal=journal)
+    core.hook()(mock.Mock())
+    core.shutdown()
+
+    # WHEN, THEN
+    with pytest.raises(DispatcherClosed):
+        core.replay()
+    assert len(journal) == 1
+
+
+def test_replay_logs_failing_hooks(directory, caplog):
+    # GIVEN
+    journal = Journal(directory)
+    journal.append(HEADERS, b"{}")
+    core = WebhookCore(journal=journal)
+    core.hook()(mock.Mock(side_effect=RuntimeError("boom")))
+
+    # WHEN
+    count = core.replay()
+
+    # THEN
+    assert count == 1
+    assert "Hook raised an exception replaying delivery 1" in caplog.text
+    assert len(journal) == 1
+
+
+webhook = WebhookCore()
+webhook_handler = mock.Mock()
+webhook.hook()(webhook_handler)
+
+
+def test_cli(directory, capsys):
+    # GIVEN
+    journal = Journal(directory)
+    journal.append(HEADERS, b'{"key": "value"}')
+    journal.close()
+
+    # WHEN
+    assert main(["list", directory]) == 0
+    assert main(["replay", directory, "tests.test_journal:webhook"]) == 0
+    with pytest.raises(SystemExit):
+        main([])
+
+    # THEN
+    out = capsys.readouterr().out.splitlines()
+    assert out[:2] == ["1 72d3162e push 16", "Replayed 1 deliveries, 0 still pending"]
+    webhook_handler.assert_called_once_with({"key": "value"})
+    assert list(Journal(directory).entries()) == []
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
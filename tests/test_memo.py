@@ -0,0 +1,155 @@
+"""Tests for github_webhook.memo"""
+
+import json
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore
+from github_webhook.memo import MemoizedHook
+from github_webhook.metrics import PrometheusMetrics
+from github_webhook.payload import LazyPayload
+
+HEADERS = {"X-Github-Event": "check_run", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+
+def _payload(sha, n=0):
+    return {"check_run": {"head_sha": sha}, "n": n}
+
+
+def test_results_are_cached_by_key():
+    # GIVEN
+    func = mock.Mock(side_effect=lambda data: data["n"])
+    memoized = MemoizedHook(func, "check_run.head_sha")
+
+    # WHEN
+    results = [memoized(_payload("abc", 1)), memoized(_payload("abc", 2)), memoized(_payload("def", 3))]
+
+    # THEN
+    assert results == [1, 1, 3]
+    assert func.call_count == 2
+    assert (memoized.hits, memoized.misses) == (1, 2)
+
+
+@pytest.mark.parametrize(
+    "key, data",
+    [
+        (["repository.full_name", "check_run.head_sha"], {"repository": {"full_name": "a/b"}, "check_run": {}}),
+        (lambda data: None, {}),
+    ],
+)
+def test_payloads_lacking_the_key_are_not_cached(key, data):
+    # GIVEN
+    func = mock.Mock()
+    memoized = MemoizedHook(func, key)
+
+    # WHEN
+    memoized(data)
+    memoized(data)
+
+    # THEN
+    assert func.call_count == 2
+    assert len(memoized.cache) == 0
+
+
+def test_lazy_payloads_and_key_functions():
+    # GIVEN
+    func = mock.Mock(return_value="result")
+    memoized = MemoizedHook(func, lambda data: data.lookup(("id",)), max_size=1)
+
+    # WHEN
+    results = [memoized(LazyPayload(body, json.loads)) for body in [b'{"id": 1}', b'{"id": 2}', b'{"id": 1}']]
+
+    # THEN
+    assert results == ["result"] * 3
+    assert func.call_count == 3
+
+
+def test_exceptions_are_not_cached():
+    # GIVEN
+    func = mock.Mock(side_effect=[RuntimeError("boom"), "result"])
+    memoized = MemoizedHook(func, "check_run.head_sha")
+
+    # WHEN
+    with pytest.raises(RuntimeError):
+        memoized(_payload("abc"))
+    result = memoized(_payload("abc"))
+
+    # THEN
+    assert result == "result"
+    assert memoized.misses == 2
+
+
+def test_concurrent_calls_for_a_key_wait_for_the_first():
+    # GIVEN
+    started, release = threading.Event(), threading.Event()
+
+    def slow(data):
+        started.set()
+        release.wait(5)
+        return data["n"]
+
+    memoized = MemoizedHook(slow, "check_run.head_sha")
+    results = []
+    first = threading.Thread(target=lambda: results.append(memoized(_payload("abc", 1))))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(memoized(_payload("abc", 2))))
+    second.start()
+
+    # WHEN
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    # THEN
+    assert results == [1, 1]
+    assert (memoized.hits, memoized.misses) == (1, 1)
+
+
+def test_memoized_hooks_run_once_per_key_and_report_metrics():
+    # GIVEN
+    metrics = PrometheusMetrics()
+    core = WebhookCore(metrics=metrics)
+    handler = mock.Mock(__name__="handler")
+
+    @core.memoize("check_run.head_sha", ttl=300)
+    def head_files(data):
+        return ["README.md"]
+
+    @core.hook("check_run")
+    @core.memoize("check_run.head_sha")
+    def on_check_run(data):
+        handler(head_files(data))
+
+    # WHEN
+    for n in range(3):
+        core.handle(HEADERS, b'{"check_run": {"head_sha": "abc"}, "n": %d}' % n)
+
+    # THEN
+    handler.assert_called_once_with(["README.md"])
+    rendered = metrics.render()
+    assert '.on_check_run",result="hit"} 2' in rendered
+    assert '.head_files",result="miss"} 1' in rendered
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,252 @@
+"""Tests for github_webhook.metrics"""
+
+import pytest
+from flask import Flask
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore, WebhookError
+from github_webhook.dispatch import PoolDispatcher
+from github_webhook.metrics import UNTIMED, MetricsSink, PrometheusMetrics, TimedHook, Timer, hook_name
+from github_webhook.webhook import Webhook
+
+HEADERS = {"X-Github-Event": "push", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+
+def on_push(data):
+    pass
+
+
+@pytest.fixture
+def sink():
+    yield PrometheusMetrics(buckets={"latency_seconds": (0.1, 1), "size_bytes": (10,)})
+
+
+def test_counters_are_rendered(sink):
+    # GIVEN
+    sink.increment("requests_total", {"event": "push"})
+    sink.increment("requests_total", {"event": "push"}, value=2)
+    sink.increment("requests_total", {"event": 'say "hi"\n\\'})
+    sink.increment("github_webhook_responses_total", {})
+
+    # WHEN
+    text = sink.render()
+
+    # THEN
+    assert text == (
+        "# HELP github_webhook_responses_total Responses sent, by status code\n"
+        "# TYPE github_webhook_responses_total counter\n"
+        "github_webhook_responses_total 1\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{event="push"} 3\n'
+        'requests_total{event="say \\"hi\\"\\n\\\\"} 1\n'
+    )
+
+
+def test_histograms_are_rendered(sink):
+    # GIVEN
+    for value in [0.05, 0.5, 0.5, 2.0]:
+        sink.observe("latency_seconds", value, {"stage": "parse"})
+    sink.observe("size_bytes", 4, {})
+
+    # WHEN
+    text = sink.render()
+
+    # THEN
+    assert text == (
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{stage="parse",le="0.1"} 1\n'
+        'latency_seconds_bucket{stage="parse",le="1"} 3\n'
+        'latency_seconds_bucket{stage="parse",le="+Inf"} 4\n'
+        'latency_seconds_sum{stage="parse"} 3.05\n'
+        'latency_seconds_count{stage="parse"} 4\n'
+        "# TYPE size_bytes histogram\n"
+        'size_bytes_bucket{le="10"} 1\n'
+        'size_bytes_bucket{le="+Inf"} 1\n'
+        "size_bytes_sum 4\n"
+        "size_bytes_count 1\n"
+    )
+
+
+def test_default_buckets():
+    # GIVEN
+    sink = PrometheusMetrics()
+
+    # WHEN
+    sink.observe("github_webhook_payload_bytes", 2048, {})
+    sink.observe("github_webhook_hook_seconds", 0.002, {})
+
+    # THEN
+    text = sink.render()
+    assert 'github_webhook_payload_bytes_bucket{le="4096"} 1' in text
+    assert 'github_webhook_hook_seconds_bucket{le="0.0025"} 1' in text
+
+
+@mock.patch("github_webhook.metrics._clock", side_effect=[1.0, 1.5])
+def test_timer(_, sink):
+    # WHEN
+    with Timer(sink, "latency_seconds", {"stage": "parse"}):
+        pass
+
+    # THEN
+    assert 'latency_seconds_sum{stage="parse"} 0.5' in sink.render()
+
+
+def test_untimed_does_nothing():
+    # WHEN, THEN
+    with UNTIMED as timer:
+        assert timer is UNTIMED
+
+
+def test_timed_hook_counts_errors():
+    # GIVEN
+    sink = mock.Mock(spec=MetricsSink)
+    hook = TimedHook(mock.Mock(side_effect=[None, RuntimeError("boom")]), sink, "hook")
+
+    # WHEN
+    hook({})
+    with pytest.raises(RuntimeError):
+        hook({})
+
+    # THEN
+    assert sink.observe.call_count == 2
+    sink.increment.assert_called_once_with("github_webhook_hook_errors_total", {"hook": "hook"})
+
+
+def test_hook_name():
+    # GIVEN
+    wrapper = mock.Mock(__wrapped__=on_push)
+
+    # WHEN, THEN
+    assert hook_name(on_push) == "tests.test_metrics.on_push"
+    assert hook_name(wrapper) == "tests.test_metrics.on_push"
+    assert hook_name(mock.Mock(__wrapped__=1)) == "1"
+    assert hook_name(mock.Mock(__wrapped__=mock.Mock(__name__="name", __module__=None))) == "name"
+
+
+def test_interface_is_abstract():
+    # GIVEN
+    sink = MetricsSink()
+
+    # WHEN, THEN
+    with pytest.raises(NotImplementedError):
+        sink.increment("name", {})
+    with pytest.raises(NotImplementedError):
+        sink.observe("name", 1, {})
+
+
+def test_core_records_deliveries_stages_and_hooks():
+    # GIVEN
+    sink = mock.Mock(spec=MetricsSink)
+    core = WebhookCore(secret="secret", metrics=sink)
+    core.hook()(on_push)
+    core._verifier = mock.Mock()
+
+    # WHEN
+    core.handle(HEADERS, b"{}")
+
+    # THEN
+    sink.increment.assert_called_once_with("github_webhook_deliveries_total", {"event": "push"})
+    observed = [(c[0][0], c[0][2]) for c in sink.observe.call_args_list]
+    assert observed == [
+        ("github_webhook_stage_seconds", {"stage": "body"}),
+        ("github_webhook_stage_seconds", {"stage": "verify"}),
+        ("github_webhook_payload_bytes", {"event": "push"}),
+        ("github_webhook_stage_seconds", {"stage": "parse"}),
+        ("github_webhook_hook_seconds", {"hook": "tests.test_metrics.on_push"}),
+    ]
+
+
+def test_core_does_not_time_hooks_on_process_pools():
+    # GIVEN
+    core = WebhookCore(dispatcher=PoolDispatcher(executor="process", max_workers=1), metrics=PrometheusMetrics())
+
+    # WHEN, THEN
+    assert core._synchronous_hooks([on_push]) == [on_push]
+    core.shutdown()
+
+
+def test_flask_metrics_endpoint():
+    # GIVEN
+    app = Flask(__name__)
+    webhook = Webhook(app, metrics=PrometheusMetrics(), metrics_endpoint="/metrics")
+    webhook.hook()(on_push)
+    client = app.test_client()
+    client.post("/postreceive", data=b"{}", headers=HEADERS)
+    client.post("/postreceive", data=b"{}", headers=dict(HEADERS, **{"content-type": "text/plain"}))
+
+    # WHEN
+    response = client.get("/metrics")
+
+    # THEN
+    assert response.status_code == 200
+    assert response.content_type == PrometheusMetrics.content_type
+    text = response.get_data(as_text=True)
+    assert 'github_webhook_responses_total{status="204"} 1' in text
+    assert 'github_webhook_responses_total{status="400"} 1' in text
+    assert 'github_webhook_deliveries_total{event="push"} 2' in text
+
+
+def test_flask_counts_failing_hooks():
+    # GIVEN
+    app = Flask(__name__)
+    webhook = Webhook(app, metrics=PrometheusMetrics())
+    webhook.hook()(mock.Mock(side_effect=RuntimeError("boom"), __name__="broken"))
+
+    # WHEN
+    response = app.test_client().post("/postreceive", data=b"{}", headers=HEADERS)
+
+    # THEN
+    assert response.status_code == 500
+    text = webhook.metrics.render()
+    assert 'github_webhook_responses_total{status="500"} 1' in text
+    assert "github_webhook_hook_errors_total" in text
+
+
+@pytest.mark.parametrize("metrics", [None, mock.Mock(spec=MetricsSink)])
+def test_metrics_endpoint_requires_renderable_sink(metrics):
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        Webhook(Flask(__name__), metrics=metrics, metrics_endpoint="/metrics")
+
+
+def test_disabled_metrics_do_not_wrap_hooks():
+    # GIVEN
+    core = WebhookCore()
+
+    # WHEN, THEN
+    assert core._synchronous_hooks([on_push]) == [on_push]
+    assert core._timer("parse") is UNTIMED
+    core._count_response(204)
+
+
+def test_refused_delivery_is_still_counted():
+    # GIVEN
+    core = WebhookCore(metrics=PrometheusMetrics())
+
+    # WHEN
+    with pytest.raises(WebhookError):
+        core.handle(HEADERS, b"not json")
+
+    # THEN
+    assert 'github_webhook_deliveries_total{event="push"} 1' in core.metrics.render()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
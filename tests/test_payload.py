@@ -0,0 +1,177 @@
+"""Tests for github_webhook.payload"""
+
+import json
+import pickle
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook import payload as payload_module
+from github_webhook.decoders import get_decoder
+from github_webhook.payload import FieldsHook, LazyPayload, extract
+
+DATA = {
+    "action": "opened",
+    "number": 7,
+    "repository": {"full_name": "bloomberg/python-github-webhook", "owner": {"login": "bloomberg"}},
+    "labels": [{"name": "bug"}, {"name": "docs"}],
+    "sender": {"login": "octocat/~1"},
+}
+BODY = json.dumps(DATA).encode("utf-8")
+
+
+@pytest.fixture(params=["simdjson", "decoder"])
+def backend(request):
+    if request.param == "simdjson":
+        pytest.importorskip("simdjson")
+        yield request.param
+    else:
+        with mock.patch.object(payload_module, "simdjson", None):
+            yield request.param
+
+
+@pytest.fixture
+def decode():
+    yield mock.Mock(side_effect=get_decoder("json"))
+
+
+def test_reads_like_a_dict(backend, decode):
+    # GIVEN
+    payload = LazyPayload(memoryview(bytearray(BODY)), decode)
+
+    # WHEN, THEN
+    assert payload["repository"]["full_name"] == "bloomberg/python-github-webhook"
+    assert payload.get("missing") is None
+    assert "action" in payload and "missing" not in payload
+    assert len(payload) == len(DATA)
+    assert sorted(payload) == sorted(DATA)
+    assert payload == DATA
+    assert repr(payload) == "<LazyPayload of {0} bytes>".format(len(BODY))
+
+
+def test_nothing_is_decoded_until_read(backend, decode):
+    # GIVEN
+    payload = LazyPayload(BODY, decode)
+
+    # WHEN, THEN
+    decode.assert_not_called()
+    assert payload["action"] == "opened"
+    assert payload["action"] == "opened"
+    assert decode.call_count == (0 if backend == "simdjson" else 1)
+
+
+def test_top_level_must_be_an_object(backend, decode):
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        LazyPayload(b"[1, 2]", decode)["action"]
+
+
+def test_pickles_as_raw_bytes(backend):
+    # GIVEN
+    payload = LazyPayload(memoryview(bytearray(BODY)), get_decoder("json"))
+
+    # WHEN
+    restored = pickle.loads(pickle.dumps(payload))
+
+    # THEN
+    assert isinstance(restored, LazyPayload)
+    assert restored == DATA
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_extract(backend, decode, lazy):
+    # GIVEN
+    data = LazyPayload(BODY, decode) if lazy else DATA
+
+    # WHEN
+    fields = extract(data, ["action", "repository.owner.login", "labels.1.name", "sender.login", "missing.field"])
+
+    # THEN
+    assert fields == {
+        "action": "opened",
+        "repository": {"owner": {"login": "bloomberg"}},
+        "labels": [{"name": "docs"}],
+        "sender": {"login": "octocat/~1"},
+    }
+
+
+@pytest.mark.parametrize("lazy", [True, False])
+def test_extract_keeps_lists_and_digit_keys(backend, decode, lazy):
+    # GIVEN
+    document = {
+        "commits": [{"id": "c0", "message": "First"}, {"id": "c1"}, {"id": "c2", "message": "Third"}],
+        "stats": {"0": "zero", "10": {"1": "one"}},
+    }
+    data = LazyPayload(json.dumps(document).encode("utf-8"), decode) if lazy else document
+    fields = ["commits.2.message", "commits.0.id", "commits.2.id", "stats.0", "stats.10.1", "commits.x", "stats.2"]
+
+    # WHEN
+    extracted = extract(data, fields)
+
+    # THEN
+    assert extracted == {
+        "commits": [{"id": "c0"}, {"id": "c2", "message": "Third"}],
+        "stats": {"0": "zero", "10": {"1": "one"}},
+    }
+
+
+def test_lookup_takes_keys_and_list_indices(backend, decode):
+    # GIVEN
+    payload = LazyPayload(BODY, decode)
+
+    # WHEN, THEN
+    assert payload.lookup(("labels", 1, "name")) == payload.lookup(("labels", "1", "name")) == "docs"
+    with pytest.raises(LookupError):
+        payload.lookup(("repository", "missing"))
+
+
+def test_extract_does_not_change_the_payload():
+    # GIVEN
+    data = {"repository": {"owner": {"login": "bloomberg", "id": 1}}}
+
+    # WHEN
+    extracted = extract(data, ["repository.owner", "repository.owner.login", "repository.owner.id"])
+
+    # THEN
+    assert extracted == data
+    assert data == {"repository": {"owner": {"login": "bloomberg", "id": 1}}}
+
+
+def test_extract_skips_paths_through_scalars(backend, decode):
+    # WHEN, THEN
+    assert extract(LazyPayload(BODY, decode), ["number.value", "labels.name"]) == {}
+
+
+def test_fields_hook():
+    # GIVEN
+    hook = mock.Mock(__name__="on_pull_request")
+    wrapped = FieldsHook(hook, ["action", "repository.full_name"])
+
+    # WHEN
+    wrapped(DATA)
+
+    # THEN
+    assert wrapped.__name__ == "on_pull_request"
+    assert wrapped.__wrapped__ is hook
+    hook.assert_called_once_with({"action": "opened", "repository": {"full_name": "bloomberg/python-github-webhook"}})
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,288 @@
+"""Tests for github_webhook.recording"""
+
+import gzip
+import hashlib
+import hmac
+import os
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import DUPLICATE, Result, WebhookCore, WebhookError
+from github_webhook.dedup import MemoryDeliveryStore
+from github_webhook.forward import ForwardHook
+from github_webhook.metrics import hook_name
+from github_webhook.recording import Recorded, Recorder, _replay_part, main, read_recording, replay_recording
+from github_webhook.workers import WORKER_ENV
+
+HEADERS = {"x-github-event": "push", "x-github-delivery": "72d3162e", "content-type": "application/json"}
+
+
+@pytest.fixture
+def path(tmpdir):
+    yield str(tmpdir.join("deliveries.gz"))
+
+
+def _record(path, *deliveries):
+    recorder = Recorder(path)
+    for headers, body in deliveries:
+        recorder.record(headers, body)
+    recorder.close()
+
+
+def test_deliveries_are_recorded_and_read_back(path):
+    # GIVEN
+    _record(path, (dict(HEADERS, cookie="secret"), b'{"first": 1}'))
+    recorder = Recorder(path, compresslevel=1)
+
+    # WHEN
+    with mock.patch("github_webhook.recording.time.time", return_value=1500000000.0):
+        recorder.record(HEADERS, memoryview(bytearray(b"{}")))
+    recorder.close()
+
+    # THEN
+    deliveries = list(read_recording(path))
+    assert [(d.headers, d.body) for d in deliveries] == [(HEADERS, b'{"first": 1}'), (HEADERS, b"{}")]
+    assert deliveries[1] == Recorded(1500000000.0, HEADERS, b"{}")
+
+
+@pytest.mark.parametrize("cut", [1, 10, 30])
+def test_truncated_delivery_ends_the_recording(path, cut, caplog):
+    # GIVEN
+    _record(path, (HEADERS, b"1"), (HEADERS, b"2"))
+    with gzip.open(path, "rb") as archive:
+        data = archive.read()
+    with gzip.open(path, "wb") as archive:
+        archive.write(data[:-cut])
+
+    # WHEN
+    deliveries = list(read_recording(path))
+
+    # THEN
+    assert [d.body for d in deliveries] == [b"1"]
+    assert "Discarding a truncated delivery" in caplog.text
+
+
+def test_truncated_archive_ends_the_recording(path, caplog):
+    # GIVEN
+    _record(path, (HEADERS, b"1" * 100000))
+    with open(path, "rb") as archive:
+        data = archive.read()
+    with open(path, "wb") as archive:
+        archive.write(data[: len(data) // 2])
+
+    # WHEN
+    deliveries = list(read_recording(path))
+
+    # THEN
+    assert deliveries == []
+    assert "Discarding a truncated delivery" in caplog.text
+
+
+def test_core_records_verified_deliveries_once(path):
+    # GIVEN
+    recorder = Recorder(path)
+    core = WebhookCore(secret="secret", dedup=MemoryDeliveryStore(), recorder=recorder)
+    core.hook()(mock.Mock())
+    signature = "sha256=" + hmac.new(b"secret", b"{}", hashlib.sha256).hexdigest()
+    signed = dict(HEADERS, **{"x-hub-signature-256": signature})
+
+    # WHEN
+    assert core.handle(signed, b"{}") == Result(204, "")
+    assert core.handle(signed, b"{}") == DUPLICATE
+    with pytest.raises(WebhookError):
+        core.handle(dict(signed, **{"x-github-delivery": "forged"}), b"[]")
+    recorder.close()
+
+    # THEN
+    assert [d.headers["x-github-delivery"] for d in read_recording(path)] == ["72d3162e"]
+
+
+def test_core_records_deliveries_handed_to_workers(path):
+    # GIVEN
+    recorder = Recorder(path)
+    core = WebhookCore(workers=mock.Mock(), recorder=recorder)
+
+    # WHEN
+    result = core.handle(HEADERS, b"{}", tenant="acme")
+    recorder.close()
+
+    # THEN
+    assert result == Result(202, "")
+    assert list(read_recording(path)) == [
+        Recorded(mock.ANY, dict(HEADERS, **{"x-github-webhook-tenant": "acme"}), b"{}")
+    ]
+
+
+def test_replay_runs_and_times_each_hook(path, caplog):
+    # GIVEN
+    _record(
+        path,
+        (HEADERS, b'{"key": "value"}'),
+        (dict(HEADERS, **{"x-github-webhook-tenant": "acme"}), b"{}"),
+        (dict(HEADERS, **{"content-type": "text/plain"}), b"{}"),
+    )
+    core = WebhookCore()
+    handler = mock.Mock(__name__="handler")
+    failing = mock.Mock(__name__="failing", side_effect=RuntimeError("boom"))
+    core.hook()(handler)
+    core.hook(tenant="acme")(failing)
+
+    # WHEN
+    report = replay_recording(core, path)
+
+    # THEN
+    assert report["deliveries"] == 3
+    assert report["refused"] == 1
+    assert report["seconds"] >= 0
+    assert report["hooks"] == {
+        hook_name(handler): {"calls": 2, "errors": 0, "seconds": mock.ANY},
+        hook_name(failing): {"calls": 1, "errors": 1, "seconds": mock.ANY},
+    }
+    assert handler.call_args_list == [mock.call({"key": "value"}), mock.call({})]
+    assert "Refused recorded delivery 72d3162e" in caplog.text
+    assert "Hook {0} raised an exception".format(hook_name(failing)) in caplog.text
+
+
+@mock.patch("github_webhook.recording.time.sleep")
+def test_replay_follows_the_original_timing(mock_sleep, path):
+    # GIVEN
+    recorder = Recorder(path)
+    with mock.patch("github_webhook.recording.time.time", side_effect=[100.0, 100.0, 110.0]):
+        for _ in range(3):
+            recorder.record(HEADERS, b"{}")
+    recorder.close()
+
+    # WHEN
+    report = replay_recording(webhook, path, speed=2.0)
+
+    # THEN
+    assert report["deliveries"] == 3
+    assert mock_sleep.call_count == 1
+    assert 4.0 < mock_sleep.call_args[0][0] <= 5.0
+
+
+def test_replay_is_shared_by_processes(path):
+    # GIVEN
+    _record(path, *[(HEADERS, b'{"key": "value"}')] * 5)
+
+    # WHEN
+    report = replay_recording("tests.test_recording:webhook", path, processes=2)
+
+    # THEN
+    assert report["deliveries"] == 5
+    assert report["hooks"][hook_name(webhook_handler)]["calls"] == 5
+
+
+def test_replay_part_takes_every_nth_delivery(path):
+    # GIVEN
+    _record(path, *[(HEADERS, str(i).encode("ascii")) for i in range(5)])
+    webhook_handler.reset_mock()
+
+    # WHEN
+    report = _replay_part("tests.test_recording:webhook", path, None, 1, 2)
+
+    # THEN
+    assert report["deliveries"] == 2
+    assert webhook_handler.call_args_list == [mock.call(1), mock.call(3)]
+
+
+webhook = WebhookCore()
+webhook_handler = mock.Mock(__name__="webhook_handler")
+webhook.hook()(webhook_handler)
+
+
+def test_cli(path, capsys):
+    # GIVEN
+    with mock.patch("github_webhook.recording.time.time", return_value=1500000000.0):
+        _record(path, (HEADERS, b'{"key": "value"}'))
+
+    # WHEN
+    assert main(["list", path]) == 0
+    assert main(["replay", path, "tests.test_recording:webhook"]) == 0
+    with pytest.raises(SystemExit):
+        main([])
+
+    # THEN
+    out = capsys.readouterr().out.splitlines()
+    assert out[0] == "2017-07-14T02:40:00 72d3162e push 16"
+    assert out[1].startswith("Replayed 1 deliveries in ")
+    assert out[1].endswith("s, 0 refused")
+    assert out[3].split()[:3] == [hook_name(webhook_handler), "1", "0"]
+
+
+def test_archives_are_not_opened_in_worker_processes(path, monkeypatch):
+    # GIVEN
+    monkeypatch.setenv(WORKER_ENV, "1")
+
+    # WHEN
+    recorder = Recorder(path)
+
+    # THEN
+    with pytest.raises(ValueError):
+        recorder.record(HEADERS, b"{}")
+    recorder.close()
+    assert not os.path.exists(path)
+
+
+def test_replay_runs_hooks_without_retries_and_batches_them(path):
+    # GIVEN
+    _record(path, *[(HEADERS, '{{"n": {0}}}'.format(n).encode("ascii")) for n in range(5)])
+    core = WebhookCore(retries=mock.Mock(), metrics=mock.Mock())
+    failing = mock.Mock(__name__="failing", side_effect=RuntimeError("boom"))
+    batched = mock.Mock(__name__="batched")
+    core.hook()(failing)
+    core.batch_hook(window=3600, max_size=2)(batched)
+
+    # WHEN
+    report = replay_recording(core, path)
+
+    # THEN
+    assert report["hooks"] == {
+        hook_name(failing): {"calls": 5, "errors": 5, "seconds": mock.ANY},
+        hook_name(batched): {"calls": 3, "errors": 0, "seconds": mock.ANY},
+    }
+    assert not core.retries.schedule.called
+    assert batched.call_args_list == [
+        mock.call([{"n": 0}, {"n": 1}]),
+        mock.call([{"n": 2}, {"n": 3}]),
+        mock.call([{"n": 4}]),
+    ]
+
+
+@pytest.mark.parametrize("forward", [False, True])
+def test_replay_only_forwards_when_asked_to(path, forward):
+    # GIVEN
+    _record(path, (HEADERS, b"{}"))
+    core = WebhookCore()
+    forwarder = ForwardHook(["http://localhost/"])
+    core.hook()(forwarder)
+
+    # WHEN
+    with mock.patch.object(forwarder, "forward") as mock_forward:
+        report = replay_recording(core, path, forward=forward)
+
+    # THEN
+    assert mock_forward.called is forward
+    assert len(report["hooks"]) == forward
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
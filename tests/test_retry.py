@@ -0,0 +1,361 @@
+"""Tests for github_webhook.retry"""
+
+import json
+import multiprocessing
+import os
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.batching import BatchHook
+from github_webhook.core import Result, WebhookCore
+from github_webhook.forward import ForwardHook
+from github_webhook.metrics import hook_name
+from github_webhook.payload import LazyPayload
+from github_webhook.retry import DeadLetter, DeadLetterStore, RetryingHook, RetryScheduler
+
+HEADERS = {"x-github-event": "push", "x-github-delivery": "72d3162e", "content-type": "application/json"}
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = RetryScheduler(base_delay=0.01, jitter=0)
+    yield scheduler
+    scheduler.close()
+
+
+def _calls(count, side_effects):
+    """Return a hook raising each of :code:`side_effects` in turn, and an Event set after :code:`count` calls"""
+
+    done = threading.Event()
+    calls = []
+
+    def hook(data):
+        calls.append(data)
+        if len(calls) == count:
+            done.set()
+        effect = side_effects[len(calls) - 1] if len(calls) <= len(side_effects) else None
+        if effect is not None:
+            raise effect
+
+    return hook, calls, done
+
+
+def test_delays_grow_exponentially_up_to_the_maximum():
+    # GIVEN
+    scheduler = RetryScheduler(base_delay=1, max_delay=5, jitter=0)
+
+    # WHEN
+    delays = [scheduler.delay(attempts) for attempts in range(1, 6)]
+    scheduler.close()
+
+    # THEN
+    assert delays == [1, 2, 4, 5, 5]
+
+
+@mock.patch("github_webhook.retry.random.random", return_value=0.5)
+def test_delays_are_jittered(mock_random):
+    # GIVEN
+    scheduler = RetryScheduler(base_delay=2, jitter=0.5)
+
+    # WHEN
+    delay = scheduler.delay(2)
+    scheduler.close()
+
+    # THEN
+    assert delay == 3
+
+
+@pytest.mark.parametrize("options", [{"max_attempts": 0}, {"jitter": 1.5}])
+def test_invalid_options_are_refused(options):
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        RetryScheduler(**options)
+
+
+def test_failed_invocation_is_retried_until_it_succeeds(scheduler, caplog):
+    # GIVEN
+    hook, calls, done = _calls(2, [RuntimeError("again")])
+
+    # WHEN
+    scheduler.schedule(hook, {"key": "value"}, RuntimeError("boom"), name="hook")
+
+    # THEN
+    assert done.wait(5)
+    assert calls == [{"key": "value"}] * 2
+    assert scheduler.pending == 0
+    assert len(scheduler.dead_letters) == 0
+    assert "Hook hook failed again (attempt 2): again" in caplog.text
+
+
+def test_invocation_is_dead_lettered_after_max_attempts():
+    # GIVEN
+    metrics = mock.Mock()
+    scheduler = RetryScheduler(max_attempts=3, base_delay=0, metrics=metrics)
+    hook, calls, done = _calls(2, [RuntimeError("first"), RuntimeError("last")])
+
+    # WHEN
+    scheduler.schedule(hook, {}, RuntimeError("boom"))
+    assert done.wait(5)
+    scheduler.close()
+
+    # THEN
+    assert scheduler.dead_letters.letters() == [DeadLetter("hook", {}, 3, "last", mock.ANY)]
+    outcomes = [call[0][1]["outcome"] for call in metrics.increment.call_args_list]
+    assert outcomes == ["scheduled", "scheduled", "dead"]
+
+
+def test_single_attempt_is_dead_lettered_at_once(caplog):
+    # GIVEN
+    scheduler = RetryScheduler(max_attempts=1)
+    hook = mock.Mock()
+
+    # WHEN
+    scheduler.schedule(hook, {}, RuntimeError("boom"), name="hook")
+    scheduler.close()
+
+    # THEN
+    hook.assert_not_called()
+    assert scheduler.dead_letters.letters() == [DeadLetter("hook", {}, 1, "boom", mock.ANY)]
+    assert "Giving up on hook hook after 1 attempts: boom" in caplog.text
+
+
+def test_pending_retries_are_dead_lettered_on_close():
+    # GIVEN
+    scheduler = RetryScheduler(base_delay=60)
+    hook = mock.Mock(__name__="hook")
+    scheduler.schedule(hook, {"first": 1}, RuntimeError("boom"))
+    assert scheduler.pending == 1
+
+    # WHEN
+    scheduler.close()
+    scheduler.schedule(hook, {"second": 2}, RuntimeError("boom"))
+
+    # THEN
+    hook.assert_not_called()
+    assert [(letter.data, letter.attempts) for letter in scheduler.dead_letters.letters()] == [
+        ({"first": 1}, 1),
+        ({"second": 2}, 1),
+    ]
+
+
+def test_payloads_beyond_the_memory_limit_are_spilled(tmpdir):
+    # GIVEN
+    spill = str(tmpdir.join("spill"))
+    scheduler = RetryScheduler(base_delay=60, jitter=0, max_in_memory=1, spill=spill)
+
+    # WHEN
+    for i in range(3):
+        scheduler.schedule(mock.Mock(), {"i": i}, RuntimeError("boom"), name="hook")
+
+    # THEN
+    assert len(os.listdir(spill)) == 2
+    scheduler.close()
+    assert os.listdir(spill) == []
+    assert [letter.data for letter in scheduler.dead_letters.letters()] == [{"i": 0}, {"i": 1}, {"i": 2}]
+
+
+def test_spilled_payloads_are_read_back_when_due(tmpdir):
+    # GIVEN
+    spill = str(tmpdir.join("spill"))
+    scheduler = RetryScheduler(base_delay=0, max_in_memory=0, spill=spill)
+    hook, calls, done = _calls(1, [])
+
+    # WHEN
+    scheduler.schedule(hook, LazyPayload(b'{"key": "value"}', json.loads), RuntimeError("boom"))
+    assert done.wait(5)
+    scheduler.close()
+
+    # THEN
+    assert dict(calls[0]) == {"key": "value"}
+    assert os.listdir(spill) == []
+
+
+def test_unpicklable_payloads_stay_in_memory(tmpdir, caplog):
+    # GIVEN
+    scheduler = RetryScheduler(base_delay=60, max_in_memory=0, spill=str(tmpdir))
+    data = {"lock": threading.Lock()}
+
+    # WHEN
+    scheduler.schedule(mock.Mock(), data, RuntimeError("boom"), name="hook")
+    scheduler.close()
+
+    # THEN
+    assert os.listdir(str(tmpdir)) == []
+    assert scheduler.dead_letters.letters()[0].data is data
+    assert "Keeping the payload of a retry of hook in memory" in caplog.text
+
+
+def test_dead_letters_are_kept_in_a_file(tmpdir):
+    # GIVEN
+    path = str(tmpdir.join("dead.jsonl"))
+    store = DeadLetterStore(path, max_size=2)
+    store.add(DeadLetter("first", {"i": 1}, 5, "boom", 1.0))
+    store.add(DeadLetter("second", LazyPayload(b'{"i": 2}', json.loads), 5, "boom", 2.0))
+    store.add(DeadLetter("third", ["not", "an", "object"], 1, "boom", 3.0))
+
+    # WHEN
+    reloaded = DeadLetterStore(path)
+
+    # THEN
+    assert [letter.hook for letter in store.letters()] == ["second", "third"]
+    assert reloaded.letters() == [
+        DeadLetter("first", {"i": 1}, 5, "boom", 1.0),
+        DeadLetter("second", {"i": 2}, 5, "boom", 2.0),
+        DeadLetter("third", ["not", "an", "object"], 1, "boom", 3.0),
+    ]
+    reloaded.clear()
+    assert len(reloaded) == 0
+    assert len(DeadLetterStore(path)) == 0
+
+
+def test_pending_retries_are_left_behind_after_fork():
+    # GIVEN
+    scheduler = RetryScheduler(base_delay=60)
+    scheduler.schedule(mock.Mock(), {}, RuntimeError("boom"))
+
+    # WHEN
+    scheduler.after_fork()  # as a child process would, where that retry is not its own
+    scheduler.close()
+
+    # THEN
+    assert scheduler.pending == 0
+    assert len(scheduler.dead_letters) == 0
+
+
+def _retry_in_child(scheduler, queue):
+    scheduler.after_fork()
+    hook, _, done = _calls(1, [])
+    scheduler.schedule(hook, {}, RuntimeError("boom"))
+    queue.put(done.wait(5))
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork")
+def test_retries_run_in_forked_processes(scheduler):
+    # GIVEN
+    # Python 2 has no contexts, and always forks
+    context = multiprocessing.get_context("fork") if hasattr(multiprocessing, "get_context") else multiprocessing
+    queue = context.Queue()
+
+    # WHEN
+    process = context.Process(target=_retry_in_child, args=(scheduler, queue))
+    process.start()
+    retried = queue.get(timeout=10)
+    process.join()
+
+    # THEN
+    assert retried
+
+
+def test_retrying_hook_hands_failures_to_the_scheduler(caplog):
+    # GIVEN
+    scheduler = mock.Mock()
+    error = RuntimeError("boom")
+    failing = mock.Mock(side_effect=error)
+
+    # WHEN
+    RetryingHook(mock.Mock(), scheduler)({})
+    RetryingHook(failing, scheduler, "failing")({"key": "value"})
+
+    # THEN
+    scheduler.schedule.assert_called_once_with(failing, {"key": "value"}, error, name="failing")
+    assert "Hook failing raised an exception; retrying it later" in caplog.text
+
+
+def test_core_isolates_failing_hooks(scheduler):
+    # GIVEN
+    core = WebhookCore(retries=scheduler, metrics=mock.Mock())
+    failing, calls, done = _calls(2, [RuntimeError("boom")])
+    other = mock.Mock()
+    core.hook()(failing)
+    core.hook()(other)
+
+    # WHEN
+    result = core.handle(HEADERS, b'{"key": "value"}')
+
+    # THEN
+    assert result == Result(204, "")
+    other.assert_called_once_with({"key": "value"})
+    assert done.wait(5)
+    assert calls == [{"key": "value"}] * 2
+
+
+def test_core_closes_the_scheduler_on_shutdown():
+    # GIVEN
+    scheduler = mock.Mock()
+    core = WebhookCore(retries=scheduler)
+
+    # WHEN
+    core.shutdown(wait=False)
+
+    # THEN
+    scheduler.close.assert_called_once_with(wait=False)
+    assert hook_name(RetryingHook(_calls, scheduler)) == hook_name(_calls)
+
+
+def test_core_restarts_its_threads_after_fork():
+    # GIVEN
+    scheduler, dispatcher = mock.Mock(), mock.Mock(asynchronous=True)
+    core = WebhookCore(dispatcher=dispatcher, retries=scheduler)
+    forwarder = ForwardHook(["http://localhost/"])
+    core.hook()(forwarder)
+    core.batch_hook()(mock.Mock())
+
+    # WHEN
+    with mock.patch.object(BatchHook, "after_fork") as batch_after_fork, mock.patch.object(
+        forwarder, "after_fork"
+    ) as forward_after_fork:
+        core.after_fork()
+    WebhookCore().after_fork()
+
+    # THEN
+    scheduler.after_fork.assert_called_once_with()
+    dispatcher.after_fork.assert_called_once_with()
+    batch_after_fork.assert_called_once_with()
+    forward_after_fork.assert_called_once_with()
+
+
+def test_retries_spilled_by_exited_processes_are_dead_lettered(tmpdir, caplog):
+    # GIVEN
+    spill = str(tmpdir)
+    scheduler = RetryScheduler(base_delay=60, max_in_memory=0, spill=spill)
+    scheduler.schedule(mock.Mock(), {"key": "value"}, RuntimeError("boom"), name="hook")
+    [filename] = os.listdir(spill)
+    tmpdir.join(filename.replace(str(os.getpid()), "999999999", 1)).write(tmpdir.join(filename).read("rb"), "wb")
+    for name in ("999999998-0.retry", "{0}-1.retry".format(os.getpid()), "notes.txt"):
+        tmpdir.join(name).write("garbage")
+
+    # WHEN
+    other = RetryScheduler(spill=spill)
+    other.close()
+    scheduler.close()
+
+    # THEN
+    [letter] = other.dead_letters.letters()
+    assert letter[:4] == ("hook", {"key": "value"}, 1, "boom")
+    assert sorted(os.listdir(spill)) == ["{0}-1.retry".format(os.getpid()), "notes.txt"]
+    assert len(scheduler.dead_letters) == 1
+    assert "Giving up on hook hook after its process exited: boom" in caplog.text
+    assert "Discarding the unreadable retry" in caplog.text
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
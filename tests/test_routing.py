@@ -0,0 +1,184 @@
+"""Tests for github_webhook.routing"""
+
+import json
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore
+from github_webhook.payload import LazyPayload
+from github_webhook.routing import Route, Router
+
+DATA = {
+    "action": "opened",
+    "ref": "refs/heads/main",
+    "repository": {"full_name": "Org/Repo"},
+    "sender": {"login": "octocat"},
+}
+
+
+@pytest.fixture
+def router():
+    yield Router()
+
+
+def test_unfiltered_hooks_match_every_delivery(router):
+    # GIVEN
+    router.add("push", "first")
+    router.add("push", "second")
+
+    # WHEN, THEN
+    assert router.match("push", DATA) == ["first", "second"]
+    assert router.match("push", {}) == ["first", "second"]
+    assert router.match("ping", DATA) == []
+
+
+@pytest.mark.parametrize(
+    "filters, matches",
+    [
+        ({"action": "opened"}, True),
+        ({"action": ["closed", "opened"]}, True),
+        ({"action": "closed"}, False),
+        ({"repository": "org/repo"}, True),
+        ({"repository": "Org/*"}, True),
+        ({"repository": ["other/repo", "org/re?o"]}, True),
+        ({"repository": "other/*"}, False),
+        ({"ref": "refs/heads/*"}, True),
+        ({"ref": ["refs/tags/*", "refs/heads/main"]}, True),
+        ({"ref": "refs/heads/release/*"}, False),
+        ({"sender": "octocat"}, True),
+        ({"sender": ["someone", "else"]}, False),
+        ({"action": "opened", "repository": "org/*", "ref": "refs/heads/main", "sender": "octocat"}, True),
+        ({"action": "opened", "repository": "org/*", "sender": "someone"}, False),
+    ],
+)
+def test_filters(router, filters, matches):
+    # GIVEN
+    router.add("push", "hook", **filters)
+
+    # WHEN, THEN
+    assert router.match("push", DATA) == (["hook"] if matches else [])
+
+
+@pytest.mark.parametrize(
+    "data",
+    [{}, {"action": 1, "repository": None, "ref": 2, "sender": "octocat"}, {"repository": {"full_name": 3}}],
+)
+def test_filters_do_not_match_missing_fields(router, data):
+    # GIVEN
+    router.add("push", "unfiltered")
+    router.add("push", "action", action="opened")
+    router.add("push", "repository", repository="org/*")
+    router.add("push", "ref", ref="*")
+    router.add("push", "sender", sender="octocat")
+
+    # WHEN, THEN
+    assert router.match("push", data) == ["unfiltered"]
+
+
+def test_pull_requests_match_on_their_base_branch(router):
+    # GIVEN
+    router.add("pull_request", "hook", ref="main")
+
+    # WHEN, THEN
+    assert router.match("pull_request", {"pull_request": {"base": {"ref": "main"}}}) == ["hook"]
+    assert router.match("pull_request", {"pull_request": {"base": {"ref": "dev"}}}) == []
+
+
+def test_hooks_are_returned_once_in_registration_order(router):
+    # GIVEN
+    router.add("push", "by-name", repository=["org/repo", "org/*"])
+    router.add("push", "unfiltered")
+    router.add("push", "by-action", action="opened")
+    router.add("push", "by-pattern", repository="*/repo")
+
+    # WHEN, THEN
+    assert router.match("push", DATA) == ["by-name", "unfiltered", "by-action", "by-pattern"]
+
+
+def test_only_candidates_are_checked(router):
+    # GIVEN
+    for i in range(1000):
+        router.add("push", "other", action="closed", repository="org/repo-{0}".format(i), sender="octocat")
+    router.add("push", "hook", action="opened", repository="org/repo", sender="octocat")
+
+    # WHEN
+    with mock.patch.object(Route, "matches", autospec=True, return_value=True) as matches:
+        hooks = router.match("push", DATA)
+
+    # THEN
+    assert hooks == ["hook"]
+    assert matches.call_count == 1
+
+
+def test_lazy_payloads_are_looked_up(router):
+    # GIVEN
+    router.add("push", "hook", action="opened", repository="org/repo", ref="refs/heads/main")
+    body = b'{"action": "opened", "ref": "refs/heads/main", "repository": {"full_name": "org/repo"}}'
+    data = LazyPayload(body, json.loads)
+
+    # WHEN, THEN
+    assert router.match("push", data) == ["hook"]
+
+
+def test_core_hooks_can_be_filtered():
+    # GIVEN
+    core = WebhookCore()
+    opened, closed = mock.Mock(), mock.Mock()
+    core.hook("pull_request", action="opened", repository="org/*")(opened)
+    core.hook("pull_request", action="closed")(closed)
+    headers = {"X-Github-Event": "pull_request", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+
+    # WHEN
+    core.handle(headers, b'{"action": "opened", "repository": {"full_name": "org/repo"}}')
+
+    # THEN
+    opened.assert_called_once_with({"action": "opened", "repository": {"full_name": "org/repo"}})
+    closed.assert_not_called()
+
+
+def test_catch_all_hooks_match_every_event_type(router):
+    # GIVEN
+    router.add("*", "everything")
+    router.add("pull_request", "opened", action="opened")
+    router.add("*", "closed", action="closed")
+    router.add("pull_request", "any action")
+
+    # WHEN, THEN
+    assert router.match("pull_request", DATA) == ["everything", "opened", "any action"]
+    assert router.match("ping", {"action": "closed"}) == ["everything", "closed"]
+    assert router.match("*", DATA) == ["everything"]
+
+
+def test_handles(router):
+    # GIVEN
+    router.add("push", "hook", action="opened")
+
+    # WHEN
+    handled = [router.handles("push"), router.handles("ping")]
+    router.add("*", "everything")
+
+    # THEN
+    assert handled == [True, False]
+    assert router.handles("ping")
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,631 @@
+"""Tests for github_webhook.server"""
+
+import errno
+import io
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+from six.moves import http_client, queue
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.admission import AdmissionControl
+from github_webhook.core import WebhookCore
+from github_webhook.dedup import MemoryDeliveryStore
+from github_webhook.metrics import PrometheusMetrics
+from github_webhook.server import (
+    _LISTENER_FD,
+    _OLD_WORKERS,
+    Server,
+    _Body,
+    _describe_memory,
+    _HTTPServer,
+    _kill,
+    _memory,
+    load,
+    main,
+)
+
+HEADERS = {"X-Github-Event": "push", "X-Github-Delivery": "72d3162e", "Content-Type": "application/json"}
+OUTPUT = "WEBHOOK_TEST_SERVER_OUTPUT"
+
+# The webhook served by `python -m github_webhook`; its hook records the pid of the worker it ran in
+webhook = WebhookCore()
+
+
+@webhook.hook()
+def record(data):
+    with open(os.path.join(os.environ[OUTPUT], data["name"]), "w") as output:
+        output.write(str(os.getpid()))
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(core, **options):
+        server = Server(core, bind=("127.0.0.1", 0), workers=1, **options)
+        server.listen()
+        http = _HTTPServer(server)
+        thread = threading.Thread(target=http.serve_forever, kwargs={"poll_interval": 0.01})
+        thread.start()
+        servers.append((http, thread))
+        return http_client.HTTPConnection(*server.address, timeout=5)
+
+    yield serve
+    for http, thread in servers:
+        http.shutdown()
+        http.server_close()
+        thread.join()
+
+
+def _post(connection, body=b'{"key": "value"}', path="/postreceive", headers=HEADERS):
+    connection.request("POST", path, body, headers)
+    response = connection.getresponse()
+    return response.status, response.read(), response.getheader("connection")
+
+
+def test_deliveries_are_served_over_kept_alive_connections(serve):
+    # GIVEN
+    core = WebhookCore()
+    handler = mock.Mock()
+    core.hook()(handler)
+    connection = serve(core)
+
+    # WHEN
+    first = _post(connection)
+    sock = connection.sock
+    second = _post(connection, headers=dict(HEADERS, **{"X-Github-Delivery": "other"}))
+
+    # THEN
+    assert first == second == (204, b"", None)
+    assert connection.sock is sock
+    assert handler.call_args_list == [mock.call({"key": "value"})] * 2
+
+
+def test_refused_deliveries_get_their_status(serve):
+    # GIVEN
+    core = WebhookCore(secret="secret")
+    connection = serve(core)
+
+    # WHEN
+    status, body, _ = _post(connection)
+
+    # THEN
+    assert (status, body) == (400, b"Missing header: X-Hub-Signature-256")
+
+
+def test_failing_hooks_get_an_internal_error(serve, caplog):
+    # GIVEN
+    core = WebhookCore(metrics=PrometheusMetrics())
+    core.hook()(mock.Mock(side_effect=RuntimeError("boom")))
+    connection = serve(core, metrics_endpoint="/metrics")
+
+    # WHEN
+    status, body, _ = _post(connection)
+    connection.request("GET", "/metrics")
+    metrics = connection.getresponse().read().decode("utf-8")
+
+    # THEN
+    assert (status, body) == (500, b"Internal Server Error")
+    assert "Hook raised an exception" in caplog.text
+    assert 'github_webhook_responses_total{status="500"} 1' in metrics
+
+
+def test_connection_is_closed_when_the_body_is_not_read(serve):
+    # GIVEN
+    core = WebhookCore(dedup=MemoryDeliveryStore())
+    core.hook()(mock.Mock())
+    connection = serve(core)
+    _post(connection)
+
+    # WHEN
+    status, body, close = _post(connection)
+
+    # THEN
+    assert (status, body, close) == (200, b"Duplicate delivery", "close")
+
+
+def test_tenant_is_read_from_the_path(serve):
+    # GIVEN
+    core = WebhookCore()
+    handler = mock.Mock()
+    core.hook(tenant="acme")(handler)
+    connection = serve(core, endpoint="/postreceive/<tenant>")
+
+    # WHEN
+    status, _, _ = _post(connection, path="/postreceive/acme?x=1")
+    other, _, _ = _post(connection, path="/other/acme")
+
+    # THEN
+    assert (status, other) == (204, 404)
+    handler.assert_called_once_with({"key": "value"})
+
+
+@pytest.mark.parametrize(
+    "method, path, status, allow",
+    [("POST", "/other", 404, None), ("GET", "/postreceive", 405, "POST"), ("GET", "/other", 404, None)],
+)
+def test_other_requests_are_refused(serve, method, path, status, allow):
+    # GIVEN
+    connection = serve(WebhookCore())
+
+    # WHEN
+    connection.request(method, path, b"{}" if method == "POST" else None, HEADERS)
+    response = connection.getresponse()
+
+    # THEN
+    assert response.status == status
+    assert response.getheader("allow") == allow
+
+
+def test_deliveries_must_declare_their_length(serve):
+    # GIVEN
+    connection = serve(WebhookCore())
+
+    # WHEN
+    connection.putrequest("POST", "/postreceive")
+    connection.endheaders()
+    response = connection.getresponse()
+
+    # THEN
+    assert (response.status, response.getheader("connection")) == (411, "close")
+
+
+def test_connections_are_closed_without_keepalive(serve):
+    # GIVEN
+    connection = serve(WebhookCore(), keepalive=0)
+
+    # WHEN
+    _, _, close = _post(connection)
+
+    # THEN
+    assert close == "close"
+
+
+def test_metrics_endpoint_requires_a_renderer():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        Server(WebhookCore(), metrics_endpoint="/metrics")
+
+
+@pytest.mark.parametrize("option", ["journal", "recorder", "workers"])
+def test_journals_recorders_and_worker_fleets_are_not_shared_by_workers(option):
+    # GIVEN
+    core = WebhookCore(**{option: mock.Mock()})
+
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        Server(core, workers=1)
+
+
+@pytest.mark.parametrize(
+    "core, options",
+    [
+        (WebhookCore(metrics=PrometheusMetrics()), {"metrics_endpoint": "/metrics"}),
+        (WebhookCore(dedup=MemoryDeliveryStore()), {}),
+    ],
+)
+def test_per_process_state_is_refused_with_several_workers(core, options):
+    # GIVEN
+    Server(core, workers=1, **options)
+
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        Server(core, workers=2, **options)
+
+
+def test_admission_rates_apply_to_each_worker(caplog):
+    # WHEN
+    Server(WebhookCore(admission=AdmissionControl()), workers=3)
+
+    # THEN
+    assert "The admission control rates apply to each of the 3 workers" in caplog.text
+
+
+@pytest.mark.parametrize("stream", [io.BytesIO(b"abcdef"), mock.Mock(spec=["read"], read=io.BytesIO(b"abcdef").read)])
+def test_body_is_read_up_to_its_length(stream):
+    # GIVEN
+    body = _Body(stream, 4)
+    buffer = bytearray(3)
+
+    # WHEN
+    count = body.readinto(buffer)
+    rest = body.read()
+
+    # THEN
+    assert (count, bytes(buffer), rest) == (3, b"abc", b"d")
+    assert body.readinto(buffer) == 0
+    assert body.read(10) == b""
+
+
+@mock.patch("github_webhook.server.signal.signal")
+def test_worker_serves_until_asked_to_stop(mock_signal, caplog):
+    # GIVEN
+    caplog.set_level(logging.INFO, "webhook")
+    core = WebhookCore()
+    core.shutdown, core.after_fork = mock.Mock(), mock.Mock()
+    server = Server(core, bind=("127.0.0.1", 0), graceful_timeout=7)
+    server.listen()
+    responses = []
+    waiting = threading.Event()
+    wait = server._stopping.wait
+
+    def wait_for_stop(timeout):
+        waiting.set()
+        return wait(timeout)
+
+    server._stopping.wait = wait_for_stop
+
+    def request():
+        connection = http_client.HTTPConnection(*server.address, timeout=5)
+        responses.append(_post(connection)[0])
+        waiting.wait(5)
+        server._stopping.set()  # while the connection is kept alive
+
+    threading.Thread(target=request).start()
+
+    # WHEN
+    code = server._work(time.time())
+
+    # THEN
+    assert code == 0
+    assert responses == [204]
+    core.after_fork.assert_called_once_with()
+    core.shutdown.assert_called_once_with(timeout=7)
+    assert "ready in" in caplog.text
+
+
+@mock.patch("github_webhook.server.os")
+def test_forked_worker_exits_with_the_status_of_its_work(mock_os, caplog):
+    # GIVEN
+    mock_os.fork.return_value = 0
+    server = Server(WebhookCore())
+    server._work = mock.Mock(side_effect=[0, RuntimeError("boom")])
+
+    # WHEN
+    server._spawn()
+    server._spawn()
+
+    # THEN
+    assert mock_os._exit.call_args_list == [mock.call(0), mock.call(1)]
+    assert "crashed" in caplog.text
+
+
+@pytest.fixture
+def master(monkeypatch):
+    """A server whose processes, signals and sleeps are mocked; :code:`script` says what happens at each sleep"""
+
+    for name in (_LISTENER_FD, _OLD_WORKERS):
+        monkeypatch.delenv(name, raising=False)
+    server = Server(WebhookCore(), bind=("127.0.0.1", 0), workers=2)
+    pids = iter(range(101, 200))
+    with mock.patch("github_webhook.server.os.fork", side_effect=lambda: next(pids)), mock.patch(
+        "github_webhook.server.os.waitpid"
+    ) as waitpid, mock.patch("github_webhook.server.os.kill") as kill, mock.patch(
+        "github_webhook.server.time.sleep"
+    ) as sleep, mock.patch(
+        "github_webhook.server.signal.signal"
+    ), mock.patch(
+        "github_webhook.server.gc"
+    ):
+        server.mocks = mock.Mock(waitpid=waitpid, kill=kill, sleep=sleep)
+        yield server
+
+
+def _exited(*statuses):
+    """Side effect of waitpid: the children given by (pid, status) exit, then none is left"""
+
+    return [status for status in statuses] + [OSError(errno.ECHILD, "No child processes")] * 100
+
+
+def test_master_forks_workers_again_and_stops_them(master, caplog):
+    # GIVEN
+    master.mocks.waitpid.side_effect = [(101, 256), (0, 0), (0, 0)] + _exited((102, 0), (103, 0))
+    master.mocks.sleep.side_effect = [master._on_signal(signal.SIGTERM, None)] + [None] * 10
+
+    # WHEN
+    master.run()
+
+    # THEN
+    assert master._workers == set()
+    assert master._retiring == set()
+    assert sorted(master.mocks.kill.call_args_list) == [mock.call(102, signal.SIGTERM), mock.call(103, signal.SIGTERM)]
+    assert "Worker 101 exited with status 256; forking another" in caplog.text
+
+
+@mock.patch("github_webhook.server._clock")
+def test_workers_crashing_as_they_start_are_forked_again_with_backoff(clock, master, caplog):
+    # GIVEN
+    clock.return_value = 100.0
+    master._spawn()
+    master._spawn()
+    master.mocks.waitpid.side_effect = [(101, 256), (0, 0), (103, 256), (0, 0), (0, 0), (0, 0), (104, 0), (0, 0)]
+    workers = []
+
+    # WHEN
+    for now in (100.0, 100.0, 100.4, 100.5, 200.0):
+        clock.return_value = now
+        master._reap()
+        master._respawn()
+        workers.append(sorted(master._workers))
+
+    # THEN
+    assert workers == [[102, 103], [102], [102], [102, 104], [102, 105]]
+    assert "Worker 101 exited with status 256; forking another\n" in caplog.text
+    assert "Worker 103 exited with status 256; forking another in 0.5s" in caplog.text
+    assert "Worker 104 exited with status 0; forking another\n" in caplog.text
+
+
+def test_master_kills_workers_that_do_not_stop(master, caplog):
+    # GIVEN
+    master.graceful_timeout = 0
+    master.mocks.waitpid.side_effect = _exited()
+    master._on_signal(signal.SIGINT, None)
+
+    # WHEN
+    master.run()
+
+    # THEN
+    assert mock.call(101, signal.SIGKILL) in master.mocks.kill.call_args_list
+    assert "Killing worker 101" in caplog.text
+
+
+def test_master_retires_the_previous_generation(master, monkeypatch):
+    # GIVEN
+    monkeypatch.setenv(_OLD_WORKERS, "51,52")
+    master.graceful_timeout = 0
+    master.mocks.waitpid.side_effect = _exited()
+    master._on_signal(signal.SIGTERM, None)
+
+    # WHEN
+    master.run()
+
+    # THEN
+    assert master.mocks.kill.call_args_list[:2] == [mock.call(51, signal.SIGTERM), mock.call(52, signal.SIGTERM)]
+
+
+def test_reload_forks_a_new_generation(master):
+    # GIVEN
+    master.mocks.waitpid.return_value = (0, 0)
+    master.mocks.sleep.side_effect = lambda seconds: master._on_signal(
+        signal.SIGTERM if master._workers == {103, 104} else signal.SIGHUP, None
+    )
+    master.graceful_timeout = 0
+
+    # WHEN
+    master.run()
+
+    # THEN
+    assert master.mocks.kill.call_args_list[:2] == [mock.call(101, signal.SIGTERM), mock.call(102, signal.SIGTERM)]
+
+
+@mock.patch("github_webhook.server.os.execv")
+def test_reload_executes_the_server_again(mock_execv, master, monkeypatch, caplog):
+    # GIVEN
+    master.mocks.waitpid.return_value = (0, 0)
+    master.graceful_timeout = 0
+    mock_execv.side_effect = [None, OSError("no such file")]
+    environ = []
+
+    def reload_then_stop(seconds):
+        environ.append((os.environ.get(_LISTENER_FD), os.environ.get(_OLD_WORKERS)))
+        master._on_signal(signal.SIGTERM if mock_execv.call_count == 2 else signal.SIGHUP, None)
+
+    master.mocks.sleep.side_effect = reload_then_stop
+
+    # WHEN
+    master.run(["tests.test_server:webhook", "--workers", "2"])
+
+    # THEN
+    assert mock_execv.call_args == mock.call(
+        sys.executable, [sys.executable, "-m", "github_webhook", "tests.test_server:webhook", "--workers", "2"]
+    )
+    assert environ[1][0].isdigit()
+    assert environ[1][1] == "101,102"
+    assert environ[2] == (None, None)
+    assert "Could not execute the server again" in caplog.text
+    monkeypatch.delenv(_LISTENER_FD, raising=False)
+
+
+def test_listener_is_inherited_across_reloads(monkeypatch):
+    # GIVEN
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    monkeypatch.setenv(_LISTENER_FD, str(os.dup(listener.fileno())))
+    server = Server(WebhookCore())
+
+    # WHEN
+    server.listen()
+
+    # THEN
+    assert server.address == listener.getsockname()
+    assert _LISTENER_FD not in os.environ
+    server.listener.close()
+    listener.close()
+
+
+def test_idle_connections_are_closed():
+    # GIVEN
+    server = Server(WebhookCore(), bind=("127.0.0.1", 0))
+    server.listen()
+    http = _HTTPServer(server)
+    http.idle.update([mock.Mock(), mock.Mock(**{"shutdown.side_effect": OSError("closed")})])
+
+    # WHEN
+    http.close_idle()
+
+    # THEN
+    for connection in http.idle:
+        connection.shutdown.assert_called_once_with(socket.SHUT_RDWR)
+    http.server_close()
+
+
+def test_unexpected_errors_are_raised(master):
+    # GIVEN
+    master.mocks.waitpid.side_effect = OSError(errno.EINTR, "Interrupted")
+    master.mocks.kill.side_effect = OSError(errno.EPERM, "Not permitted")
+
+    # WHEN, THEN
+    with pytest.raises(OSError):
+        master._reap()
+    with pytest.raises(OSError):
+        _kill(1, signal.SIGTERM)
+    master.mocks.kill.side_effect = OSError(errno.ESRCH, "No such process")
+    _kill(1, signal.SIGTERM)
+
+
+def test_memory_is_measured_without_proc(caplog):
+    # GIVEN
+    with mock.patch("github_webhook.server.open", side_effect=IOError, create=True):
+        # WHEN
+        rss, shared = _memory()
+        description = _describe_memory()
+
+    # THEN
+    assert rss > 0
+    assert shared is None
+    assert description.startswith("RSS ")
+    assert "shared" in _describe_memory()
+
+
+def test_load_imports_and_warms_the_webhook(caplog):
+    # GIVEN
+    caplog.set_level(logging.INFO, "webhook")
+
+    # WHEN
+    loaded = load("tests.test_server:webhook", ["tests.test_recording"], ["tests.test_server:warmed"])
+
+    # THEN
+    assert loaded is webhook
+    warmed.assert_called_once_with(webhook)
+    assert "Loaded tests.test_server:webhook in" in caplog.text
+
+
+warmed = mock.Mock()
+
+
+@mock.patch("github_webhook.server.Server.run")
+def test_main_reads_a_config_file(mock_run, tmpdir):
+    # GIVEN
+    config = tmpdir.join("server.json")
+    config.write(json.dumps({"webhook": "tests.test_server:webhook", "workers": 3, "graceful-timeout": 5}))
+    argv = ["--config", str(config), "--bind", ":8080", "--keepalive", "0"]
+
+    # WHEN
+    with mock.patch("github_webhook.server.Server.__init__", return_value=None) as mock_init:
+        assert main(argv) == 0
+
+    # THEN
+    mock_init.assert_called_once_with(
+        webhook,
+        bind=("0.0.0.0", 8080),
+        workers=3,
+        endpoint="/postreceive",
+        metrics_endpoint=None,
+        keepalive=0,
+        graceful_timeout=5,
+    )
+    mock_run.assert_called_once_with(argv)
+
+
+def test_main_requires_a_webhook(capsys):
+    # WHEN, THEN
+    with pytest.raises(SystemExit):
+        main([])
+    assert "the webhook to serve is required" in capsys.readouterr().err
+
+
+def test_module_runs_the_server():
+    # WHEN
+    import github_webhook.__main__ as module
+
+    # THEN
+    assert module.main is main
+
+
+def _lines(process):
+    lines = queue.Queue()
+
+    def read():
+        for line in iter(process.stderr.readline, b""):
+            lines.put(line.decode("utf-8"))
+
+    thread = threading.Thread(target=read)
+    thread.daemon = True
+    thread.start()
+    return lines
+
+
+def _wait_for(lines, text, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        line = lines.get(timeout=max(deadline - time.time(), 0.01))
+        if text in line:
+            return line
+
+
+def _named(name):
+    return json.dumps({"name": name}).encode("utf-8"), "/postreceive", dict(HEADERS, **{"X-Github-Delivery": name})
+
+
+def test_server_forks_workers_and_reloads(tmpdir):
+    # GIVEN
+    env = dict(os.environ, **{OUTPUT: str(tmpdir)})
+    command = [sys.executable, "-m", "github_webhook", "tests.test_server:webhook", "--bind", "127.0.0.1:0"]
+    process = subprocess.Popen(command + ["--workers", "2"], env=env, stderr=subprocess.PIPE)
+    lines = _lines(process)
+    try:
+        port = int(_wait_for(lines, "Listening on").split(":")[-1].split("/")[0])
+        for _ in range(2):
+            _wait_for(lines, "ready in")
+
+        # WHEN
+        connection = http_client.HTTPConnection("127.0.0.1", port, timeout=10)
+        first = _post(connection, *_named("first"))
+        process.send_signal(signal.SIGHUP)
+        _wait_for(lines, "Listening on")
+        for _ in range(2):
+            _wait_for(lines, "ready in")
+        connection = http_client.HTTPConnection("127.0.0.1", port, timeout=10)
+        second = _post(connection, *_named("second"))
+        process.send_signal(signal.SIGTERM)
+
+        # THEN
+        assert process.wait(30) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+    assert first[0] == second[0] == 204
+    pids = set(tmpdir.join(name).read() for name in ("first", "second"))
+    assert str(process.pid) not in pids
+    assert len(pids) == 2
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,116 @@
+"""Tests for github_webhook.signature"""
+
+import hashlib
+import hmac
+
+import pytest
+
+from github_webhook.signature import InvalidSignature, Signature, Verifier
+
+BODY = b'{"key": "value"}'
+
+
+def _headers(secret=b"secret", algorithms=("sha256", "sha1")):
+    headers = {}
+    if "sha256" in algorithms:
+        headers["x-hub-signature-256"] = "sha256=" + hmac.new(secret, BODY, hashlib.sha256).hexdigest()
+    if "sha1" in algorithms:
+        headers["x-hub-signature"] = "sha1=" + hmac.new(secret, BODY, hashlib.sha1).hexdigest()
+    return headers
+
+
+def _verify(verifier, headers, policy="prefer-sha256"):
+    signature = verifier.signature(headers, policy)
+    signature.update(BODY)
+    return signature.verify()
+
+
+@pytest.mark.parametrize(
+    "algorithms, policy",
+    [
+        (("sha256", "sha1"), "prefer-sha256"),
+        (("sha1",), "prefer-sha256"),
+        (("sha256",), "sha256"),
+        (("sha1",), "sha1"),
+    ],
+)
+def test_accepted_signatures(algorithms, policy):
+    # WHEN, THEN
+    assert _verify(Verifier([b"secret"]), _headers(algorithms=algorithms), policy)
+
+
+def test_sha256_is_preferred():
+    # GIVEN
+    headers = _headers()
+    headers["x-hub-signature"] = "sha1=0000"
+
+    # WHEN, THEN
+    assert _verify(Verifier([b"secret"]), headers)
+
+
+def test_wrong_secret():
+    # WHEN, THEN
+    assert not _verify(Verifier([b"secret"]), _headers(secret=b"other"))
+
+
+def test_any_active_secret_is_accepted():
+    # GIVEN
+    verifier = Verifier([b"new", b"old"])
+
+    # WHEN, THEN
+    assert _verify(verifier, _headers(secret=b"new"))
+    assert _verify(verifier, _headers(secret=b"old"))
+    assert not _verify(verifier, _headers(secret=b"other"))
+
+
+@pytest.mark.parametrize(
+    "algorithms, policy, message",
+    [
+        ((), "prefer-sha256", "Missing header: X-Hub-Signature-256"),
+        (("sha1",), "sha256", "Missing header: X-Hub-Signature-256"),
+        (("sha256",), "sha1", "Missing header: X-Hub-Signature"),
+    ],
+)
+def test_missing_signature(algorithms, policy, message):
+    # WHEN, THEN
+    with pytest.raises(InvalidSignature, match=message):
+        Verifier([b"secret"]).signature(_headers(algorithms=algorithms), policy)
+
+
+@pytest.mark.parametrize("header", ["c0ffee", "sha1=c0ffee"])
+def test_malformed_signature(header):
+    # WHEN, THEN
+    with pytest.raises(InvalidSignature, match="Invalid signature"):
+        Verifier([b"secret"]).signature({"x-hub-signature-256": header})
+
+
+def test_unknown_policy():
+    # WHEN, THEN
+    with pytest.raises(ValueError):
+        Verifier([b"secret"]).signature(_headers(), "md5")
+
+
+@pytest.mark.parametrize("digest", ["\xe9", b"\xe9"])
+def test_non_ascii_signature_does_not_match(digest):
+    # GIVEN
+    signature = Signature(digest, [hmac.new(b"secret", digestmod=hashlib.sha256)])
+
+    # WHEN, THEN
+    assert not signature.verify()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -0,0 +1,206 @@
+"""Tests for github_webhook.tenants"""
+
+import hashlib
+import hmac
+
+import pytest
+from flask import Flask
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook import Webhook
+from github_webhook.core import WebhookCore, WebhookError
+from github_webhook.journal import Journal
+from github_webhook.tenants import TenantSecrets
+
+BODY = b'{"key": "value"}'
+SECRETS = {"1": "one", "2": ["two", "old-two"], "3": []}
+
+
+def _headers(secret=None, tenant=None):
+    headers = {"X-Github-Event": "push", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+    if secret is not None:
+        digest = hmac.new(secret.encode("utf-8"), BODY, hashlib.sha256).hexdigest()
+        headers["X-Hub-Signature-256"] = "sha256=" + digest
+    if tenant is not None:
+        headers["X-GitHub-Hook-Installation-Target-ID"] = tenant
+    return headers
+
+
+def test_secrets_are_loaded_once():
+    # GIVEN
+    provider = mock.Mock(side_effect=SECRETS.get)
+    secrets = TenantSecrets(provider)
+
+    # WHEN
+    verifiers = [secrets.verifier("2"), secrets.verifier("2")]
+
+    # THEN
+    provider.assert_called_once_with("2")
+    assert verifiers[0] is verifiers[1]
+    assert verifiers[0].secrets == (b"two", b"old-two")
+
+
+def test_tenants_without_secrets_have_no_verifier():
+    assert TenantSecrets(SECRETS).verifier("3") is None
+
+
+def test_unknown_tenants_are_cached():
+    # GIVEN
+    provider = mock.Mock(return_value=None)
+    secrets = TenantSecrets(provider)
+
+    # WHEN
+    for _ in range(2):
+        with pytest.raises(KeyError):
+            secrets.verifier("4")
+
+    # THEN
+    provider.assert_called_once_with("4")
+
+
+@pytest.mark.parametrize("tenant", ["2", None])
+def test_invalidate(tenant):
+    # GIVEN
+    provider = mock.Mock(side_effect=SECRETS.get)
+    secrets = TenantSecrets(provider)
+    secrets.verifier("2")
+
+    # WHEN
+    secrets.invalidate(tenant)
+    secrets.verifier("2")
+
+    # THEN
+    assert provider.call_count == 2
+
+
+def test_core_verifies_deliveries_with_the_secret_of_their_tenant():
+    # GIVEN
+    core = WebhookCore(tenants=SECRETS)
+    handler = mock.Mock()
+    core.hook()(handler)
+
+    # WHEN
+    core.handle(_headers("one", tenant="1"), BODY)
+    core.handle(_headers("old-two"), BODY, tenant=2)
+    core.handle(_headers(), BODY, tenant="3")
+
+    # THEN
+    assert handler.call_count == 3
+
+
+@pytest.mark.parametrize(
+    "headers, tenant, status",
+    [
+        (_headers("two", tenant="1"), None, 400),
+        (_headers("one"), "4", 404),
+        (_headers("one"), None, 400),
+    ],
+)
+def test_core_refuses_deliveries(headers, tenant, status):
+    # GIVEN
+    core = WebhookCore(tenants=SECRETS)
+
+    # WHEN
+    with pytest.raises(WebhookError) as error:
+        core.handle(headers, BODY, tenant)
+
+    # THEN
+    assert error.value.status == status
+
+
+def test_body_reader_verifies_with_the_secret_of_the_tenant():
+    # GIVEN
+    core = WebhookCore(tenants=SECRETS)
+
+    # WHEN
+    reader = core.body_reader(_headers("one"), tenant="1")
+    reader.feed(BODY)
+
+    # THEN
+    assert reader.signature.verify()
+
+
+def test_core_runs_the_hooks_of_the_tenant():
+    # GIVEN
+    core = WebhookCore()
+    shared, first, second = mock.Mock(), mock.Mock(), mock.Mock()
+    core.hook(tenant="1")(first)
+    core.hook(tenant=2)(second)
+    core.hook()(shared)
+
+    # WHEN
+    hooks, _ = core.receive(_headers(tenant="2"), BODY)
+
+    # THEN
+    assert hooks == [shared, second]
+    assert core.receive(_headers(), BODY)[0] == [shared]
+    assert core.receive(_headers(), BODY, tenant="1")[0] == [shared, first]
+
+
+def test_core_does_not_trust_a_recorded_tenant_from_the_request():
+    # GIVEN
+    core = WebhookCore()
+    core.hook(tenant="1")(mock.Mock())
+    headers = dict(_headers(), **{"X-Github-Webhook-Tenant": "1"})
+
+    # WHEN
+    hooks, _ = core.receive(headers, BODY)
+
+    # THEN
+    assert hooks == []
+
+
+def test_replay_runs_the_hooks_of_the_tenant(tmpdir):
+    # GIVEN
+    journal = Journal(str(tmpdir))
+    core = WebhookCore(tenants=SECRETS, journal=journal)
+    handler = mock.Mock(side_effect=[RuntimeError("boom"), None])
+    core.hook(tenant="1")(handler)
+    with pytest.raises(RuntimeError):
+        core.handle(_headers("one"), BODY, tenant="1")
+
+    # WHEN
+    count = core.replay()
+
+    # THEN
+    assert count == 1
+    assert handler.call_count == 2
+    assert len(journal) == 0
+
+
+def test_flask_endpoint_names_the_tenant():
+    # GIVEN
+    app = Flask(__name__)
+    webhook = Webhook(app, endpoint="/postreceive/<tenant>", tenants=SECRETS)
+    handler = mock.Mock()
+    webhook.hook(tenant="1")(handler)
+    client = app.test_client()
+
+    # WHEN
+    ok = client.post("/postreceive/1", data=BODY, headers=_headers("one"))
+    unknown = client.post("/postreceive/4", data=BODY, headers=_headers("one"))
+
+    # THEN
+    assert (ok.status_code, unknown.status_code) == (204, 404)
+    handler.assert_called_once_with({"key": "value"})
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------
@@ -4,20 +4,24 @@ from __future__ import print_function
 
 import pytest
 import werkzeug
+import io
 import json
+from six.moves.urllib.parse import urlencode
 
 try:
     from unittest import mock
 except ImportError:
     import mock
 
+from github_webhook.dispatch import QueueFull
 from github_webhook.webhook import Webhook
 
 
 @pytest.fixture
 def mock_request():
-    with mock.patch("github_webhook.webhook.request") as req:
+    with mock.patch("github_webhook.webhook.request", new=mock.MagicMock()) as req:
         req.headers = {"X-Github-Delivery": ""}
+        req.stream = io.BytesIO(b"")
         yield req
 
 
@@ -25,6 +29,7 @@ def mock_request():
 def push_request(mock_request):
     mock_request.headers["X-Github-Event"] = "push"
     mock_request.headers["content-type"] = "application/json"
+    mock_request.stream = io.BytesIO(b'{"key": "value"}')
     yield mock_request
 
 
@@ -108,12 +113,12 @@ def test_run_push_hook(webhook, handler, push_request):
     webhook._postreceive()
 
     # THEN
-    handler.assert_called_once_with(push_request.get_json.return_value)
+    handler.assert_called_once_with({"key": "value"})
 
 
 def test_run_push_hook_urlencoded(webhook, handler, push_request_encoded):
     github_mock_payload = {"payload": '{"key": "value"}'}
-    push_request_encoded.form.to_dict.return_value = github_mock_payload
+    push_request_encoded.stream = io.BytesIO(urlencode(github_mock_payload).encode("ascii"))
     payload = json.loads(github_mock_payload["payload"])
 
     # WHEN
@@ -127,6 +132,7 @@ def test_do_not_run_push_hook_on_ping(webhook, handler, mock_request):
     # GIVEN
     mock_request.headers["X-Github-Event"] = "ping"
     mock_request.headers["content-type"] = "application/json"
+    mock_request.stream = io.BytesIO(b'{"key": "value"}')
 
     # WHEN
     webhook._postreceive()
@@ -139,7 +145,7 @@ def test_do_not_run_push_hook_on_ping_urlencoded(webhook, handler, mock_request)
     # GIVEN
     mock_request.headers["X-Github-Event"] = "ping"
     mock_request.headers["content-type"] = "application/x-www-form-urlencoded"
-    mock_request.form.to_dict.return_value = {"payload": '{"key": "value"}'}
+    mock_request.stream = io.BytesIO(urlencode({"payload": '{"key": "value"}'}).encode("ascii"))
 
     # WHEN
     webhook._postreceive()
@@ -154,12 +160,11 @@ def test_can_handle_zero_events(webhook, push_request):
 
 
 @pytest.mark.parametrize("secret", [u"secret", b"secret"])
-@mock.patch("github_webhook.webhook.hmac")
+@mock.patch("github_webhook.signature.hmac")
 def test_calls_if_signature_is_correct(mock_hmac, app, push_request, secret):
     # GIVEN
     webhook = Webhook(app, secret=secret)
     push_request.headers["X-Hub-Signature"] = "sha1=hash_of_something"
-    push_request.data = b"something"
     handler = mock.Mock()
     mock_hmac.compare_digest.return_value = True
 
@@ -168,15 +173,14 @@ def test_calls_if_signature_is_correct(mock_hmac, app, push_request, secret):
     webhook._postreceive()
 
     # THEN
-    handler.assert_called_once_with(push_request.get_json.return_value)
+    handler.assert_called_once_with({"key": "value"})
 
 
-@mock.patch("github_webhook.webhook.hmac")
+@mock.patch("github_webhook.signature.hmac")
 def test_does_not_call_if_signature_is_incorrect(mock_hmac, app, push_request):
     # GIVEN
     webhook = Webhook(app, secret="super_secret")
     push_request.headers["X-Hub-Signature"] = "sha1=hash_of_something"
-    push_request.data = b"something"
     handler = mock.Mock()
     mock_hmac.compare_digest.return_value = False
 
@@ -188,7 +192,7 @@ def test_does_not_call_if_signature_is_incorrect(mock_hmac, app, push_request):
 
 def test_request_has_no_data(webhook, handler, push_request):
     # GIVEN
-    push_request.get_json.return_value = None
+    push_request.stream = io.BytesIO(b"null")
 
     # WHEN, THEN
     with pytest.raises(werkzeug.exceptions.BadRequest):
@@ -201,6 +205,62 @@ def test_request_had_headers(webhook, handler, mock_request):
         webhook._postreceive()
 
 
+def test_run_push_hook_returns_no_content(webhook, handler, push_request):
+    # WHEN
+    response = webhook._postreceive()
+
+    # THEN
+    assert response == ("", 204)
+
+
+def test_asynchronous_dispatcher_returns_accepted(app, push_request):
+    # GIVEN
+    dispatcher = mock.Mock(asynchronous=True)
+    webhook = Webhook(app, dispatcher=dispatcher)
+    handler = mock.Mock()
+    webhook.hook()(handler)
+
+    # WHEN
+    response = webhook._postreceive()
+
+    # THEN
+    assert response == ("", 202)
+    dispatcher.dispatch.assert_called_once_with([handler], {"key": "value"})
+    handler.assert_not_called()
+
+
+def test_full_dispatcher_returns_service_unavailable(app, push_request):
+    # GIVEN
+    dispatcher = mock.Mock(asynchronous=True)
+    dispatcher.dispatch.side_effect = QueueFull("Too many pending deliveries")
+    webhook = Webhook(app, dispatcher=dispatcher)
+
+    # WHEN, THEN
+    with pytest.raises(werkzeug.exceptions.ServiceUnavailable):
+        webhook._postreceive()
+
+
+def test_shutdown_drains_dispatcher(app):
+    # GIVEN
+    dispatcher = mock.Mock()
+    webhook = Webhook(app, dispatcher=dispatcher)
+
+    # WHEN
+    webhook.shutdown(timeout=5)
+
+    # THEN
+    dispatcher.shutdown.assert_called_once_with(wait=True, timeout=5)
+
+
+def test_oversized_request_is_refused(app, push_request):
+    # GIVEN
+    webhook = Webhook(app, max_payload_size=8)
+
+    # WHEN, THEN
+    with pytest.raises(werkzeug.exceptions.RequestEntityTooLarge):
+        webhook._postreceive()
+
+
 # -----------------------------------------------------------------------------
 # Copyright 2015 Bloomberg Finance L.P.
 #
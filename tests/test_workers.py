@@ -0,0 +1,368 @@
+"""Tests for github_webhook.workers"""
+
+import io
+import json
+import os
+import socket
+import threading
+
+import pytest
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from github_webhook.core import WebhookCore, WebhookError
+from github_webhook.dispatch import DispatcherClosed
+from github_webhook.journal import Journal
+from github_webhook.workers import _ACK, _DELIVERY, WorkerFleet, _Connection, main, serve
+
+HEADERS = {"X-Github-Event": "push", "X-Github-Delivery": "72d3162e", "content-type": "application/json"}
+OUTPUT = "WEBHOOK_TEST_WORKERS_OUTPUT"
+
+# The webhook workers import; its hooks record the deliveries they ran in the directory $OUTPUT
+webhook = WebhookCore()
+
+
+@webhook.hook()
+def record(data):
+    directory = os.environ[OUTPUT]
+    if data.get("crash") == "always" or (data.get("crash") == "once" and not os.path.exists(directory + "/crashed")):
+        open(directory + "/crashed", "w").close()
+        os._exit(1)
+    if data.get("fail"):
+        raise RuntimeError("boom")
+    with open(os.path.join(directory, str(data["n"])), "w") as output:
+        output.write(str(os.getpid()))
+    if data.get("journal"):  # as a webhook module building its journal would
+        with open(os.path.join(directory, "journal"), "w") as output:
+            output.write(str(Journal(data["journal"]).read_only))
+
+
+@pytest.fixture
+def output(tmpdir, monkeypatch):
+    monkeypatch.setenv(OUTPUT, str(tmpdir))
+    yield tmpdir
+
+
+def _handle(core, n, **fields):
+    body = json.dumps(dict(fields, n=n)).encode("utf-8")
+    return core.handle(dict(HEADERS, **{"X-Github-Delivery": str(n)}), body)
+
+
+def _ran(output):
+    return sorted(int(name) for name in os.listdir(str(output)) if name.isdigit())
+
+
+def test_hooks_run_in_worker_processes(output):
+    # GIVEN
+    core = WebhookCore(workers=WorkerFleet("tests.test_workers:webhook", workers=2))
+
+    # WHEN
+    results = [_handle(core, n) for n in range(10)]
+    core.shutdown()
+
+    # THEN
+    assert set(result.status for result in results) == {202}
+    assert _ran(output) == list(range(10))
+    pids = set(output.join(str(n)).read() for n in range(10))
+    assert str(os.getpid()) not in pids
+
+
+def test_workers_leave_the_journal_to_the_fleet(output, tmpdir_factory):
+    # GIVEN
+    directory = str(tmpdir_factory.mktemp("journal"))
+    journal = Journal(directory)
+    core = WebhookCore(workers=WorkerFleet("tests.test_workers:webhook", workers=1), journal=journal)
+
+    # WHEN
+    _handle(core, 0, journal=directory)
+    core.shutdown()
+
+    # THEN
+    assert output.join("journal").read() == "True"
+    assert len(journal) == 0
+    assert sorted(os.listdir(directory)) == ["000000000001.journal"]
+    journal.close()
+
+
+def test_deliveries_of_crashed_workers_are_run_again(output, tmpdir_factory, caplog):
+    # GIVEN
+    journal = Journal(str(tmpdir_factory.mktemp("journal")))
+    core = WebhookCore(workers=WorkerFleet("tests.test_workers:webhook", workers=1), journal=journal)
+
+    # WHEN
+    _handle(core, 1, crash="once")
+    _handle(core, 2)
+    core.shutdown()
+
+    # THEN
+    assert _ran(output) == [1, 2]
+    assert len(journal) == 0
+    assert "Lost a worker with" in caplog.text
+
+
+def test_deliveries_are_dropped_after_max_attempts(output, tmpdir_factory, caplog):
+    # GIVEN
+    journal = Journal(str(tmpdir_factory.mktemp("journal")))
+    core = WebhookCore(workers=WorkerFleet("tests.test_workers:webhook", workers=1, max_attempts=2), journal=journal)
+
+    # WHEN
+    _handle(core, 1, crash="always")
+    _handle(core, 2)
+    core.shutdown()
+
+    # THEN
+    assert _ran(output) == [2]
+    assert [entry.headers["x-github-delivery"] for entry in journal.entries()] == ["1"]
+    assert "Dropping a delivery after 2 workers died running it" in caplog.text
+
+
+def test_failed_hooks_are_acknowledged_as_such(output):
+    # GIVEN
+    fleet = WorkerFleet("tests.test_workers:webhook", workers=1)
+    on_complete = mock.Mock(side_effect=[None, RuntimeError("callback")])
+
+    # WHEN
+    fleet.submit(
+        {"x-github-event": "push", "x-github-delivery": "1", "content-type": "application/json"},
+        b'{"fail": true}',
+        on_complete,
+    )
+    fleet.submit(
+        {"x-github-event": "push", "x-github-delivery": "1", "content-type": "application/json"},
+        b'{"n": 1}',
+        on_complete,
+    )
+    fleet.shutdown()
+
+    # THEN
+    assert on_complete.call_args_list == [mock.call(False), mock.call(True)]
+    assert fleet.pending == 0
+
+
+def test_full_fleet_refuses_deliveries(tmpdir_factory):
+    # GIVEN
+    journal = Journal(str(tmpdir_factory.mktemp("journal")))
+    core = WebhookCore(workers=WorkerFleet("tests.test_workers:webhook", workers=1, max_pending=0), journal=journal)
+
+    # WHEN
+    with pytest.raises(WebhookError) as error:
+        _handle(core, 1)
+    core.shutdown()
+
+    # THEN
+    assert error.value.status == 503
+    assert len(journal) == 0
+
+
+def test_closed_fleet_refuses_deliveries():
+    # GIVEN
+    fleet = WorkerFleet("tests.test_workers:webhook", workers=1)
+    fleet.shutdown()
+
+    # WHEN, THEN
+    with pytest.raises(DispatcherClosed):
+        fleet.submit({}, b"{}")
+
+
+def test_shutdown_without_waiting_kills_workers(output):
+    # GIVEN
+    fleet = WorkerFleet("tests.test_workers:webhook", workers=1, socket_path=str(output.join("workers.sock")))
+    fleet.start()
+    fleet.start()
+    fleet.submit({"x-github-event": "push", "x-github-delivery": "1", "content-type": "application/json"}, b'{"n": 1}')
+
+    # WHEN
+    fleet.shutdown(wait=False)
+
+    # THEN
+    assert all(process.poll() is not None for process in fleet._processes)
+
+
+def test_unsigned_deliveries_are_refused_before_reaching_workers():
+    # GIVEN
+    fleet = mock.Mock()
+    core = WebhookCore(secret="secret", workers=fleet)
+
+    # WHEN
+    with pytest.raises(WebhookError):
+        core.handle(dict(HEADERS, **{"X-Hub-Signature-256": "sha256=0"}), b"{}")
+
+    # THEN
+    fleet.submit.assert_not_called()
+
+
+def test_handle_stream_forwards_raw_deliveries():
+    # GIVEN
+    fleet = mock.Mock()
+    core = WebhookCore(workers=fleet)
+
+    # WHEN
+    result = core.handle_stream(dict(HEADERS, **{"Content-Length": "2"}), io.BytesIO(b"{}"))
+
+    # THEN
+    assert result.status == 202
+    headers, body = fleet.submit.call_args[0]
+    assert (headers["x-github-delivery"], bytearray(body)) == ("72d3162e", b"{}")
+
+
+def test_forwarding_releases_the_claim_of_failed_deliveries():
+    # GIVEN
+    fleet = mock.Mock()
+    fleet.submit.side_effect = RuntimeError("boom")
+    dedup = mock.Mock()
+    core = WebhookCore(workers=fleet, dedup=dedup)
+    dedup.__contains__ = mock.Mock(return_value=False)
+
+    # WHEN
+    with pytest.raises(RuntimeError):
+        core.handle(HEADERS, b"{}")
+
+    # THEN
+    dedup.release.assert_called_once_with("72d3162e")
+
+
+def test_serve_runs_hooks_and_acknowledges():
+    # GIVEN
+    core = WebhookCore()
+    handler = mock.Mock(side_effect=[None, RuntimeError("boom")])
+    batch = mock.Mock()
+    core.hook()(handler)
+    core.batch_hook(window=3600)(batch)
+    fleet_end, worker_end = socket.socketpair()
+    headers = json.dumps(
+        {"x-github-event": "push", "x-github-delivery": "1", "content-type": "application/json"}
+    ).encode("utf-8")
+    for seq, body in [(1, b'{"n": 1}'), (2, b'{"n": 2}'), (3, b"not json")]:
+        fleet_end.sendall(_DELIVERY.pack(seq, len(headers), len(body)) + headers + body)
+    fleet_end.shutdown(socket.SHUT_WR)
+
+    # WHEN
+    serve(core, worker_end)
+    core.shutdown()
+
+    # THEN
+    acks = [_ACK.unpack(fleet_end.recv(_ACK.size)) for _ in range(3)]
+    assert acks == [(1, True), (2, False), (3, False)]
+    batch.assert_called_once_with([{"n": 1}])
+
+
+def test_serve_stops_on_truncated_deliveries():
+    # GIVEN
+    fleet_end, worker_end = socket.socketpair()
+    fleet_end.sendall(_DELIVERY.pack(1, 2, 10) + b"{}" + b"trunc")
+    fleet_end.close()
+    core = mock.Mock()
+
+    # WHEN
+    serve(core, worker_end)
+
+    # THEN
+    core._run_verified.assert_not_called()
+
+
+def test_main(tmpdir, output):
+    # GIVEN
+    path = str(tmpdir.join("main.sock"))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    result = []
+    thread = threading.Thread(target=lambda: result.append(main([path, "tests.test_workers:webhook"])))
+    thread.start()
+    connection, _ = listener.accept()
+    headers = json.dumps(
+        {"x-github-event": "push", "x-github-delivery": "1", "content-type": "application/json"}
+    ).encode("utf-8")
+
+    # WHEN
+    connection.sendall(_DELIVERY.pack(7, len(headers), 8) + headers + b'{"n": 3}')
+    ack = _ACK.unpack(connection.recv(_ACK.size))
+    connection.close()
+    thread.join(10)
+    listener.close()
+
+    # THEN
+    assert ack == (7, True)
+    assert result == [0]
+    assert _ran(output) == [3]
+
+
+def test_forwarding_skips_duplicate_deliveries():
+    # GIVEN
+    fleet = mock.Mock()
+    dedup = mock.Mock()
+    dedup.__contains__ = mock.Mock(return_value=False)
+    dedup.claim.return_value = False
+    core = WebhookCore(workers=fleet, dedup=dedup)
+
+    # WHEN
+    result = core.handle(HEADERS, b"{}")
+
+    # THEN
+    assert result.status == 200
+    fleet.submit.assert_not_called()
+
+
+def test_shut_down_fleet_refuses_deliveries(output):
+    # GIVEN
+    fleet = WorkerFleet("tests.test_workers:webhook", workers=1)
+    fleet.start()
+    fleet.shutdown()
+
+    # WHEN, THEN
+    with pytest.raises(DispatcherClosed):
+        fleet.submit({}, b"{}")
+
+
+def test_connections_are_refused_while_stopping():
+    # GIVEN
+    fleet = WorkerFleet("tests.test_workers:webhook", workers=1)
+    sock = mock.Mock()
+    fleet._listener = mock.Mock(accept=mock.Mock(side_effect=[(sock, None), OSError("closed")]))
+    fleet._stopping.set()
+
+    # WHEN
+    fleet._accept()
+
+    # THEN
+    sock.close.assert_called_once_with()
+    assert not fleet._connections
+
+
+def test_deliveries_that_cannot_be_sent_are_requeued(caplog):
+    # GIVEN
+    fleet = WorkerFleet("tests.test_workers:webhook", workers=1)
+    fleet._started = True
+    fleet.submit({}, b"{}")
+    sock = mock.Mock(sendall=mock.Mock(side_effect=OSError("broken pipe")))
+    sock.shutdown.side_effect = OSError("not connected")
+    connection = _Connection(sock)
+
+    # WHEN
+    fleet._send(connection)
+
+    # THEN
+    assert len(fleet._queue) == 1
+    assert fleet._queue[0].attempts == 1
+    assert "Lost a worker with 1 unacknowledged deliveries" in caplog.text
+    sock.close.assert_called_once_with()
+
+
+# -----------------------------------------------------------------------------
+# Copyright 2015 Bloomberg Finance L.P.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ----------------------------- END-OF-FILE -----------------------------------